@@ -2,7 +2,7 @@
 # SPDX-License-Identifier: MIT-0
 
 from flask import Flask
-from flask import abort, jsonify
+from flask import abort, jsonify, request
 from flask_cors import CORS
 
 import json
@@ -46,7 +46,10 @@ def index():
 
 @app.route('/offers')
 def get_offers():
-    return jsonify({'tasks': offers})
+    # The ETag lets clients revalidate their cached copy of the catalog with If-None-Match
+    response = jsonify({'tasks': offers})
+    response.add_etag()
+    return response.make_conditional(request)
 
 
 @app.route('/offers/<offer_id>')
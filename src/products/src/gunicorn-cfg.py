@@ -2,6 +2,8 @@
 # SPDX-License-Identifier: MIT-0
 bind = '0.0.0.0:80'
 workers = 1
+# Threads let other requests be served while personalised descriptions are streamed
+threads = 8
 accesslog = '-'
 loglevel = 'info'
 capture_output = True
@@ -2,11 +2,19 @@
 # SPDX-License-Identifier: MIT-0
 from abc import ABC, abstractmethod
 from flask import current_app
+from typing import Any, Dict, Iterator, Tuple
 import boto3
 import json
 
 bedrock = boto3.client('bedrock-runtime')
 
+MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+
+# The model refuses with a reply starting with an apology ("Sorry") instead of a rewrite.
+# Streamed text is held back until this many characters have arrived without one, so a
+# refusal is not sent to the client.
+REFUSAL_CHECK_CHARS = 60
+
 class Cache(ABC):
 
     @abstractmethod
@@ -85,7 +93,7 @@ def generate_personalised_description(product, user, cache: Cache) -> str:
         
         response = bedrock.invoke_model(
             body=body, 
-            modelId="anthropic.claude-3-haiku-20240307-v1:0",
+            modelId=MODEL_ID,
             accept="application/json", 
             contentType="application/json"
         )
@@ -102,6 +110,78 @@ def generate_personalised_description(product, user, cache: Cache) -> str:
     cache_key = generate_key(user_persona, user_age_range, product['id'])
     return with_cache(cache_key, cache, get_personalised_description)
 
+def stream_personalised_description(product, user, cache: Cache) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yields the personalised description as it is generated by Bedrock.
+
+    Yields ("delta", {"text": ...}) events with each piece of text, followed by one
+    ("done", {"description": ..., "personalised": ..., "cached": ...}) event. A cached
+    description is sent as a single delta. The first pieces are held back until a
+    refusal is ruled out (see REFUSAL_CHECK_CHARS); a refusal sends no deltas. Once the
+    whole description has been generated it is written to the cache, so later requests
+    are served from it.
+    """
+    user_age_range = getAgeRange(user.get('age'))
+    user_persona = user.get('persona')
+    cache_key = generate_key(user_persona, user_age_range, product['id'])
+
+    if current_app.config['CACHE_PERSONALISED_PRODUCTS']:
+        cached_description = cache.get(cache_key)
+        if cached_description:
+            yield "delta", {"text": cached_description}
+            yield "done", {"description": cached_description, "personalised": True, "cached": True}
+            return
+
+    prompt = generate_prompt(product, user_persona, user_age_range)
+    body = create_claude_request(prompt)
+    current_app.logger.debug(f"Generated request:\n{body}")
+
+    response = bedrock.invoke_model_with_response_stream(
+        body=body,
+        modelId=MODEL_ID,
+        accept="application/json",
+        contentType="application/json"
+    )
+
+    parts = []
+    held_back = True
+    for event in response['body']:
+        chunk = event.get('chunk')
+        if not chunk:
+            continue
+        payload = json.loads(chunk['bytes'])
+        if payload.get('type') == 'content_block_delta' and payload['delta'].get('type') == 'text_delta':
+            text = payload['delta']['text']
+            parts.append(text)
+            if not held_back:
+                yield "delta", {"text": text}
+                continue
+
+            response_text = ''.join(parts)
+            if 'Sorry' in response_text:
+                response['body'].close()
+                break
+            if len(response_text) >= REFUSAL_CHECK_CHARS:
+                held_back = False
+                yield "delta", {"text": response_text}
+
+    response_text = ''.join(parts)
+    current_app.logger.debug(f"Response:\n{response_text}")
+
+    # Text sent before a refusal was detected is dropped by the client, which keeps the original description
+    if 'Sorry' in response_text:
+        current_app.logger.info(f"No personalised description can be generated for product: {product['id']}")
+        yield "done", {"description": '', "personalised": False, "cached": False}
+        return
+
+    if held_back and response_text:
+        # A short description that ended before the checks above could pass
+        yield "delta", {"text": response_text}
+
+    if current_app.config['CACHE_PERSONALISED_PRODUCTS']:
+        cache.put(cache_key, response_text)
+
+    yield "done", {"description": response_text, "personalised": True, "cached": False}
+
 def with_cache(cache_key: str, cache: Cache, func):
     if current_app.config['CACHE_PERSONALISED_PRODUCTS']:
         cached_description = cache.get(cache_key)
@@ -6,7 +6,7 @@ from typing import Dict, Any
 import yaml
 
 from products_service import dynamodb
-from products_service.personalisation import generate_personalised_description, Cache
+from products_service.personalisation import generate_personalised_description, stream_personalised_description, Cache
 
 MAX_BATCH_GET_ITEM = 100
 ALLOWED_PRODUCT_KEYS = {
@@ -44,6 +44,10 @@ def get_product_by_id(product_id, fully_qualify_image_urls: bool | None = None,
 
     return product
 
+def stream_product_description(product, user: Dict[str, Any]):
+    current_app.logger.debug(f"Streaming personalized product description for product: {product['name']}")
+    return stream_personalised_description(product, user, PersonalisedDescriptionCache())
+
 def get_products_by_ids(product_ids, fully_qualify_image_urls: bool):
     if len(product_ids) > MAX_BATCH_GET_ITEM:
         raise Exception("Cannot query more than 100 items at a time")
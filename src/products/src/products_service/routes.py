@@ -1,7 +1,7 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 from decimal import Decimal
-from flask import jsonify, request, Response, current_app, Blueprint
+from flask import jsonify, request, Response, current_app, Blueprint, stream_with_context
 from flask_cors import CORS
 from werkzeug.exceptions import BadRequest, UnsupportedMediaType, NotFound, Unauthorized
 from botocore.exceptions import BotoCoreError
@@ -56,6 +56,40 @@ def get_products_by_id(product_ids):
 
     return jsonify(product), 200
 
+@api.route('/products/id/<product_id>/description/stream', methods=['GET'])
+def stream_personalised_description(product_id):
+    """Streams the product's description personalised for the user as server-sent events.
+
+    A "product" event with the product (and its original description) is sent as soon as it
+    is loaded, then "delta" events with the personalised text as Bedrock generates it and a
+    final "done" event. If generation fails part way an "error" event is sent instead.
+    """
+    cognito_authentication_provider = request.headers.get('cognitoAuthenticationProvider')
+    if not cognito_authentication_provider:
+        raise Unauthorized
+    user = auth.auth_user(cognito_authentication_provider)
+
+    product = product_service.get_product_by_id(product_id, should_fully_qualify_image_urls())
+    if not product:
+        raise NotFound
+
+    def generate():
+        yield server_sent_event("product", product)
+        try:
+            for event, data in product_service.stream_product_description(product, user):
+                yield server_sent_event(event, data)
+        except Exception as e:
+            # The response has started so the error can only be reported in the stream
+            current_app.logger.error(f'Error streaming personalised description for product {product_id}: {str(e)}')
+            yield server_sent_event("error", {"error": "Personalised description could not be generated"})
+
+    headers = {
+        'Cache-Control': 'no-cache',
+        # Stops proxies that buffer responses from holding back the events
+        'X-Accel-Buffering': 'no'
+    }
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
 @api.route('/products/id/<product_id>', methods=['PUT'])
 def update_products_by_id(product_id):
     product = request.get_json(force=True)
@@ -124,6 +158,9 @@ def should_fully_qualify_image_urls() -> bool:
     param = request.args.get("fullyQualifyimageUrls", "1")
     return param.lower() in ["1", "true"]
         
+def server_sent_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=custom_serializer)}\n\n"
+
 def custom_serializer(obj):
     if isinstance(obj, Decimal):
         return float(obj)
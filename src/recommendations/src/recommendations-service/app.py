@@ -4,34 +4,82 @@
 # AWS X-ray support
 from aws_xray_sdk.core import xray_recorder
 from aws_xray_sdk.ext.flask.middleware import XRayMiddleware
-from aws_xray_sdk.core import patch_all
+from aws_xray_sdk.core import patch, patch_all
 
 
-from typing import Dict, List, Tuple, Union
-from flask import Flask, jsonify, Response
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple, Union
+from flask import Flask, jsonify, Response, stream_with_context
 from flask import request
 
 from flask_cors import CORS
 from experimentation.experiment_manager import ExperimentManager
+from experimentation.experiment_mab import MultiArmedBanditExperiment
+from experimentation.features import FEATURE_HOME_PRODUCT_RECS, FEATURE_HOME_PRODUCT_RECS_COLD, FEATURE_HOME_FEATURED_RERANK
 from experimentation.resolvers import DefaultProductResolver, PersonalizeRecommendationsResolver, \
-    PersonalizeRankingResolver, RankingProductsNoOpResolver, PersonalizeContextComparePickResolver, RandomPickResolver
+    PersonalizeRankingResolver, RankingProductsNoOpResolver, PersonalizeContextComparePickResolver, RandomPickResolver, \
+    LocalCollaborativeFilteringResolver, PrecomputedResolver, personalize_breaker, call_personalize
+from experimentation.recommendation_store import recommendation_stores
+from experimentation.aws_clients import aws_clients
+from experimentation.caching import InvalidatableCache, SharedInvalidations, TTLDict
+from experimentation import local_model
 from experimentation.utils import CompatEncoder
-from expiring_dict import ExpiringDict
-
+from experimentation.parameters import parameter_cache
+from experimentation.discovery import service_discovery
+from experimentation.product_cache import ProductCache
+from experimentation.http_client import http_client
+from experimentation.concurrency import run_concurrently, run_windowed
+from experimentation.coalescing import SingleFlight, make_key
+from experimentation.user_cache import UserResultCache
+from experimentation.offer_catalog import OfferCatalog, score_offers
+from experimentation.deadline import DeadlineExceededError
+from experimentation.circuit_breaker import CircuitOpenError
+from experimentation import deadline
+from experimentation.metrics import render_counters, render_gauges, render_histograms
+from experimentation.tracking import BufferedKinesisTracker
+from experimentation.counters import variation_counters
+from experimentation import timing
+
+import hmac
 import json
 import os
 import pprint
-import boto3
 import requests
 import random
 import logging
+import time
 from datetime import datetime
 
-# X-ray setup
-patch_all()
+# X-ray setup. Only the libraries the service calls AWS and the other services with are
+# patched by default; patch_all() imports and instruments every supported library it finds,
+# which slows down start up. Set XRAY_PATCH_MODULES=all to restore that behavior.
+XRAY_PATCH_MODULES = os.environ.get('XRAY_PATCH_MODULES', 'botocore,requests')
+if XRAY_PATCH_MODULES == 'all':
+    patch_all()
+else:
+    patch([module.strip() for module in XRAY_PATCH_MODULES.split(',') if module.strip()])
 
 NUM_DISCOUNTS = 2
 
+# Maximum number of product IDs requested from the products service in one call
+PRODUCT_FETCH_BATCH_SIZE = 100
+
+# Limits for POST /recommendations/batch
+BATCH_MAX_USERS = int(os.environ.get('BATCH_MAX_USERS', 1000))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 16))
+
+# Maximum number of correlation IDs accepted by POST /experiment/outcome/batch
+BATCH_MAX_OUTCOMES = int(os.environ.get('BATCH_MAX_OUTCOMES', 1000))
+
+# Directory of a model built with experimentation/local_model.py. When set, the model serves
+# user and related item recommendations if Personalize is not configured or is unavailable.
+LOCAL_MODEL_PATH = os.environ.get('LOCAL_MODEL_PATH')
+
+# Features that tolerate stale recommendations and are served from a store written offline
+# with experimentation/recommendation_store.py, e.g. "home_product_recs_cold=/data/popular.rds"
+PRECOMPUTED_STORES = dict(entry.strip().split('=', 1) for entry in os.environ.get('PRECOMPUTED_STORES', '').split(',')
+                          if '=' in entry)
+
 EXPERIMENTATION_LOGGING = True
 DEBUG_LOGGING = True
 
@@ -40,15 +88,69 @@ random.seed(42)  # Keep our demonstration deterministic
 # Since the DescribeRecommender/DescribeCampaign APIs easily throttles and we just
 # need the recipe from the recommender/campaign and it won't change often (if at all),
 # use a cache to help smooth out periods where we get throttled.
-personalize_meta_cache = ExpiringDict(2 * 60 * 60)
-
-servicediscovery = boto3.client('servicediscovery')
-personalize = boto3.client('personalize')
-personalize_runtime = boto3.client('personalize-runtime')
-ssm = boto3.client('ssm')
-codepipeline = boto3.client('codepipeline')
-sts = boto3.client('sts')
-cw_events = boto3.client('events')
+personalize_meta_cache = TTLDict(2 * 60 * 60)
+
+# Clients are created on first use; runtime calls go through call_personalize
+personalize = aws_clients.client('personalize')
+
+# Product documents used to hydrate recommendations change rarely, so keep recently
+# used products in memory and only ask the products service for cache misses.
+product_cache = ProductCache(
+    max_size = int(os.environ.get('PRODUCT_CACHE_SIZE', 5000)),
+    ttl = float(os.environ.get('PRODUCT_CACHE_TTL', 300))
+)
+
+# Identical concurrent (and very recent) product and ranking lookups share one computation
+products_flight = SingleFlight(
+    ttl = float(os.environ.get('COALESCE_TTL', 2.0)),
+    max_size = int(os.environ.get('COALESCE_MAX_SIZE', 1000))
+)
+ranking_flight = SingleFlight(
+    ttl = float(os.environ.get('COALESCE_TTL', 2.0)),
+    max_size = int(os.environ.get('COALESCE_MAX_SIZE', 1000))
+)
+
+# Recommendations for a user rarely change within a session, so resolved items are cached per
+# user until they expire or an event (purchase, cart change, experiment outcome) invalidates them.
+# Invalidations reach the caches of all the gunicorn worker processes.
+user_results = UserResultCache(
+    max_bytes = int(os.environ.get('USER_RESULT_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+    ttl = float(os.environ.get('USER_RESULT_CACHE_TTL', 60)),
+    max_stale = float(os.environ.get('USER_RESULT_CACHE_MAX_STALE', 600)),
+    shared_invalidations = SharedInvalidations()
+)
+
+# The offers catalog is revalidated with the offers service (ETag) once it is older than the TTL
+offers_catalog = OfferCatalog(
+    ttl = float(os.environ.get('OFFERS_CATALOG_TTL', 30)),
+    max_stale = float(os.environ.get('OFFERS_CATALOG_MAX_STALE', 600))
+)
+
+# Event types that change a user's recommendations (e.g. through the purchased items filter)
+INVALIDATING_EVENT_TYPES = ('Purchase', 'AddToCart', 'UpdateQuantity', 'StartCheckout')
+
+# Caches that can be inspected and invalidated through the /admin/caches endpoints
+caches: Dict[str, InvalidatableCache] = {
+    'parameters': parameter_cache,
+    'discovery': service_discovery,
+    'products': product_cache,
+    'experiments': ExperimentManager(),
+    'coalesced_products': products_flight,
+    'coalesced_rankings': ranking_flight,
+    'user_results': user_results,
+    'precomputed_stores': recommendation_stores,
+    'offers': offers_catalog
+}
+
+# Bearer token required by the /admin endpoints ("Authorization: Bearer <token>"); they are
+# not served at all when no token is configured
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Invalidations through /admin/caches are applied by the other worker processes on their next
+# request (see apply_shared_cache_invalidations), keyed by cache name
+cache_invalidations = SharedInvalidations(slots = 64)
+# Time of the last shared invalidation applied to each cache by this process
+cache_invalidations_applied = {}
 
 # SSM parameter name for the Personalize filter for purchased and c-store items
 filter_purchased_param_name = '/retaildemostore/personalize/filters/filter-purchased-arn'
@@ -59,8 +161,59 @@ promotion_filter_param_name = '/retaildemostore/personalize/filters/promoted-ite
 promotion_filter_no_cstore_param_name = '/retaildemostore/personalize/filters/promoted-items-no-cstore-filter-arn'
 offers_arn_param_name = '/retaildemostore/personalize/personalized-offers-arn'
 
+# Local model filters equivalent to the Personalize filter behind each SSM parameter
+local_model_filters = {
+    filter_purchased_param_name: [local_model.FILTER_EXCLUDE_PURCHASED],
+    filter_cstore_param_name: [local_model.FILTER_CSTORE_ONLY],
+    filter_purchased_cstore_param_name: [local_model.FILTER_EXCLUDE_PURCHASED, local_model.FILTER_EXCLUDE_CSTORE],
+    filter_include_categories_param_name: [local_model.FILTER_SAME_CATEGORIES]
+}
+
+# Response header set when a cheaper fallback was used instead of the configured resolver
+DEGRADED_HEADER = 'X-Recommendations-Degraded'
+
+# Widgets rendered by /home and the experiment feature and SSM parameters each one uses
+HOME_WIDGET_RECOMMENDATIONS = 'recommendations'
+HOME_WIDGET_POPULAR = 'popular'
+HOME_WIDGET_FEATURED = 'featured'
+
+home_widgets = {
+    HOME_WIDGET_RECOMMENDATIONS: {
+        'feature': FEATURE_HOME_PRODUCT_RECS,
+        'inference_arn_param_name': '/retaildemostore/personalize/recommended-for-you-arn',
+        'filter_arn_param_name': filter_purchased_param_name,
+        'promotion_filter_param_name': promotion_filter_param_name
+    },
+    HOME_WIDGET_POPULAR: {
+        'feature': FEATURE_HOME_PRODUCT_RECS_COLD,
+        'inference_arn_param_name': '/retaildemostore/personalize/popular-items-arn',
+        'filter_arn_param_name': filter_purchased_cstore_param_name,
+        'promotion_filter_param_name': promotion_filter_no_cstore_param_name
+    },
+    HOME_WIDGET_FEATURED: {
+        'feature': FEATURE_HOME_FEATURED_RERANK,
+        'inference_arn_param_name': '/retaildemostore/personalize/personalized-ranking-arn',
+        # Read by get_default_ranking
+        'filter_arn_param_name': filter_purchased_param_name
+    }
+}
+
+# SSM parameter values read once for a request that resolves several lists (e.g. /home)
+parameter_snapshot: ContextVar[Optional[Dict[str, str]]] = ContextVar('parameter_snapshot', default = None)
+
 # -- Shared Functions
 
+def degradation_reason(e: Exception) -> str:
+    """ Returns a short reason for the degradation header given the error that caused it """
+    if isinstance(e, DeadlineExceededError):
+        return 'deadline'
+    if isinstance(e, CircuitOpenError):
+        return 'circuit-open'
+    if isinstance(e, TimeoutError):
+        return 'timeout'
+    return 'error'
+
+@timing.timed('recipe')
 def get_recipe(arn):
     """ Returns the Amazon Personalize recipe ARN for the specified campaign/recommender ARN """
     recipe = None
@@ -97,28 +250,21 @@ def get_recipe(arn):
 
     return recipe
 
+@timing.timed('ssm')
 def get_parameter_values(names):
-    """ Returns values for SSM parameters or None for params that don't exist or that have value equal 'NONE' """
+    """ Returns values for SSM parameters or None for params that don't exist or that have value equal 'NONE'
+
+    Values are served from the process-wide parameter cache, which refreshes them in the background,
+    or from the request's parameter snapshot so that all lists of a request see the same values.
+    """
     if isinstance(names, str):
         names = [ names ]
 
-    response = ssm.get_parameters(Names = names)
-
-    values = []
-
-    for name in names:
-        found = False
-        for param in response['Parameters']:
-            if param['Name'] == name:
-                found = True
-                if param['Value'] != 'NONE':
-                    values.append(param['Value'])
-                else:
-                    values.append(None)
-                break
+    snapshot = parameter_snapshot.get()
+    if snapshot is not None and all(name in snapshot for name in names):
+        return [snapshot[name] for name in names]
 
-        if not found:
-            values.append(None)
+    values = [value if value != 'NONE' else None for value in parameter_cache.get_values(names)]
 
     assert len(values) == len(names), 'mismatch in number of values returned for names'
 
@@ -148,34 +294,64 @@ def get_products_service_host_and_port() -> Tuple[str, int]:
 
     if not products_service_host:
         # Get product service instance. We'll need it rehydrate product info for recommendations.
-        response = servicediscovery.discover_instances(
-            NamespaceName='retaildemostore.local',
-            ServiceName='products',
-            MaxResults=1,
-            HealthStatus='HEALTHY'
-        )
-
-        products_service_host = response['Instances'][0]['Attributes']['AWS_INSTANCE_IPV4']
+        # Instances are cached and balanced across all healthy instances by the shared discovery client.
+        products_service_host = service_discovery.get_host('products')
 
     return products_service_host, products_service_port
 
+@timing.timed('hydrate')
 def fetch_product_details(item_ids: Union[str, List[str]], fully_qualify_image_urls=False) -> List[Dict]:
-    """ Fetches details for one or more products from the products service """
-    products_service_host, products_service_port = get_products_service_host_and_port()
+    """ Fetches details for one or more products, calling the products service only for products not already cached """
+    if isinstance(item_ids, str):
+        item_ids = item_ids.split(',')
 
-    item_ids_csv = item_ids if isinstance(item_ids, str) else ','.join(item_ids)
+    products_by_id, missing_ids = product_cache.get_many(item_ids, fully_qualify_image_urls)
 
-    url = f'http://{products_service_host}:{products_service_port}/products/id/{item_ids_csv}?fullyQualifyImageUrls={fully_qualify_image_urls}'
-    app.logger.debug(f"Asking for product info from {url}")
+    if missing_ids:
+        products_service_host, products_service_port = get_products_service_host_and_port()
 
-    products = []
+        # Keep request URLs to a reasonable length when hydrating large (e.g. batch) item lists
+        for i in range(0, len(missing_ids), PRODUCT_FETCH_BATCH_SIZE):
+            item_ids_csv = ','.join(missing_ids[i:i + PRODUCT_FETCH_BATCH_SIZE])
 
-    response = requests.get(url)
-    if response.ok:
-        products = response.json()
-        if not isinstance(products, list):
-            products = [ products ]
+            url = f'http://{products_service_host}:{products_service_port}/products/id/{item_ids_csv}?fullyQualifyImageUrls={fully_qualify_image_urls}'
+            app.logger.debug(f"Asking for product info from {url}")
 
+            start = time.perf_counter()
+            try:
+                response = http_client.get(url)
+            except requests.ConnectionError:
+                service_discovery.evict('products', products_service_host)
+                raise
+            product_cache.record_fetch(time.perf_counter() - start)
+
+            if response.ok:
+                fetched = response.json()
+                if not isinstance(fetched, list):
+                    fetched = [ fetched ]
+
+                product_cache.put_many(fetched, fully_qualify_image_urls)
+                for product in fetched:
+                    products_by_id[product['id']] = product
+
+    return [products_by_id[item_id] for item_id in item_ids if item_id in products_by_id]
+
+def fetch_featured_products(fully_qualify_image_urls=False) -> List[Dict]:
+    """ Returns the featured products from the products service """
+    products_service_host, products_service_port = get_products_service_host_and_port()
+    url = f'http://{products_service_host}:{products_service_port}/products/featured?fullyQualifyImageUrls={fully_qualify_image_urls}'
+
+    try:
+        response = http_client.get(url)
+    except requests.ConnectionError:
+        service_discovery.evict('products', products_service_host)
+        raise
+
+    if not response.ok:
+        raise Exception(f'Error calling products service: {response.status_code}: {response.reason}')
+
+    products = response.json()
+    product_cache.put_many(products, fully_qualify_image_urls)
     return products
 
 def get_products(feature, user_id, current_item_id, num_results, default_inference_arn_param_name,
@@ -184,6 +360,48 @@ def get_products(feature, user_id, current_item_id, num_results, default_inferen
                  ):
     """ Returns products given a UI feature, user, item/product.
 
+    Resolves the recommended items (see resolve_items) and hydrates them with product details.
+    Identical concurrent or recent calls share one result unless an experiment may be involved.
+    Returns:
+        The hydrated items and the response headers describing how they were resolved.
+    """
+    timestamp = get_timestamp_from_request()
+
+    def compute():
+        items, resp_headers = resolve_items(
+            feature = feature,
+            user_id = user_id,
+            current_item_id = current_item_id,
+            num_results = num_results,
+            default_inference_arn_param_name = default_inference_arn_param_name,
+            default_filter_arn_param_name = default_filter_arn_param_name,
+            filter_values = filter_values,
+            related_items_recipe = related_items_recipe,
+            fully_qualify_image_urls = fully_qualify_image_urls,
+            promotion = promotion,
+            timestamp = timestamp
+        )
+
+        products = fetch_product_details([item['itemId'] for item in items], fully_qualify_image_urls)
+        hydrate_items(items, {product['id']: product for product in products})
+
+        return items, resp_headers
+
+    if feature and user_id:
+        # Experiments log an exposure and a correlation ID per call, so these calls are never shared
+        return compute()
+
+    key = make_key(feature, user_id, current_item_id, num_results, default_inference_arn_param_name, default_filter_arn_param_name,
+                   filter_values, related_items_recipe, fully_qualify_image_urls, promotion)
+    return products_flight.do(key, compute,
+                              cacheable = lambda result: 'X-Experiment-Id' not in result[1] and DEGRADED_HEADER not in result[1])
+
+def resolve_items(feature, user_id, current_item_id, num_results, default_inference_arn_param_name,
+                  default_filter_arn_param_name, filter_values=None, related_items_recipe=False, fully_qualify_image_urls=False,
+                  promotion: Dict = None, timestamp: datetime = None, variation_index: int = None
+                  ):
+    """ Returns recommended item IDs given a UI feature, user, item/product.
+
     If a feature name is provided and there is an active experiment for the
     feature, the experiment will be used to retrieve products. Otherwise,
     the default behavior will be used which will look to see if an Amazon Personalize
@@ -200,10 +418,13 @@ def get_products(feature, user_id, current_item_id, num_results, default_inferen
         related_items_recipe: If campaign/recommender is for related items use case (i.e, whether user_id is required or not)
         fully_qualify_image_urls: Fully qualify image URLs n here
         promotion: Personalize promotional filter configuration
+        timestamp: Time of the request, passed to experiments
+        variation_index: Variation assigned up front by a multi-armed bandit experiment (batch requests)
     Returns:
-        A prepared HTTP response object.
+        The items (dicts with an 'itemId' and, for experiments, 'experiment') and response headers.
     """
 
+    started = time.monotonic()
     items = []
     resp_headers = {}
     experiment = None
@@ -212,25 +433,48 @@ def get_products(feature, user_id, current_item_id, num_results, default_inferen
     # Get active experiment if one is setup for feature and we have a user.
     if feature and user_id:
         exp_manager = ExperimentManager()
-        experiment = exp_manager.get_active(feature, user_id)
+        with timing.stage('experiment'):
+            experiment = exp_manager.get_active(feature, user_id)
+
+    # Results for a user are served from the per-user cache when no experiment is active for the
+    # feature. Experiment results are never cached so every exposure is assigned, tracked and
+    # correlated by the experiment, including for users with results cached before it started.
+    cache_key = None
+    if user_id and not experiment:
+        cache_key = make_key(feature, default_filter_arn_param_name, current_item_id, num_results,
+                             default_inference_arn_param_name, filter_values, related_items_recipe, promotion)
+        cached = user_results.get(user_id, cache_key)
+        if cached is not None:
+            return cached
 
     if experiment:
         # Get items from experiment.
         tracker = exp_manager.default_tracker()
 
-        items = experiment.get_items(
-            user_id = user_id,
-            current_item_id = current_item_id,
-            num_results = num_results,
-            tracker = tracker,
-            filter_values = filter_values,
-            timestamp = get_timestamp_from_request(),
-            promotion = promotion
-        )
+        experiment_args = {}
+        if variation_index is not None and isinstance(experiment, MultiArmedBanditExperiment):
+            experiment_args['variation_index'] = variation_index
+
+        try:
+            with timing.stage('experiment_items'):
+                items = experiment.get_items(
+                    user_id = user_id,
+                    current_item_id = current_item_id,
+                    num_results = num_results,
+                    tracker = tracker,
+                    filter_values = filter_values,
+                    timestamp = timestamp,
+                    promotion = promotion,
+                    **experiment_args
+                )
 
-        resp_headers['X-Experiment-Name'] = experiment.name
-        resp_headers['X-Experiment-Type'] = experiment.type
-        resp_headers['X-Experiment-Id'] = experiment.id
+            resp_headers['X-Experiment-Name'] = experiment.name
+            resp_headers['X-Experiment-Type'] = experiment.type
+            resp_headers['X-Experiment-Id'] = experiment.id
+        except Exception as e:
+            # Serve the default recommendations below rather than failing the request
+            logger.warning(f'Experiment {experiment.name} could not provide items: {e}')
+            resp_headers[DEGRADED_HEADER] = f'{degradation_reason(e)}; source=experiment'
 
     elif related_items_recipe:
         # No experiment but is related items use case. Check if seed item already has related items and
@@ -245,6 +489,21 @@ def get_products(feature, user_id, current_item_id, num_results, default_inferen
             # Currently only similar-items is supported by content generator (subject to change)
             resp_headers["X-Personalize-Recipe"] = "arn:aws:personalize:::recipe/aws-similar-items"
 
+    if len(items) == 0 and feature in PRECOMPUTED_STORES and not filter_values:
+        # Served without calling Personalize only when the store's recommendations were made with
+        # exactly the filter this feature uses (a store built without --filter only serves features
+        # without a filter). Filter values are given at inference so cannot be precomputed.
+        resolver = PrecomputedResolver(store_path = PRECOMPUTED_STORES[feature])
+        store_metadata = resolver.store.metadata
+        if store_metadata and store_metadata.get('filter') == default_filter_arn_param_name:
+            try:
+                with timing.stage('precomputed'):
+                    items = resolver.get_items(user_id = user_id, product_id = current_item_id, num_results = num_results)
+                if items and store_metadata.get('recipe'):
+                    resp_headers['X-Personalize-Recipe'] = store_metadata['recipe']
+            except Exception as e:
+                logger.warning(f'get_products: precomputed store {resolver.store_path} unavailable ({e})')
+
     if len(items) == 0:
         # Fallback to default behavior of checking for campaign/recommender ARN parameter and
         # then the default product resolver.
@@ -253,35 +512,83 @@ def get_products(feature, user_id, current_item_id, num_results, default_inferen
         inference_arn = values[0]
         filter_arn = values[1]
 
-        if inference_arn and (user_id or related_items_recipe):
+        use_default_resolver = not (inference_arn and (user_id or related_items_recipe))
+        degraded_reason = None
+        fallback = 'products'
+
+        if not use_default_resolver:
 
             logger.info(f"get_products: Supplied campaign/recommender: {inference_arn} (from {default_inference_arn_param_name}) Supplied filter: {filter_arn} (from {default_filter_arn_param_name}) Supplied user: {user_id}")
 
             resolver = PersonalizeRecommendationsResolver(inference_arn = inference_arn, filter_arn = filter_arn)
 
-            items = resolver.get_items(
-                user_id = user_id,
-                product_id = current_item_id,
-                num_results = num_results,
-                filter_values = filter_values,
-                promotion = promotion
-            )
+            try:
+                with timing.stage('personalize'):
+                    items = resolver.get_items(
+                        user_id = user_id,
+                        product_id = current_item_id,
+                        num_results = num_results,
+                        filter_values = filter_values,
+                        promotion = promotion
+                    )
 
-            resp_headers['X-Personalize-Recipe'] = get_recipe(inference_arn)
-        else:
+                resp_headers['X-Personalize-Recipe'] = get_recipe(inference_arn)
+            except Exception as e:
+                # Personalize is slow, failing or out of budget; fall back to cheaper sources.
+                logger.warning(f'get_products: Personalize unavailable ({e}); degrading')
+                reason = degradation_reason(e)
+
+                stale = user_results.get(user_id, cache_key, allow_stale = True) if cache_key is not None else None
+                if stale is not None:
+                    items, resp_headers = stale
+                    resp_headers[DEGRADED_HEADER] = f'{reason}; fallback=cache'
+                    return items, resp_headers
+
+                degraded_reason = reason
+                use_default_resolver = True
+
+        if use_default_resolver and LOCAL_MODEL_PATH and (user_id or related_items_recipe):
+            # Score with the local model before falling back to non-personalized products
+            resolver = LocalCollaborativeFilteringResolver(model_path = LOCAL_MODEL_PATH,
+                                                           filters = local_model_filters.get(default_filter_arn_param_name))
+            try:
+                with timing.stage('local_model'):
+                    items = resolver.get_items(user_id = user_id, product_id = current_item_id, num_results = num_results)
+                if items:
+                    use_default_resolver = False
+                    fallback = 'local-model'
+            except Exception as e:
+                logger.warning(f'get_products: local model unavailable ({e})')
+
+        if use_default_resolver:
             products_service_host, products_service_port = get_products_service_host_and_port()
             resolver = DefaultProductResolver(products_service_host = products_service_host, products_service_port = products_service_port)
 
-            items = resolver.get_items(product_id = current_item_id, num_results = num_results)
+            with timing.stage('products'):
+                items = resolver.get_items(product_id = current_item_id, num_results = num_results)
+
+        if degraded_reason:
+            resp_headers[DEGRADED_HEADER] = f'{degraded_reason}; fallback={fallback}'
+
+    # Experiment results are per exposure and degraded results should not outlive the outage
+    if cache_key is not None and 'X-Experiment-Id' not in resp_headers and DEGRADED_HEADER not in resp_headers:
+        user_results.put(user_id, cache_key, (items, resp_headers), computed_at = started)
+
+    return items, resp_headers
 
-    item_ids = [item['itemId'] for item in items]
+def hydrate_items(items: List[Dict], products_by_id: Dict[str, Dict]) -> List[Dict]:
+    """ Replaces each item's 'itemId' with its product from products_by_id
 
-    products = fetch_product_details(item_ids, fully_qualify_image_urls)
+    Products can be shared by several lists (e.g. a batch), so a product is copied
+    before the experiment correlation ID is appended to its URL.
+    """
     for item in items:
         item_id = item['itemId']
 
-        product = next((p for p in products if p['id'] == item_id), None)
+        product = products_by_id.get(item_id)
         if product is not None and 'experiment' in item and 'url' in product:
+            product = dict(product)
+
             # Append the experiment correlation ID to the product URL so it gets tracked if used by client.
             product_url = product.get('url')
             if '?' in product_url:
@@ -299,10 +606,16 @@ def get_products(feature, user_id, current_item_id, num_results, default_inferen
 
         item.pop('itemId')
 
-    return items, resp_headers
+    return items
 
 # -- Logging
 class LoggingMiddleware(object):
+    """ Pretty prints every request's WSGI environ and response headers (development only)
+
+    Formatting the whole environ on every request costs far more than serving most
+    requests, so it is only installed by the development server or, under gunicorn,
+    when LOG_REQUESTS is set.
+    """
     def __init__(self, app):
         self._app = app
 
@@ -338,11 +651,50 @@ class BadRequest(Exception):
 
 app = Flask(__name__)
 logger = app.logger
-corps = CORS(app, expose_headers=['X-Experiment-Name', 'X-Experiment-Type', 'X-Experiment-Id', 'X-Personalize-Recipe'])
+corps = CORS(app, expose_headers=['X-Experiment-Name', 'X-Experiment-Type', 'X-Experiment-Id', 'X-Personalize-Recipe', 'Server-Timing', DEGRADED_HEADER])
 
 xray_recorder.configure(service='Recommendations Service')
 XRayMiddleware(app, xray_recorder)
 
+@app.before_request
+def start_request_timing():
+    timing.start_request()
+    deadline.start()
+
+@app.before_request
+def require_admin_token():
+    """ Rejects requests to the /admin endpoints that do not present ADMIN_TOKEN """
+    if not request.path.startswith('/admin/') and request.path != '/admin':
+        return
+    if not ADMIN_TOKEN:
+        raise BadRequest('Not found', status_code = 404)
+    authorization = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(authorization.encode('utf-8'), f'Bearer {ADMIN_TOKEN}'.encode('utf-8')):
+        raise BadRequest('Unauthorized', status_code = 401)
+
+@app.before_request
+def apply_shared_cache_invalidations():
+    """ Invalidates the caches that another worker process invalidated through /admin/caches """
+    for name, cache in caches.items():
+        invalidated_at = cache_invalidations.invalidated_at(name)
+        if invalidated_at > cache_invalidations_applied.get(name, 0.0):
+            cache_invalidations_applied[name] = invalidated_at
+            cache.invalidate(None)
+
+@app.after_request
+def add_server_timing(response):
+    """ Records the request's stage timings and returns them to the caller in a Server-Timing header """
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    timings = timing.finish_request(route, request.method, response.status_code)
+    if timings is not None:
+        response.headers['Server-Timing'] = timings.server_timing(total = timings.elapsed())
+    return response
+
+@app.teardown_request
+def clear_deadline(error = None):
+    """ Clears the request's deadline so it does not apply to later work on the same thread """
+    deadline.clear()
+
 @app.errorhandler(BadRequest)
 def handle_bad_request(error):
     response = jsonify(error.to_dict())
@@ -357,6 +709,99 @@ def index():
 def health():
     return 'OK'
 
+@app.route('/admin/caches', methods=['GET'])
+def cache_stats():
+    """ Returns hit/miss counters for the in-process caches """
+    return jsonify({name: cache.stats() for name, cache in caches.items()})
+
+@app.route('/admin/caches/<name>/invalidate', methods=['POST'])
+def invalidate_cache(name):
+    """ Invalidates all entries of a cache or only the keys listed in the JSON body ({"keys": [...]}) """
+    cache = caches.get(name)
+    if not cache:
+        raise BadRequest(f'Unknown cache {name}', status_code = 404)
+
+    keys = None
+    content = request.get_json(silent = True)
+    if content:
+        keys = content.get('keys')
+        if keys is not None and not isinstance(keys, list):
+            raise BadRequest('keys must be a list')
+
+    removed = cache.invalidate(keys)
+
+    # The user results cache shares its invalidations itself. Other workers drop all entries of
+    # the other caches, since only the name of the cache is shared.
+    if getattr(cache, 'shared_invalidations', None) is None:
+        cache_invalidations.invalidate(name)
+        cache_invalidations_applied[name] = cache_invalidations.invalidated_at(name)
+
+    return jsonify(success = True, invalidated = removed)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """ Returns request, stage and outbound HTTP latency histograms and coalescing counters in the Prometheus text format """
+    lines = timing.render_metrics()
+    lines += render_histograms(
+        'recommendations_http_client_duration_seconds',
+        'Latency of calls to other services',
+        ('host',),
+        [((host,), histogram) for host, histogram in http_client.histograms().items()]
+    )
+    lines += render_counters(
+        'recommendations_coalesced_calls_total',
+        'Product and ranking lookups by whether they executed, joined an in-flight call or reused a recent result',
+        ('scope', 'outcome'),
+        [((scope, outcome), flight.stats()[outcome])
+            for scope, flight in (('products', products_flight), ('ranking', ranking_flight))
+            for outcome in ('executions', 'coalesced', 'cache_hits', 'errors')]
+    )
+    breaker = personalize_breaker.stats()
+    lines += render_counters(
+        'recommendations_personalize_breaker_total',
+        'Personalize calls by outcome as seen by the circuit breaker',
+        ('outcome',),
+        [((outcome,), breaker[outcome]) for outcome in ('successes', 'failures', 'rejected', 'opened')]
+    )
+    experiment_counters = variation_counters.stats()
+    lines += render_counters(
+        'recommendations_experiment_counter_writes_total',
+        'Experiment exposure and conversion counter writes to DynamoDB by outcome',
+        ('outcome',),
+        [((outcome,), experiment_counters[outcome]) for outcome in ('writes', 'write_errors', 'dropped_writes')]
+    )
+    lines += render_gauges(
+        'recommendations_experiment_counter_pending_increments',
+        'Experiment counter increments buffered in memory and not yet written to DynamoDB',
+        (),
+        [((), experiment_counters['pending'])]
+    )
+    trackers = [(stream_name, tracker.stats()) for stream_name, tracker in ExperimentManager().trackers().items()
+                if isinstance(tracker, BufferedKinesisTracker)]
+    lines += render_counters(
+        'recommendations_experiment_tracker_events_total',
+        'Experiment exposure and outcome events by what the buffered Kinesis tracker did with them',
+        ('stream', 'outcome'),
+        [((stream_name, outcome), stats[outcome])
+            for stream_name, stats in trackers
+            for outcome in ('enqueued', 'dropped', 'sent', 'failed', 'retried')]
+    )
+    lines += render_gauges(
+        'recommendations_experiment_tracker_queue_depth',
+        'Events waiting to be sent by the buffered Kinesis tracker',
+        ('stream',),
+        [((stream_name,), stats['queue_depth']) for stream_name, stats in trackers]
+    )
+    lines += render_gauges(
+        'recommendations_experiment_tracker_flush_latency_seconds',
+        'Average and maximum time taken to send a batch of events to Kinesis',
+        ('stream', 'statistic'),
+        [((stream_name, statistic), stats[f'flush_latency_{statistic}_ms'] / 1000)
+            for stream_name, stats in trackers
+            for statistic in ('avg', 'max')]
+    )
+    return Response('\n'.join(lines) + '\n', content_type = 'text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/related', methods=['GET'])
 def related():
     """ Returns related products given an item/product.
@@ -495,6 +940,118 @@ def recommendations():
         app.logger.exception('Unexpected error generating recommendations', e)
         raise BadRequest(message = 'Unhandled error', status_code = 500)
 
+@app.route('/recommendations/batch', methods=['POST'])
+def recommendations_batch():
+    """ Returns recommendations for many users in one call as newline-delimited JSON
+
+    Accepts a JSON body with 'userIDs' (required) and the optional 'feature', 'filter',
+    'numResults', 'currentItemID' and 'fullyQualifyImageUrls' values that /recommendations
+    accepts as query parameters. Up to BATCH_CONCURRENCY users are resolved at a time, each with
+    the time budget of a single request, and the products for the users that complete together
+    are hydrated with a single de-duplicated lookup. One line is streamed per user, in the order of
+    the userIDs, as soon as that user and those before it are done: {"userID", "items", "headers"}
+    on success or {"userID", "error"} if that user's recommendations could not be generated. When the feature
+    has an active multi-armed bandit experiment, all the users are assigned variations up front.
+    """
+    content = request.get_json(silent = True) or {}
+
+    user_ids = content.get('userIDs')
+    if not user_ids or not isinstance(user_ids, list):
+        raise BadRequest('userIDs is required and must be a list')
+    if len(user_ids) > BATCH_MAX_USERS:
+        raise BadRequest(f'userIDs must not contain more than {BATCH_MAX_USERS} users')
+
+    num_results = content.get('numResults', 25)
+    if not isinstance(num_results, int) or num_results < 1:
+        raise BadRequest('numResults must be greater than zero')
+    if num_results > 100:
+        raise BadRequest('numResults must be less than 100')
+
+    feature = content.get('feature')
+    current_item_id = content.get('currentItemID')
+    fully_qualify_image_urls = str(content.get('fullyQualifyImageUrls', '0')).lower() in [ 'true', 't', '1']
+
+    # The default filter is the not-already-purchased filter
+    filter_ssm = content.get('filter', filter_purchased_param_name)
+    # We have short names for these filters
+    if filter_ssm == 'cstore':
+        filter_ssm = filter_cstore_param_name
+    elif filter_ssm == 'purchased':
+        filter_ssm = filter_purchased_param_name
+
+    promotion = None
+    promotion_filter_arn = get_parameter_values(promotion_filter_param_name)[0]
+    if promotion_filter_arn:
+        promotion = {
+            'name': 'promotedItem',
+            'percentPromotedItems': 25,
+            'filterArn': promotion_filter_arn
+        }
+
+    timestamp = get_timestamp_from_request()
+
+    # A multi-armed bandit experiment assigns variations to all the users with one draw
+    variation_indexes = [None] * len(user_ids)
+    if feature:
+        try:
+            experiment = ExperimentManager().get_active(feature, None)
+            if isinstance(experiment, MultiArmedBanditExperiment):
+                variation_indexes = experiment.select_variation_indexes(len(user_ids))
+        except Exception:
+            app.logger.exception('Error assigning experiment variations for batch; assigning per user')
+
+    def resolve(user_id, variation_index):
+        return lambda: resolve_items(
+            related_items_recipe = False,
+            feature = feature,
+            user_id = str(user_id),
+            current_item_id = current_item_id,
+            num_results = num_results,
+            default_inference_arn_param_name='/retaildemostore/personalize/recommended-for-you-arn',
+            default_filter_arn_param_name=filter_ssm,
+            fully_qualify_image_urls = fully_qualify_image_urls,
+            promotion = promotion,
+            timestamp = timestamp,
+            variation_index = variation_index
+        )
+
+    def generate():
+        # Lines of users that completed before a user ahead of them, by position
+        lines = {}
+        next_index = 0
+
+        tasks = (resolve(user_id, variation_index) for user_id, variation_index in zip(user_ids, variation_indexes))
+        for completed in run_windowed(tasks, BATCH_CONCURRENCY):
+            # One products service lookup for the union of the items recommended to the users that completed
+            deadline.start()
+            results = [result for _, result in completed]
+            item_ids = list(dict.fromkeys(item['itemId'] for result in results if result.ok for item in result.value[0]))
+            try:
+                products = fetch_product_details(item_ids, fully_qualify_image_urls) if item_ids else []
+                hydration_error = None
+            except Exception as e:
+                app.logger.exception('Error hydrating batch recommendations')
+                products = []
+                hydration_error = e
+            products_by_id = {product['id']: product for product in products}
+
+            for index, result in completed:
+                user_id = user_ids[index]
+                if not result.ok or hydration_error:
+                    error = result.error or hydration_error
+                    app.logger.warning('Error generating batch recommendations for user %s: %s', user_id, error)
+                    line = {'userID': user_id, 'error': str(error) or type(error).__name__}
+                else:
+                    items, resp_headers = result.value
+                    line = {'userID': user_id, 'items': hydrate_items(items, products_by_id), 'headers': resp_headers}
+                lines[index] = json.dumps(line, cls=CompatEncoder) + '\n'
+
+            while next_index in lines:
+                yield lines.pop(next_index)
+                next_index += 1
+
+    return Response(stream_with_context(generate()), content_type = 'application/x-ndjson')
+
 @app.route('/popular', methods=['GET'])
 def popular():
     """ Returns item/product recommendations for a given user in the context
@@ -564,6 +1121,125 @@ def popular():
         app.logger.exception('Unexpected error generating recommendations', e)
         raise BadRequest(message = 'Unhandled error', status_code = 500)
 
+@app.route('/home', methods=['POST'])
+def home():
+    """ Returns the recommendation widgets of the home page for a user in one call
+
+    Accepts a JSON body with 'userID' (required), 'widgets' (any of 'recommendations',
+    'popular' and 'featured'; all by default), 'numResults', 'fullyQualifyImageUrls' and
+    optionally the 'featuredItems' to rerank (the featured products are fetched otherwise).
+    The widgets are computed concurrently as /recommendations, /popular and /rerank would,
+    but from one snapshot of the SSM parameters and with one products service lookup for
+    all recommended items. Each widget is returned as {"items", "headers"} (the headers
+    include any experiment) or {"error"} so that one failing widget does not fail the page.
+    """
+    content = request.get_json(silent = True) or {}
+
+    user_id = content.get('userID')
+    if not user_id:
+        raise BadRequest('userID is required')
+    user_id = str(user_id)
+
+    widgets = content.get('widgets', list(home_widgets))
+    if not isinstance(widgets, list) or not widgets:
+        raise BadRequest('widgets must be a non-empty list')
+    unknown = [name for name in widgets if name not in home_widgets]
+    if unknown:
+        raise BadRequest(f'Unknown widgets: {unknown}')
+    widgets = list(dict.fromkeys(widgets))
+
+    num_results = content.get('numResults', 25)
+    if not isinstance(num_results, int) or num_results < 1:
+        raise BadRequest('numResults must be greater than zero')
+    if num_results > 100:
+        raise BadRequest('numResults must be less than 100')
+
+    featured_items = content.get('featuredItems')
+    if featured_items is not None and not isinstance(featured_items, list):
+        raise BadRequest('featuredItems must be a list')
+
+    fully_qualify_image_urls = str(content.get('fullyQualifyImageUrls', '0')).lower() in [ 'true', 't', '1']
+    timestamp = get_timestamp_from_request()
+
+    # Every parameter any of the widgets reads, fetched once
+    names = sorted({value for name in widgets for key, value in home_widgets[name].items() if key.endswith('_param_name')})
+    snapshot = dict(zip(names, get_parameter_values(names)))
+
+    def recommend(widget):
+        promotion = None
+        promotion_filter_arn = get_parameter_values(widget['promotion_filter_param_name'])[0]
+        if promotion_filter_arn:
+            promotion = {
+                'name': 'promotedItem',
+                'percentPromotedItems': 25,
+                'filterArn': promotion_filter_arn
+            }
+
+        return resolve_items(
+            related_items_recipe = False,
+            feature = widget['feature'],
+            user_id = user_id,
+            current_item_id = None,
+            num_results = num_results,
+            default_inference_arn_param_name = widget['inference_arn_param_name'],
+            default_filter_arn_param_name = widget['filter_arn_param_name'],
+            fully_qualify_image_urls = fully_qualify_image_urls,
+            promotion = promotion,
+            timestamp = timestamp
+        )
+
+    def rank_featured(widget):
+        items = featured_items
+        if items is None:
+            with timing.stage('products'):
+                items = fetch_featured_products(fully_qualify_image_urls)
+        if not items:
+            return [], {}
+
+        return get_ranking(user_id, items, widget['feature'],
+                           default_inference_arn_param_name = widget['inference_arn_param_name'],
+                           top_n = num_results)
+
+    token = parameter_snapshot.set(snapshot)
+    try:
+        results = run_concurrently([
+            lambda name=name: (rank_featured if name == HOME_WIDGET_FEATURED else recommend)(home_widgets[name])
+            for name in widgets
+        ])
+
+        # One products service lookup for the union of the recommended items (featured items are already products)
+        item_ids = list(dict.fromkeys(item['itemId'] for name, result in zip(widgets, results)
+                                      if result.ok and name != HOME_WIDGET_FEATURED for item in result.value[0]))
+        try:
+            products = fetch_product_details(item_ids, fully_qualify_image_urls) if item_ids else []
+            hydration_error = None
+        except Exception as e:
+            app.logger.exception('Error hydrating home page recommendations')
+            products = []
+            hydration_error = e
+    finally:
+        parameter_snapshot.reset(token)
+
+    products_by_id = {product['id']: product for product in products}
+
+    response = {}
+    for name, result in zip(widgets, results):
+        error = result.error
+        if error is None and name != HOME_WIDGET_FEATURED:
+            error = hydration_error
+
+        if error is not None:
+            app.logger.warning('Error generating home page widget %s for user %s: %s', name, user_id, error)
+            response[name] = {'error': str(error) or type(error).__name__}
+            continue
+
+        items, resp_headers = result.value
+        if name != HOME_WIDGET_FEATURED:
+            items = hydrate_items(items, products_by_id)
+        response[name] = {'items': items, 'headers': resp_headers}
+
+    return Response(json.dumps({'userID': user_id, 'widgets': response}, cls=CompatEncoder), content_type = 'application/json')
+
 def ranking_request_params():
     """
     Utility function which grabs a JSON body and extracts the UserID, item list and feature name.
@@ -639,52 +1315,53 @@ def get_ranking(user_id, items, feature,
     # Get active experiment if one is setup for feature.
     if feature:
         exp_manager = ExperimentManager()
-        experiment = exp_manager.get_active(feature, user_id)
+        with timing.stage('experiment'):
+            experiment = exp_manager.get_active(feature, user_id)
 
+    ranked_items = None
     if experiment:
         app.logger.info('Using experiment: %s', experiment.name)
 
         # Get ranked items from experiment.
         tracker = exp_manager.default_tracker()
 
-        ranked_items = experiment.get_items(
-            user_id=user_id,
-            item_list=unranked_items,
-            tracker=tracker,
-            context=context,
-            timestamp=get_timestamp_from_request()
-        )
-
-        app.logger.debug("Experiment ranking resolver gave us this ranking: %s", ranked_items)
+        try:
+            with timing.stage('rank'):
+                ranked_items = experiment.get_items(
+                    user_id=user_id,
+                    item_list=unranked_items,
+                    tracker=tracker,
+                    context=context,
+                    timestamp=get_timestamp_from_request()
+                )
 
-        resp_headers['X-Experiment-Name'] = experiment.name
-        resp_headers['X-Experiment-Type'] = experiment.type
-        resp_headers['X-Experiment-Id'] = experiment.id
-    else:
-        # Fallback to default behavior of checking for campaign/recommender ARN parameter and
-        # then the default product resolver.
-        values = get_parameter_values([default_inference_arn_param_name, filter_purchased_param_name])
-        app.logger.info(f'Falling back to Personalize: {values}')
+            app.logger.debug("Experiment ranking resolver gave us this ranking: %s", ranked_items)
+
+            resp_headers['X-Experiment-Name'] = experiment.name
+            resp_headers['X-Experiment-Type'] = experiment.type
+            resp_headers['X-Experiment-Id'] = experiment.id
+        except Exception as e:
+            # Rank with the default resolver below rather than failing the request
+            app.logger.warning(f'Experiment {experiment.name} could not rank items: {e}')
+            resp_headers[DEGRADED_HEADER] = f'{degradation_reason(e)}; source=experiment'
+
+    if ranked_items is None:
+        # Identical concurrent or recent rankings share one resolver call
+        key = make_key(user_id, unranked_items, default_inference_arn_param_name, context)
+        ranked_items, recipe_arn, degraded = ranking_flight.do(
+            key,
+            lambda: get_default_ranking(user_id, unranked_items, default_inference_arn_param_name, context),
+            cacheable = lambda result: result[2] is None
+        )
 
-        inference_arn = values[0]
-        filter_arn = values[1]
+        if degraded:
+            resp_headers[DEGRADED_HEADER] = degraded
 
-        if inference_arn:
-            resolver = PersonalizeRankingResolver(inference_arn=inference_arn, filter_arn=filter_arn)
-            recipe_arn = get_recipe(inference_arn)
+        if recipe_arn:
             if resp_headers.get('X-Personalize-Recipe'):
                 resp_headers['X-Personalize-Recipe'] = resp_headers['X-Personalize-Recipe'] + ',' + recipe_arn
             else:
                 resp_headers['X-Personalize-Recipe'] = recipe_arn
-        else:
-            app.logger.info(f'Falling back to No-op: {values}')
-            resolver = RankingProductsNoOpResolver()
-
-        ranked_items = resolver.get_items(
-            user_id=user_id,
-            product_list=unranked_items,
-            context=context
-        )
 
     response_items = []
     if top_n is not None:
@@ -716,6 +1393,43 @@ def get_ranking(user_id, items, feature,
 
     return response_items, resp_headers
 
+def get_default_ranking(user_id, unranked_items, default_inference_arn_param_name, context=None):
+    """ Ranks item IDs with the campaign/recommender configured in SSM, or keeps their order if there is none
+
+    If Personalize fails, is out of the request's time budget or its circuit is open,
+    the items are returned in their original order.
+    Returns:
+        3-tuple of ranked items (dicts with an 'itemId'), the recipe ARN used (or None)
+        and the degradation header value (or None)
+    """
+    # Fallback to default behavior of checking for campaign/recommender ARN parameter and
+    # then the default product resolver.
+    values = get_parameter_values([default_inference_arn_param_name, filter_purchased_param_name])
+    app.logger.info(f'Falling back to Personalize: {values}')
+
+    inference_arn = values[0]
+    filter_arn = values[1]
+
+    if inference_arn:
+        resolver = PersonalizeRankingResolver(inference_arn=inference_arn, filter_arn=filter_arn)
+        try:
+            with timing.stage('rank'):
+                ranked_items = resolver.get_items(
+                    user_id=user_id,
+                    product_list=unranked_items,
+                    context=context
+                )
+            return ranked_items, get_recipe(inference_arn), None
+        except Exception as e:
+            app.logger.warning(f'Personalize ranking unavailable ({e}); keeping the original order')
+            degraded = f'{degradation_reason(e)}; fallback=no-op'
+    else:
+        app.logger.info(f'Falling back to No-op: {values}')
+        degraded = None
+
+    ranked_items = RankingProductsNoOpResolver().get_items(product_list=unranked_items)
+    return ranked_items, None, degraded
+
 @app.route('/rerank', methods=['POST'])
 def rerank():
     """
@@ -774,7 +1488,8 @@ def get_top_n(user_id, items, feature, top_n,
     # Get active experiment if one is setup for feature.
     if feature:
         exp_manager = ExperimentManager()
-        experiment = exp_manager.get_active(feature, user_id)
+        with timing.stage('experiment'):
+            experiment = exp_manager.get_active(feature, user_id)
 
     if experiment:
         app.logger.info('Using experiment: ' + experiment.name)
@@ -782,13 +1497,14 @@ def get_top_n(user_id, items, feature, top_n,
         # Get ranked items from experiment.
         tracker = exp_manager.default_tracker()
 
-        topn_items = experiment.get_items(
-            user_id=user_id,
-            item_list=unranked_items,
-            tracker=tracker,
-            num_results=top_n,
-            timestamp=get_timestamp_from_request()
-        )
+        with timing.stage('pick'):
+            topn_items = experiment.get_items(
+                user_id=user_id,
+                item_list=unranked_items,
+                tracker=tracker,
+                num_results=top_n,
+                timestamp=get_timestamp_from_request()
+            )
 
         app.logger.debug(f"Experiment ranking resolver gave us this ranking: {topn_items}")
 
@@ -813,11 +1529,20 @@ def get_top_n(user_id, items, feature, top_n,
             app.logger.info(f'Falling back to No-op: {values}')
             resolver = RandomPickResolver()
 
-        topn_items = resolver.get_items(
-            user_id=user_id,
-            product_list=unranked_items,
-            num_results=top_n
-        )
+        try:
+            with timing.stage('pick'):
+                topn_items = resolver.get_items(
+                    user_id=user_id,
+                    product_list=unranked_items,
+                    num_results=top_n
+                )
+        except Exception as e:
+            if not inference_arn:
+                raise
+            app.logger.warning(f'Personalize ranking unavailable ({e}); picking at random')
+            resp_headers.pop('X-Personalize-Recipe', None)
+            resp_headers[DEGRADED_HEADER] = f'{degradation_reason(e)}; fallback=random'
+            topn_items = RandomPickResolver().get_items(product_list=unranked_items, num_results=top_n)
 
     logger.info(f"Sorted items: returned from resolver: {topn_items}")
 
@@ -907,39 +1632,52 @@ def get_offers_service():
     service_port = os.environ.get('OFFERS_SERVICE_PORT', 80)
 
     if not service_host or service_host.strip().lower() == 'offers.retaildemostore.local':
-        # Get product service instance. We'll need it rehydrate product info for recommendations.
-        response = servicediscovery.discover_instances(
-            NamespaceName='retaildemostore.local',
-            ServiceName='offers',
-            MaxResults=1,
-            HealthStatus='HEALTHY'
-        )
-
-        service_host = response['Instances'][0]['Attributes']['AWS_INSTANCE_IPV4']
+        # Get offers service instance from the shared discovery client.
+        service_host = service_discovery.get_host('offers')
 
     return service_host, service_port
 
 
-def get_all_offers_by_id():
-    """We might wish to prepopulate all offers if we are going to be picking up multiple offers."""
+def get_offers_url(url, offers_service_host, **kwargs):
+    """ Calls the offers service, taking the instance out of rotation if it cannot be reached """
+    try:
+        return http_client.get(url, **kwargs)
+    except requests.ConnectionError:
+        service_discovery.evict('offers', offers_service_host)
+        raise
+
+
+def fetch_offers(etag=None):
+    """ Fetches all offers from the offers service unless they still match etag
+
+    Returns None if the offers service reports the catalog is unchanged (304),
+    otherwise the offers and the catalog's ETag.
+    """
     offers_service_host, offers_service_port = get_offers_service()
     url = f'http://{offers_service_host}:{offers_service_port}/offers'
     logger.debug(f"Asking for offers info from {url}")
-    offers_response = requests.get(url)  # we let connection error propagate
+    headers = {'If-None-Match': etag} if etag else {}
+    offers_response = get_offers_url(url, offers_service_host, headers=headers)  # we let connection error propagate
     logger.debug(f"Got offer info: {offers_response}")
+    if offers_response.status_code == 304:
+        return None
     if not offers_response.ok:
         logger.error(f"Offers service not giving us offers: {offers_response.reason}")
         raise BadRequest(message='Cannot obtain offers', status_code=500)
-    offers = offers_response.json()['tasks']
-    offers_by_id = {str(offer['id']): offer for offer in offers}
-    return offers_by_id
+    return offers_response.json()['tasks'], offers_response.headers.get('ETag')
+
+
+def get_all_offers_by_id():
+    """We might wish to prepopulate all offers if we are going to be picking up multiple offers."""
+    snapshot = offers_catalog.get(fetch_offers)
+    return {offer_id: snapshot.offer(offer_id) for offer_id in snapshot.offer_ids}
 
 
 def get_offer_by_id(offer_id):
     offers_service_host, offers_service_port = get_offers_service()
     url = f'http://{offers_service_host}:{offers_service_port}/offers/{offer_id}'
     logger.debug(f"Asking for offer info from {url}")
-    offers_response = requests.get(url)  # we let connection error propagate
+    offers_response = get_offers_url(url, offers_service_host)  # we let connection error propagate
     logger.debug(f"Got offer info: {offers_response}")
     if not offers_response.ok:
         logger.error(f"Offers service not giving us offers: {offers_response.reason}")
@@ -948,12 +1686,64 @@ def get_offer_by_id(offer_id):
     return offer
 
 
+def get_offer_recommendations(inference_arn, user_id, num_results):
+    """ Returns the Personalize itemList of offers scored for a user """
+    logger.info(f"Input to Personalize for offers: userId: {user_id}({type(user_id)}) numResults: {num_results}")
+    get_recommendations_response = call_personalize(
+        'get_recommendations',
+        campaignArn=inference_arn,
+        userId=user_id,
+        numResults=num_results
+    )
+    logger.info(f'Recommendations returned: {json.dumps(get_recommendations_response, default=str)}')
+    return get_recommendations_response['itemList']
+
+
+def choose_offers(user_ids, inference_arn, snapshot, item_lists=None):
+    """ Returns the chosen offer (a copy, with scores if Personalize was used) for each user
+
+    Here is where might want to incorporate some business logic; for more information on how the
+    scores are used see https://aws.amazon.com/blogs/machine-learning/introducing-recommendation-scores-in-amazon-personalize/
+
+    An alternative approach would be to train Personalize to produce recommendations based on objectives
+    we specify rather than the default which is to maximise the target event. For more information, see
+    https://docs.aws.amazon.com/personalize/latest/dg/optimizing-solution-for-objective.html
+    """
+    offer_ids = snapshot.offer_ids
+    if not offer_ids:
+        raise BadRequest(message='Cannot obtain offers', status_code=500)
+
+    if not inference_arn:
+        app.logger.warning('No campaign Arn set for offers - returning arbitrary')
+        # We deterministically choose an offer
+        # - random approach would have been chosen_offer_id = random.choice(offer_ids)
+        return [snapshot.offer(offer_ids[int(user_id) % len(offer_ids)]) for user_id in user_ids]
+
+    # Just one way we could add some randomness - adds serendipity though removes personalization a bit
+    # because we have the scores though we retain a lot of the personalization
+    random_factor = 0.0
+
+    # We can do many other things here, like randomisation, normalisation in different dimensions,
+    # tracking per-user, offer, quotas, etc. Here, we just select the most promising adjusted score
+    chosen = []
+    for result in score_offers(snapshot, item_lists, random_factor = random_factor):
+        if result is None:
+            chosen.append(None)
+            continue
+        chosen_offer_id, chosen_score, chosen_adjusted_score = result
+        chosen_offer = snapshot.offer(chosen_offer_id)
+        chosen_offer['score'] = chosen_score
+        chosen_offer['adjusted_score'] = chosen_adjusted_score
+        chosen.append(chosen_offer)
+    return chosen
+
+
 @app.route('/coupon_offer', methods=['GET'])
 def coupon_offer():
     """
     Returns an offer recommendation for a given user.
 
-    Hits the offers endpoint to find what offers are available, get their preferences for adjusting scores.
+    Uses the cached offers catalog to find what offers are available, get their preferences for adjusting scores.
     Uses Amazon Personalize if available to score them.
     Returns the highest scoring offer.
 
@@ -970,80 +1760,16 @@ def coupon_offer():
     try:
 
         inference_arn = get_parameter_values(offers_arn_param_name)[0]
-        offers_service_host, offers_service_port = get_offers_service()
-
-        url = f'http://{offers_service_host}:{offers_service_port}/offers'
-        app.logger.debug(f"Asking for offers info from {url}")
-        offers_response = requests.get(url)
-        app.logger.debug(f"Got offer info: {offers_response}")
-
-        if not offers_response.ok:
-            app.logger.exception('Offers service did not return happily', offers_response.reason())
-            raise BadRequest(message='Cannot obtain offers', status_code=500)
-        else:
+        snapshot = offers_catalog.get(fetch_offers)
 
-            offers = offers_response.json()['tasks']
-            offers_by_id = {str(offer['id']): offer for offer in offers}
-            offer_ids = sorted(list(offers_by_id.keys()))
-
-            if not inference_arn:
-                app.logger.warning('No campaign Arn set for offers - returning arbitrary')
-                # We deterministically choose an offer
-                # - random approach would have been chosen_offer_id = random.choice(offer_ids)
-                chosen_offer_id = offer_ids[int(user_id) % len(offer_ids)]
-                chosen_score = None
-            else:
-                resp_headers['X-Personalize-Recipe'] = get_recipe(inference_arn)
-                logger.info(f"Input to Personalized Ranking for offers: userId: {user_id}({type(user_id)}) "
-                            f"inputList: {offer_ids}")
-                get_recommendations_response = personalize_runtime.get_recommendations(
-                    campaignArn=inference_arn,
-                    userId=user_id,
-                    numResults=len(offer_ids)
-                )
+        item_lists = None
+        if inference_arn:
+            resp_headers['X-Personalize-Recipe'] = get_recipe(inference_arn)
+            item_lists = [get_offer_recommendations(inference_arn, user_id, len(snapshot.offer_ids))]
 
-                logger.info(f'Recommendations returned: {json.dumps(get_recommendations_response)}')
-
-                return_key = 'itemList'
-                # Here is where might want to incorporate some business logic
-                # for more information on how these scores are used see
-                # https://aws.amazon.com/blogs/machine-learning/introducing-recommendation-scores-in-amazon-personalize/
-
-                # An alternative approach would be to train Personalize to produce recommendations based on objectives
-                # we specify rather than the default which is to maximise the target event. For more information, see
-                # https://docs.aws.amazon.com/personalize/latest/dg/optimizing-solution-for-objective.html
-
-                user_scores = {item['itemId']: float(item['score']) for item in
-                               get_recommendations_response[return_key]}
-                # We assume we have pre-calculated the adjusting factor, can be a mix of probability when applicable,
-                # calculation of expected return per offer, etc.
-                adjusted_scores = {offer_id: score * offers_by_id[offer_id]['preference']
-                                   for offer_id, score in user_scores.items()}
-                logger.info(f"Scores after adjusting for preference parameters: {adjusted_scores}")
-
-                # Normalise these - makes it easier to do further adjustments
-                score_sum = sum(adjusted_scores.values())
-                adjusted_scores = {offer_id: score / score_sum
-                                   for offer_id, score in adjusted_scores.items()}
-                logger.info(f"Scores after normalising adjusted scores: {adjusted_scores}")
-
-                # Just one way we could add some randomness - adds serendipity though removes personalization a bit
-                # because we have the scores though we retain a lot of the personalization
-                random_factor = 0.0
-                adjusted_scores = {offer_id: score*(1-random_factor) + random_factor*random.random()
-                                   for offer_id, score in adjusted_scores.items()}
-                logger.info(f"Scores after adding randomness: {adjusted_scores}")
-
-                # We can do many other things here, like randomisation, normalisation in different dimensions,
-                # tracking per-user, offer, quotas, etc. Here, we just select the most promising adjusted score
-                chosen_offer_id = max(adjusted_scores, key=adjusted_scores.get)
-                chosen_score = user_scores[chosen_offer_id]
-                chosen_adjusted_score = adjusted_scores[chosen_offer_id]
-
-            chosen_offer = offers_by_id[chosen_offer_id]
-            if chosen_score is not None:
-                chosen_offer['score'] = chosen_score
-                chosen_offer['adjusted_score'] = chosen_adjusted_score
+        chosen_offer = choose_offers([user_id], inference_arn, snapshot, item_lists)[0]
+        if chosen_offer is None:
+            raise Exception(f'Personalize did not score any known offer for user {user_id}')
 
         resp = Response(json.dumps({'offer': chosen_offer}, cls=CompatEncoder),
                         content_type='application/json', headers=resp_headers)
@@ -1056,6 +1782,68 @@ def coupon_offer():
         raise BadRequest(message='Unhandled error', status_code=500)
 
 
+@app.route('/coupon_offer/batch', methods=['POST'])
+def coupon_offer_batch():
+    """
+    Returns an offer recommendation for each of many users (e.g. all recipients of a Pinpoint campaign).
+
+    Accepts a JSON body with 'userIDs'. Personalize is called for up to BATCH_CONCURRENCY users at
+    a time, each with the time budget of a single request, and all users' scores are then adjusted and compared in one vectorized pass.
+    Returns {"offers": [...]} with {"userID", "offer"} or {"userID", "error"} per user, in order.
+    """
+    content = request.get_json(silent = True) or {}
+
+    user_ids = content.get('userIDs')
+    if not user_ids or not isinstance(user_ids, list):
+        raise BadRequest('userIDs is required and must be a list')
+    if len(user_ids) > BATCH_MAX_USERS:
+        raise BadRequest(f'userIDs must not contain more than {BATCH_MAX_USERS} users')
+    user_ids = [str(user_id) for user_id in user_ids]
+
+    resp_headers = {}
+    try:
+        inference_arn = get_parameter_values(offers_arn_param_name)[0]
+        snapshot = offers_catalog.get(fetch_offers)
+    except Exception as e:
+        app.logger.exception('Unexpected error generating recommendations', e)
+        raise BadRequest(message='Unhandled error', status_code=500)
+
+    errors = {}
+    if inference_arn:
+        resp_headers['X-Personalize-Recipe'] = get_recipe(inference_arn)
+
+        item_lists = [[] for _ in user_ids]
+        tasks = (lambda user_id=user_id: get_offer_recommendations(inference_arn, user_id, len(snapshot.offer_ids))
+                 for user_id in user_ids)
+        for completed in run_windowed(tasks, BATCH_CONCURRENCY):
+            for index, result in completed:
+                if result.ok:
+                    item_lists[index] = result.value
+                else:
+                    errors[user_ids[index]] = result.error
+
+        chosen = choose_offers(user_ids, inference_arn, snapshot, item_lists)
+    else:
+        chosen = []
+        for user_id in user_ids:
+            try:
+                chosen.append(choose_offers([user_id], None, snapshot)[0])
+            except Exception as e:
+                errors[user_id] = e
+                chosen.append(None)
+
+    offers = []
+    for user_id, chosen_offer in zip(user_ids, chosen):
+        if chosen_offer is not None:
+            offers.append({'userID': user_id, 'offer': chosen_offer})
+        else:
+            error = errors.get(user_id) or Exception('No known offer was scored for the user')
+            app.logger.warning('Error choosing offer for user %s: %s', user_id, error)
+            offers.append({'userID': user_id, 'error': str(error) or type(error).__name__})
+
+    return Response(json.dumps({'offers': offers}, cls=CompatEncoder), content_type='application/json', headers=resp_headers)
+
+
 @app.route('/experiment/outcome', methods=['POST'])
 def experiment_outcome():
     """ Tracks an outcome/conversion for an experiment """
@@ -1079,15 +1867,99 @@ def experiment_outcome():
 
         experiment.track_conversion(correlation_id, get_timestamp_from_request())
 
+        # The user converted, so their next recommendations should be generated fresh
+        user_results.invalidate_user(correlation_id.split('~')[1])
+
         return jsonify(success=True)
 
     except Exception as e:
         app.logger.exception('Unexpected error logging outcome', e)
         raise BadRequest(message='Unhandled error', status_code=500)
 
-if __name__ == '__main__':
+@app.route('/experiment/outcome/batch', methods=['POST'])
+def experiment_outcome_batch():
+    """ Tracks outcomes/conversions for many correlation IDs (e.g. replayed offline conversions)
+
+    Accepts a JSON body with 'correlationIds'. IDs are grouped by experiment so each experiment is
+    looked up once, and conversions are counted with one increment per variation. Returns the
+    status of each ID, in order: 'tracked', 'invalid' (malformed ID or unknown variation),
+    'not_found' (no such experiment) or 'error' (the experiment could not be loaded).
+    """
+    content = request.get_json(silent = True) or {}
+
+    correlation_ids = content.get('correlationIds')
+    if not correlation_ids or not isinstance(correlation_ids, list):
+        raise BadRequest('correlationIds is required and must be a list')
+    if len(correlation_ids) > BATCH_MAX_OUTCOMES:
+        raise BadRequest(f'correlationIds must not contain more than {BATCH_MAX_OUTCOMES} IDs')
+
+    timestamp = get_timestamp_from_request()
+    statuses = [None] * len(correlation_ids)
+
+    # Positions of the IDs for each experiment
+    positions_by_experiment = {}
+    for position, correlation_id in enumerate(correlation_ids):
+        if not isinstance(correlation_id, str) or len(correlation_id.split('~')) != 4:
+            statuses[position] = 'invalid'
+            continue
+        positions_by_experiment.setdefault(correlation_id.split('~')[0], []).append(position)
+
+    exp_manager = ExperimentManager()
+    converted_users = set()
+
+    for experiment_id, positions in positions_by_experiment.items():
+        try:
+            experiment = exp_manager.get_by_id(experiment_id)
+        except Exception:
+            app.logger.exception(f'Unexpected error loading experiment {experiment_id}')
+            for position in positions:
+                statuses[position] = 'error'
+            continue
+
+        if not experiment:
+            for position in positions:
+                statuses[position] = 'not_found'
+            continue
 
-    if DEBUG_LOGGING:
+        ids = [correlation_ids[position] for position in positions]
+        for position, correlation_id, status in zip(positions, ids, experiment.track_conversions(ids, timestamp)):
+            statuses[position] = status
+            if status == 'tracked':
+                converted_users.add(correlation_id.split('~')[1])
+
+    # Users that converted should get fresh recommendations next time
+    for user_id in converted_users:
+        user_results.invalidate_user(user_id)
+
+    results = [{'correlationId': correlation_id, 'status': status} for correlation_id, status in zip(correlation_ids, statuses)]
+    return jsonify(results = results, tracked = sum(1 for status in statuses if status == 'tracked'))
+
+@app.route('/events', methods=['POST'])
+def user_event():
+    """ Receives a user interaction event and drops the user's cached recommendations if it affects them
+
+    Expects a JSON body with 'userID' and 'eventType'. Purchase and cart events invalidate the
+    user's cached results; other event types are accepted and ignored.
+    """
+    content = request.get_json(silent = True) or {}
+
+    user_id = content.get('userID')
+    if not user_id:
+        raise BadRequest('userID is required')
+
+    event_type = content.get('eventType')
+    if not event_type:
+        raise BadRequest('eventType is required')
+
+    invalidated = 0
+    if event_type in INVALIDATING_EVENT_TYPES:
+        invalidated = user_results.invalidate_user(str(user_id))
+
+    return jsonify(success = True, invalidated = invalidated)
+
+def configure_logging(debug: bool = DEBUG_LOGGING):
+    """ Sets the log level of the service and routes experimentation logs to its handlers """
+    if debug:
         level = logging.DEBUG
     else:
         level = logging.INFO
@@ -1100,6 +1972,10 @@ if __name__ == '__main__':
             logging.getLogger('experimentation.experiment_manager').addHandler(handler)
             handler.setLevel(level)  # this will get the main app logs to CloudWatch
 
+if __name__ == '__main__':
+    # Development server; production runs wsgi:app under gunicorn (see gunicorn-cfg.py)
+    configure_logging()
+
     app.wsgi_app = LoggingMiddleware(app.wsgi_app)
 
-    app.run(debug=True, host='0.0.0.0', port=80)
+    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 80)))
@@ -0,0 +1,81 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Micro-benchmark for the interleaving methods of InterleavingExperiment.
+
+Times each method over 2-8 variations and 25-500 results, with every variation
+over-fetching 3x the results (as get_items does) from an overlapping item pool.
+
+python -m benchmarks.benchmark_interleaving [--repeat 20]
+"""
+
+import argparse
+import copy
+import random
+import time
+
+from experimentation.experiment_interleaving import InterleavingExperiment
+
+VARIATION_COUNTS = [2, 3, 4, 6, 8]
+RESULT_COUNTS = [25, 50, 100, 250, 500]
+METHODS = [
+    InterleavingExperiment.METHOD_BALANCED,
+    InterleavingExperiment.METHOD_TEAM_DRAFT,
+    InterleavingExperiment.METHOD_PROBABILISTIC
+]
+
+def create_experiment(method):
+    return InterleavingExperiment('ExperimentStrategy', **{
+        'id': 'benchmark',
+        'feature': 'benchmark',
+        'name': 'benchmark',
+        'type': 'interleaving',
+        'status': 'ACTIVE',
+        'method': method,
+        'variations': []
+    })
+
+def create_item_lists(rng, variation_count, count):
+    # Overlapping pool so that duplicate handling is exercised
+    pool_size = count * 4
+    return [[{'itemId': str(item_id)} for item_id in rng.sample(range(pool_size), count * 3)]
+            for _ in range(variation_count)]
+
+def time_method(experiment, lists, count, repeat):
+    timings = []
+    for _ in range(repeat):
+        data = copy.deepcopy(lists)
+        start = time.perf_counter()
+        interleave(experiment, data, count)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+def interleave(experiment, lists, count):
+    if experiment.method == InterleavingExperiment.METHOD_TEAM_DRAFT:
+        return experiment._interleave_team_draft('1', lists, count)
+    if experiment.method == InterleavingExperiment.METHOD_PROBABILISTIC:
+        return experiment._interleave_probabilistic('1', lists, count)
+    return experiment._interleave_balanced('1', lists, count)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark interleaving methods')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per configuration (median is reported)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+
+    print(f'{"method":<14} {"variations":>10} {"results":>8} {"median ms":>10} {"us/result":>10}')
+    for method in METHODS:
+        experiment = create_experiment(method)
+        for variation_count in VARIATION_COUNTS:
+            for count in RESULT_COUNTS:
+                lists = create_item_lists(rng, variation_count, count)
+                median = time_method(experiment, lists, count, args.repeat)
+                print(f'{method:<14} {variation_count:>10} {count:>8} {median * 1000:>10.3f} {median / count * 1e6:>10.2f}')
+
+if __name__ == '__main__':
+    main()
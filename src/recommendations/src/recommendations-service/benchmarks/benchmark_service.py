@@ -0,0 +1,331 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Benchmark of the recommendations service's endpoints against local stand-ins for
+Personalize, SSM, Cloud Map, DynamoDB, Kinesis and the products service (see fakes.py).
+
+/recommendations, /related, /rerank and /choose_discounted are each driven with no
+active experiment and with an active A/B, interleaving and multi-armed bandit
+experiment for their feature. Requests are sent straight to the WSGI app by
+--concurrency client threads, for a pool of users so that per-user caches see a
+realistic mix of hits and misses.
+
+For each scenario the throughput, p50/p95/p99 latency, CPU time per request, the
+share of degraded responses and the memory allocated per request are reported. The
+allocations are the peak memory traced by tracemalloc while serving a request, over
+a separate sequential pass, since CPython does not count allocations cumulatively.
+
+Results can be written with --output and compared with an earlier run with
+--compare-to, which fails if the allocations per request of a scenario or the CPU
+time per request over all scenarios regressed by more than --max-regression, or if
+any request failed. This is how CI checks pull requests against their base branch.
+
+python -m benchmarks.benchmark_service [--requests 400] [--concurrency 8] [--personalize-latency 0.03]
+python -m benchmarks.benchmark_service --output head.json --compare-to base.json
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+
+from werkzeug.test import Client
+
+from benchmarks.fakes import FakePersonalizeRuntime, FakeSession, FakeSSM, ProductsService, create_products
+
+TABLE_NAME = 'benchmark-experiment-strategy'
+STREAM_NAME = 'benchmark-experiment-events'
+CAMPAIGN_ARN = 'arn:aws:personalize:us-east-1:123456789012:campaign/{}'
+FILTER_ARN = 'arn:aws:personalize:us-east-1:123456789012:filter/{}'
+
+PARAMETERS = {
+    '/retaildemostore/personalize/recommended-for-you-arn': CAMPAIGN_ARN.format('recommended-for-you'),
+    '/retaildemostore/personalize/related-items-arn': CAMPAIGN_ARN.format('related-items'),
+    '/retaildemostore/personalize/personalized-ranking-arn': CAMPAIGN_ARN.format('personalized-ranking'),
+    '/retaildemostore/personalize/popular-items-arn': CAMPAIGN_ARN.format('popular-items'),
+    '/retaildemostore/personalize/filters/filter-purchased-arn': FILTER_ARN.format('purchased'),
+    '/retaildemostore/personalize/filters/filter-cstore-arn': FILTER_ARN.format('cstore'),
+    '/retaildemostore/personalize/filters/filter-purchased-and-cstore-arn': FILTER_ARN.format('purchased-cstore'),
+    '/retaildemostore/personalize/filters/filter-same-categories-arn': 'NONE',
+    '/retaildemostore/personalize/filters/promoted-items-filter-arn': 'NONE',
+    '/retaildemostore/personalize/filters/promoted-items-no-cstore-filter-arn': 'NONE',
+    'retaildemostore-experiment-strategy-table-name': TABLE_NAME,
+    'retaildemostore-kinesis-event-stream-name': STREAM_NAME
+}
+
+ENDPOINTS = ['recommendations', 'related', 'rerank', 'choose_discounted']
+EXPERIMENT_TYPES = ['none', 'ab', 'interleaving', 'mab']
+
+# Feature of each endpoint and the variations its experiments compare
+FEATURES = {
+    'recommendations': ('home_product_recs', [
+        {'type': 'personalize-recommendations', 'inference_arn': CAMPAIGN_ARN.format('recommended-for-you')},
+        {'type': 'personalize-recommendations', 'inference_arn': CAMPAIGN_ARN.format('recommended-for-you-v2')}
+    ]),
+    'related': ('product_detail_related', [
+        {'type': 'personalize-recommendations', 'inference_arn': CAMPAIGN_ARN.format('related-items')},
+        {'type': 'personalize-recommendations', 'inference_arn': CAMPAIGN_ARN.format('related-items-v2')}
+    ]),
+    'rerank': ('home_featured_rerank', [
+        {'type': 'personalize-ranking', 'inference_arn': CAMPAIGN_ARN.format('personalized-ranking')},
+        {'type': 'ranking-no-op'}
+    ]),
+    'choose_discounted': ('live_stream_prod_discounts', [
+        {'type': 'personalize-pick', 'inference_arn': CAMPAIGN_ARN.format('personalized-ranking'),
+         'with_context': {'Discount': 'Yes'}, 'without_context': {}},
+        {'type': 'random-pick'}
+    ])
+}
+
+class Harness:
+    """ Runs the service in-process against the fakes """
+
+    def __init__(self, args):
+        self.args = args
+        products = create_products(args.products)
+        self.item_ids = [product['id'] for product in products]
+        self.products_service = ProductsService(products).start()
+        self.personalize_runtime = FakePersonalizeRuntime(self.item_ids, args.personalize_latency, args.throttle_rate)
+        self.session = FakeSession(self.personalize_runtime, FakeSSM(dict(PARAMETERS)))
+
+        os.environ['PRODUCT_SERVICE_PORT'] = str(self.products_service.port)
+        os.environ.pop('PRODUCT_SERVICE_HOST', None)
+        # There is no X-Ray daemon to send traces (or ask for sampling rules) to
+        os.environ['AWS_XRAY_SDK_ENABLED'] = 'false'
+
+        import app as service
+        from experimentation.aws_clients import aws_clients
+        aws_clients.reset(lambda: self.session)
+        self.service = service
+        self.table = self.session.dynamodb.Table(TABLE_NAME)
+
+    def stop(self):
+        self.products_service.stop()
+
+    def activate(self, experiment_type: str):
+        """ Makes experiment_type the active experiment for every feature ('none' for no experiments) """
+        # Experiments of earlier scenarios are stopped rather than deleted so their buffered counters can be written
+        for item in self.table.items.values():
+            item['status'] = 'STOPPED'
+        if experiment_type != 'none':
+            for endpoint, (feature, variations) in FEATURES.items():
+                experiment_id = f'{experiment_type}-{endpoint}'
+                self.table.items[experiment_id] = {
+                    'id': experiment_id,
+                    'feature': feature,
+                    'name': experiment_id,
+                    'status': 'ACTIVE',
+                    'type': experiment_type,
+                    'variations': [dict(variation, exposures = 0, conversions = 0) for variation in variations]
+                }
+
+        # Start each scenario with fresh results but warm connections and product details
+        for name in ('experiments', 'user_results', 'coalesced_products', 'coalesced_rankings'):
+            self.service.caches[name].invalidate()
+        self.session.services['kinesis'].records.clear()
+
+    def request(self, client: Client, endpoint: str, rng: random.Random):
+        user_id = str(rng.randrange(self.args.users))
+        feature = FEATURES[endpoint][0]
+        if endpoint == 'recommendations':
+            return client.get(f'/recommendations?userID={user_id}&feature={feature}&numResults=25')
+        if endpoint == 'related':
+            item_id = rng.choice(self.item_ids)
+            return client.get(f'/related?userID={user_id}&currentItemID={item_id}&feature={feature}&numResults=25')
+
+        count = 50 if endpoint == 'rerank' else 10
+        items = [{'itemId': item_id, 'url': f'http://localhost/#/product/{item_id}'} for item_id in rng.sample(self.item_ids, count)]
+        return client.post(f'/{endpoint}', json = {'userID': user_id, 'items': items, 'feature': feature})
+
+    def run(self, endpoint: str, experiment_type: str) -> dict:
+        self.activate(experiment_type)
+        seeds = itertools.count(zlib.crc32(f'{endpoint}/{experiment_type}'.encode('utf-8')))
+
+        # Warm up (e.g. the experiment snapshot and the product cache) before measuring
+        self.load(endpoint, self.args.warmup, seeds)
+
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        latencies, errors, degraded = self.load(endpoint, self.args.requests, seeds)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - start_cpu
+
+        allocated, retained = self.measure_allocations(endpoint, next(seeds))
+
+        latencies.sort()
+        count = len(latencies)
+        return {
+            'endpoint': endpoint,
+            'experiment': experiment_type,
+            'requests': count,
+            'rps': count / elapsed,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'cpu_ms': cpu / count * 1000,
+            'alloc_kib': allocated,
+            'retained_blocks': retained,
+            'degraded': degraded / count,
+            'errors': errors
+        }
+
+    def load(self, endpoint: str, requests: int, seeds):
+        """ Sends requests from the client threads; returns the latencies, error count and degraded count """
+        latencies, failures, degraded = [], [], []
+        remaining = iter(range(requests))
+        lock = threading.Lock()
+
+        def worker(seed):
+            client = Client(self.service.app)
+            rng = random.Random(seed)
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                start = time.perf_counter()
+                response = self.request(client, endpoint, rng)
+                elapsed = time.perf_counter() - start
+                response.close()
+                with lock:
+                    latencies.append(elapsed)
+                    if response.status_code >= 400:
+                        failures.append(response.status_code)
+                    if self.service.DEGRADED_HEADER in response.headers:
+                        degraded.append(1)
+
+        threads = [threading.Thread(target = worker, args = (next(seeds),)) for _ in range(self.args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, len(failures), len(degraded)
+
+    def measure_allocations(self, endpoint: str, seed: int):
+        """ Returns the mean peak KiB allocated while serving a request and the blocks retained per request """
+        requests = self.args.alloc_requests
+        if not requests:
+            return None, None
+
+        client = Client(self.service.app)
+        rng = random.Random(seed)
+        gc.collect()
+        blocks = sys.getallocatedblocks()
+        peaks = 0
+        for _ in range(requests):
+            # Tracing restarts for each request since Python 3.8 (the service's and CI's
+            # version) has no tracemalloc.reset_peak().
+            tracemalloc.start()
+            try:
+                self.request(client, endpoint, rng).close()
+                peaks += tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        gc.collect()
+        return peaks / requests / 1024, (sys.getallocatedblocks() - blocks) / requests
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))] if values else float('nan')
+
+def print_result(result):
+    alloc = f'{result["alloc_kib"]:>10.1f}' if result['alloc_kib'] is not None else f'{"-":>10}'
+    retained = f'{result["retained_blocks"]:>9.1f}' if result['retained_blocks'] is not None else f'{"-":>9}'
+    print(f'{result["endpoint"]:<18} {result["experiment"]:<13} {result["rps"]:>8.1f} {result["p50_ms"]:>8.2f} '
+          f'{result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} {result["cpu_ms"]:>8.2f} {alloc} {retained} '
+          f'{result["degraded"]:>9.1%} {result["errors"]:>6}', flush = True)
+
+def compare(results, baseline, max_regression):
+    """ Returns descriptions of the regressions compared with the baseline results
+
+    Allocations are compared per scenario. CPU time per request varies too much from
+    run to run for single scenarios, so it is compared summed over all scenarios.
+    """
+    previous = {(result['endpoint'], result['experiment']): result for result in baseline['results']}
+    regressions = []
+    cpu, base_cpu = 0.0, 0.0
+    for result in results:
+        base = previous.get((result['endpoint'], result['experiment']))
+        if base is None:
+            continue
+        cpu += result['cpu_ms']
+        base_cpu += base['cpu_ms']
+        if result.get('alloc_kib') is not None and base.get('alloc_kib'):
+            ratio = result['alloc_kib'] / base['alloc_kib']
+            if ratio > 1 + max_regression:
+                regressions.append(f'{result["endpoint"]} ({result["experiment"]}): alloc KiB per request '
+                                   f'{base["alloc_kib"]:.1f} -> {result["alloc_kib"]:.1f} ({ratio - 1:+.0%})')
+    if base_cpu and cpu / base_cpu > 1 + max_regression:
+        regressions.append(f'CPU ms per request summed over scenarios {base_cpu:.2f} -> {cpu:.2f} ({cpu / base_cpu - 1:+.0%})')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the recommendations service against local stand-ins')
+    parser.add_argument('--endpoint', action = 'append', choices = ENDPOINTS, help = 'Endpoint to benchmark, may be repeated (default all)')
+    parser.add_argument('--experiment', action = 'append', choices = EXPERIMENT_TYPES, help = 'Experiment type, may be repeated (default all)')
+    parser.add_argument('--requests', type = int, default = 400, help = 'Measured requests per scenario')
+    parser.add_argument('--warmup', type = int, default = 50, help = 'Requests per scenario before measuring')
+    parser.add_argument('--concurrency', type = int, default = 8, help = 'Client threads')
+    parser.add_argument('--alloc-requests', type = int, default = 50, help = 'Requests traced for allocations (0 to skip)')
+    parser.add_argument('--users', type = int, default = 10000, help = 'Size of the pool of user IDs')
+    parser.add_argument('--products', type = int, default = 500, help = 'Products in the stub catalog')
+    parser.add_argument('--personalize-latency', type = float, default = 0.0, help = 'Mean seconds per Personalize call')
+    parser.add_argument('--throttle-rate', type = float, default = 0.0, help = 'Share of Personalize calls throttled')
+    parser.add_argument('--output', help = 'Write the results to this JSON file')
+    parser.add_argument('--compare-to', help = 'Results of an earlier run to check for regressions')
+    parser.add_argument('--max-regression', type = float, default = 0.25,
+                        help = 'Largest allowed increase of CPU time or allocations per request (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.ERROR)
+    harness = Harness(args)
+    logging.getLogger(harness.service.app.logger.name).setLevel(logging.ERROR)
+
+    print(f'{"endpoint":<18} {"experiment":<13} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+          f'{"cpu ms":>8} {"alloc KiB":>10} {"retained":>9} {"degraded":>9} {"errors":>6}')
+    results = []
+    try:
+        for endpoint in args.endpoint or ENDPOINTS:
+            for experiment_type in args.experiment or EXPERIMENT_TYPES:
+                # The service prints some payloads to stdout; keep them out of the report
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = harness.run(endpoint, experiment_type)
+                results.append(result)
+                print_result(result)
+    finally:
+        harness.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'args': vars(args), 'results': results}, f, indent = 2)
+
+    failed = False
+    errors = sum(result['errors'] for result in results)
+    if errors:
+        print(f'\n{errors} requests failed')
+        failed = True
+
+    if args.compare_to:
+        with open(args.compare_to) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print(f'\nRegressions compared with {args.compare_to}:')
+            for regression in regressions:
+                print(f'  {regression}')
+            failed = True
+        else:
+            print(f'\nNo regressions compared with {args.compare_to}')
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Start up benchmark and import-time profile for the recommendations service.
+
+Each run starts a fresh interpreter (as a new container would after a scale-out),
+imports app.py and serves a first request (GET /health) with the Flask test client.
+The time to import, to serve the first request and the whole process are reported
+along with the AWS clients that were created along the way and the threads running
+after the import, which should both be none since gunicorn forks workers after it.
+
+With --profile, the service is also imported once under "python -X importtime" and
+the modules and top level packages that take the most time to import are listed.
+
+python -m benchmarks.benchmark_startup [--runs 10] [--profile] [--top 20] [--max-import-ms 1500]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json
+import threading
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+threads = [thread.name for thread in threading.enumerate() if thread is not threading.main_thread()]
+response = app.app.test_client().get('/health')
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (served - imported) * 1000,
+    'status': response.status_code,
+    'aws_clients': app.aws_clients.stats(),
+    'threads': threads
+}))
+'''
+
+def run_child():
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', CHILD], cwd = SERVICE_DIR, capture_output = True, text = True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f'Service failed to start:\n{result.stderr}')
+    # The service may log to stdout; the measurements are the last line
+    measurements = json.loads(result.stdout.strip().splitlines()[-1])
+    measurements['process_ms'] = elapsed * 1000
+    return measurements
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def profile_imports():
+    """ Returns (module, self us, cumulative us) for each module imported by app.py """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd = SERVICE_DIR,
+                            capture_output = True, text = True)
+    if result.returncode != 0:
+        raise RuntimeError(f'Service failed to import:\n{result.stderr}')
+
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        modules.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return modules
+
+def print_profile(modules, top):
+    total = sum(self_us for _, self_us, _ in modules)
+    print(f'\nImported {len(modules)} modules in {total / 1000:.1f} ms (sum of self times)')
+
+    packages = {}
+    for module, self_us, _ in modules:
+        package = module.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+
+    print(f'\n{"package":<40} {"self ms":>10} {"share":>7}')
+    for package, self_us in sorted(packages.items(), key = lambda entry: -entry[1])[:top]:
+        print(f'{package:<40} {self_us / 1000:>10.1f} {self_us / total:>7.1%}')
+
+    print(f'\n{"module":<60} {"cumulative ms":>14} {"self ms":>10}')
+    for module, self_us, cumulative_us in sorted(modules, key = lambda entry: -entry[2])[:top]:
+        print(f'{module:<60} {cumulative_us / 1000:>14.1f} {self_us / 1000:>10.1f}')
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the start up of the recommendations service')
+    parser.add_argument('--runs', type = int, default = 10, help = 'Fresh interpreters to start')
+    parser.add_argument('--profile', action = 'store_true', help = 'Also report the slowest imports')
+    parser.add_argument('--top', type = int, default = 20, help = 'Modules and packages listed by --profile')
+    parser.add_argument('--max-import-ms', type = float, help = 'Exit with an error if the median import takes longer')
+    args = parser.parse_args()
+
+    runs = [run_child() for _ in range(args.runs)]
+
+    print(f'{"measurement":<18} {"p50 ms":>10} {"p95 ms":>10} {"max ms":>10}')
+    for measurement in ('import_ms', 'first_request_ms', 'process_ms'):
+        values = [run[measurement] for run in runs]
+        print(f'{measurement[:-3]:<18} {percentile(values, 0.5):>10.1f} {percentile(values, 0.95):>10.1f} {max(values):>10.1f}')
+
+    clients = runs[-1]['aws_clients']
+    print(f'\nAWS clients created before serving the first request: {clients["clients"]} '
+          f'{json.dumps(clients["creation_ms"]) if clients["clients"] else ""}'.rstrip())
+
+    threads = runs[-1]['threads']
+    print(f'Threads running after import: {len(threads)} {", ".join(threads)}'.rstrip())
+
+    if args.profile:
+        print_profile(profile_imports(), args.top)
+
+    if threads:
+        print('\nThreads started at import do not survive the fork of gunicorn workers (preload_app)')
+        sys.exit(1)
+
+    median_import = percentile([run['import_ms'] for run in runs], 0.5)
+    if args.max_import_ms is not None and median_import > args.max_import_ms:
+        print(f'\nMedian import time {median_import:.1f} ms exceeds {args.max_import_ms:.1f} ms')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+In-process stand-ins for the AWS services and the products service used by the
+recommendations service, so that it can be benchmarked without an AWS account.
+
+FakeSession is installed with aws_clients.reset(lambda: session) and serves:
+- personalize-runtime: deterministic recommendations and rankings, with configurable
+  latency and a share of calls throttled like Personalize does
+- personalize: recipe lookups for campaigns and recommenders
+- ssm: parameters from a dict
+- servicediscovery: every service is at 127.0.0.1
+- kinesis: LocalKinesisStream
+- dynamodb: an experiment strategy table with scan, get_item and update_item
+
+ProductsService is a stub products service listening on a local port.
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+from botocore.exceptions import ClientError
+from experimentation.tracking import LocalKinesisStream
+
+CATEGORIES = ['accessories', 'apparel', 'beauty', 'electronics', 'footwear', 'housewares', 'jewelry', 'outdoors']
+
+def create_products(count: int) -> List[Dict]:
+    """ Returns a catalog of products shaped like the products service's """
+    return [{
+        'id': str(i),
+        'url': f'http://localhost/#/product/{i}',
+        'sk': '',
+        'name': f'Product {i}',
+        'category': CATEGORIES[i % len(CATEGORIES)],
+        'style': 'style',
+        'description': f'Description of product {i}',
+        'price': round(5 + (i * 7.31) % 200, 2),
+        'image': f'{i}.jpg',
+        'featured': 'true' if i < 20 else 'false',
+        'gender_affinity': None,
+        'current_stock': 10
+    } for i in range(count)]
+
+def seeded(*parts) -> random.Random:
+    """ Returns a random generator seeded from the parts, so fake responses are repeatable """
+    digest = hashlib.blake2b('|'.join(str(part) for part in parts).encode('utf-8'), digest_size = 8).digest()
+    return random.Random(int.from_bytes(digest, 'little'))
+
+class FakePersonalizeRuntime:
+    """ Personalize runtime returning items from the catalog, after an optional delay
+
+    latency is the mean delay of a call in seconds (uniformly +/- 50%) and
+    throttle_rate the share of calls that fail with a ThrottlingException.
+    """
+
+    def __init__(self, item_ids: List[str], latency: float = 0.0, throttle_rate: float = 0.0, seed: int = 42):
+        self.item_ids = item_ids
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.calls = 0
+        self.throttled = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call(self, operation: str):
+        with self._lock:
+            self.calls += 1
+            throttle = self._rng.random() < self.throttle_rate
+            delay = self.latency * (0.5 + self._rng.random()) if self.latency else 0.0
+            if throttle:
+                self.throttled += 1
+        if delay:
+            time.sleep(delay)
+        if throttle:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'},
+                               'ResponseMetadata': {'HTTPStatusCode': 400}}, operation)
+
+    def get_recommendations(self, numResults = 25, userId = None, itemId = None, **kwargs):
+        self.__call('GetRecommendations')
+        arn = kwargs.get('campaignArn') or kwargs.get('recommenderArn')
+        rng = seeded(arn, userId, itemId)
+        item_ids = rng.sample(self.item_ids, min(numResults, len(self.item_ids)))
+        scores = sorted((rng.random() for _ in item_ids), reverse = True)
+        return {
+            'itemList': [{'itemId': item_id, 'score': score} for item_id, score in zip(item_ids, scores)],
+            'recommendationId': f'RID-{rng.getrandbits(64):x}'
+        }
+
+    def get_personalized_ranking(self, campaignArn, userId, inputList, context = None, **kwargs):
+        self.__call('GetPersonalizedRanking')
+        rng = seeded(campaignArn, userId, json.dumps(context, sort_keys = True))
+        ranked = list(inputList)
+        rng.shuffle(ranked)
+        scores = sorted((rng.random() for _ in ranked), reverse = True)
+        return {
+            'personalizedRanking': [{'itemId': item_id, 'score': score} for item_id, score in zip(ranked, scores)],
+            'recommendationId': f'RID-{rng.getrandbits(64):x}'
+        }
+
+class FakePersonalize:
+    """ Personalize control plane; only the calls used to look up recipes """
+
+    RECIPE = 'arn:aws:personalize:::recipe/aws-user-personalization'
+
+    def describe_campaign(self, campaignArn):
+        return {'campaign': {'campaignArn': campaignArn, 'solutionVersionArn': campaignArn + '/solution-version'}}
+
+    def describe_solution_version(self, solutionVersionArn):
+        return {'solutionVersion': {'solutionVersionArn': solutionVersionArn, 'recipeArn': FakePersonalize.RECIPE}}
+
+    def describe_recommender(self, recommenderArn):
+        return {'recommender': {'recommenderArn': recommenderArn, 'recipeArn': FakePersonalize.RECIPE}}
+
+class FakeSSM:
+    def __init__(self, parameters: Dict[str, str]):
+        self.parameters = parameters
+        self.calls = 0
+
+    def get_parameters(self, Names):
+        self.calls += 1
+        return {
+            'Parameters': [{'Name': name, 'Value': self.parameters[name]} for name in Names if name in self.parameters],
+            'InvalidParameters': [name for name in Names if name not in self.parameters]
+        }
+
+    def get_parameter(self, Name):
+        self.calls += 1
+        if Name not in self.parameters:
+            raise ClientError({'Error': {'Code': 'ParameterNotFound', 'Message': Name},
+                               'ResponseMetadata': {'HTTPStatusCode': 400}}, 'GetParameter')
+        return {'Parameter': {'Name': Name, 'Value': self.parameters[Name]}}
+
+class FakeServiceDiscovery:
+    def discover_instances(self, NamespaceName, ServiceName, **kwargs):
+        return {'Instances': [{'InstanceId': ServiceName, 'Attributes': {'AWS_INSTANCE_IPV4': '127.0.0.1'}}]}
+
+class FakeTable:
+    """ Experiment strategy table; items are experiment configurations keyed by 'id' """
+
+    UPDATE_ASSIGNMENT = re.compile(r'variations\[(\d+)\]\.(\w+) = if_not_exists\([^)]*\) \+ :(\w+)')
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self.items: Dict[str, Dict] = {}
+        self.updates = 0
+        self._lock = threading.Lock()
+
+    def scan(self, **kwargs):
+        # The service only scans for ACTIVE experiments, so the filter is applied as such
+        with self._lock:
+            return {'Items': [json.loads(json.dumps(item)) for item in self.items.values() if item.get('status') == 'ACTIVE']}
+
+    def get_item(self, Key):
+        with self._lock:
+            item = self.items.get(Key['id'])
+            return {'Item': json.loads(json.dumps(item))} if item else {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, **kwargs):
+        with self._lock:
+            self.updates += 1
+            item = self.items[Key['id']]
+            updated = {}
+            for variation, field_name, value_name in FakeTable.UPDATE_ASSIGNMENT.findall(UpdateExpression):
+                config = item['variations'][int(variation)]
+                config[field_name] = config.get(field_name, 0) + ExpressionAttributeValues[f':{value_name}']
+                updated[field_name] = config[field_name]
+            return {'Attributes': {'variations': [updated]}}
+
+class FakeDynamoDB:
+    def __init__(self):
+        self.tables: Dict[str, FakeTable] = {}
+
+    def Table(self, name):
+        return self.tables.setdefault(name, FakeTable(name))
+
+class FakeSession:
+    """ Stands in for boto3.session.Session, returning the fakes above """
+
+    def __init__(self, personalize_runtime: FakePersonalizeRuntime, ssm: FakeSSM):
+        self.services = {
+            'personalize-runtime': personalize_runtime,
+            'personalize': FakePersonalize(),
+            'ssm': ssm,
+            'servicediscovery': FakeServiceDiscovery(),
+            'kinesis': LocalKinesisStream()
+        }
+        self.dynamodb = FakeDynamoDB()
+
+    def client(self, service_name, config = None):
+        return self.services[service_name]
+
+    def resource(self, service_name, config = None):
+        if service_name != 'dynamodb':
+            raise ValueError(f'No fake for resource {service_name}')
+        return self.dynamodb
+
+class ProductsService:
+    """ Stub products service serving /products/id, /products/featured and /products/category """
+
+    def __init__(self, products: List[Dict]):
+        self.products = {product['id']: product for product in products}
+        self.featured = [product for product in products if product['featured'] == 'true']
+        self.by_category = {}
+        for product in products:
+            self.by_category.setdefault(product['category'], []).append(product)
+        self.requests = 0
+
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                service.requests += 1
+                status, body = service.route(urlsplit(self.path).path)
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target = self._server.serve_forever, name = 'fake-products', daemon = True)
+
+    def route(self, path: str):
+        parts = path.strip('/').split('/')
+        if parts[:2] == ['products', 'id'] and len(parts) == 3:
+            found = [self.products[item_id] for item_id in parts[2].split(',') if item_id in self.products]
+            if ',' not in parts[2]:
+                return (200, found[0]) if found else (404, {'error': 'Product not found'})
+            return 200, found
+        if parts == ['products', 'featured']:
+            return 200, self.featured
+        if parts[:2] == ['products', 'category'] and len(parts) == 3:
+            return 200, self.by_category.get(parts[2], [])
+        return 404, {'error': 'Not found'}
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,156 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Load test for the recommendations service.
+
+Each client thread keeps one HTTP/1.1 connection open (as a load balancer would) and
+sends GET requests for the given paths in turn for the duration of the test. The
+throughput, latency percentiles and errors are reported.
+
+The service can be started by the script, either with the development server
+(python app.py) or with gunicorn (gunicorn-cfg.py), or both with --compare to show the
+difference between them. Paths other than /health need the service's dependencies
+(SSM, Personalize, the products service) to be reachable.
+
+python -m benchmarks.load_test --compare [--concurrency 32] [--duration 15] [--path /health]
+python -m benchmarks.load_test --url http://localhost:8005 --path '/recommendations?userID=12'
+"""
+
+import argparse
+import http.client
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'dev': lambda port: ([sys.executable, 'app.py'], {'PORT': str(port)}),
+    'gunicorn': lambda port: ([sys.executable, '-m', 'gunicorn', '--config', 'gunicorn-cfg.py', 'wsgi:app'],
+                              {'GUNICORN_BIND': f'127.0.0.1:{port}'})
+}
+
+def start_server(server, port):
+    command, env = SERVERS[server](port)
+    process = subprocess.Popen(command, cwd = SERVICE_DIR, env = {**os.environ, **env}, start_new_session = True,
+                               stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{server} server exited with {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout = 1)
+            connection.request('GET', '/health')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f'{server} server did not become healthy')
+
+def stop_server(process):
+    # The development server's reloader runs the service in a child process
+    os.killpg(process.pid, signal.SIGTERM)
+    process.wait(timeout = 30)
+
+def client(host, port, paths, stop_at, latencies, errors):
+    connection = None
+    i = 0
+    while time.monotonic() < stop_at:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection(host, port, timeout = 10)
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors.append(response.status)
+            else:
+                latencies.append(time.perf_counter() - start)
+            if response.will_close:
+                connection.close()
+                connection = None
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            if connection is not None:
+                connection.close()
+            connection = None
+    if connection is not None:
+        connection.close()
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))] if values else float('nan')
+
+def run_load(host, port, paths, concurrency, duration):
+    latencies, errors = [], []
+    stop_at = time.monotonic() + duration
+    threads = [threading.Thread(target = client, args = (host, port, paths, stop_at, latencies, errors))
+               for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'rps': len(latencies) / elapsed,
+        'p50': percentile(latencies, 0.5) * 1000,
+        'p95': percentile(latencies, 0.95) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'requests': len(latencies),
+        'errors': len(errors)
+    }
+
+def print_result(name, result):
+    print(f'{name:<10} {result["rps"]:>10.1f} {result["p50"]:>9.2f} {result["p95"]:>9.2f} {result["p99"]:>9.2f} '
+          f'{result["requests"]:>9} {result["errors"]:>7}')
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Load test the recommendations service')
+    parser.add_argument('--url', default = 'http://127.0.0.1:8005', help = 'Service to test when not starting one')
+    parser.add_argument('--path', action = 'append', help = 'Path to request, may be repeated (default /health)')
+    parser.add_argument('--concurrency', type = int, default = 32, help = 'Client connections')
+    parser.add_argument('--duration', type = float, default = 15, help = 'Seconds per test')
+    parser.add_argument('--warmup', type = float, default = 2, help = 'Seconds of load before measuring')
+    parser.add_argument('--start', choices = sorted(SERVERS), help = 'Start the service with this server')
+    parser.add_argument('--compare', action = 'store_true', help = 'Test the development server and gunicorn')
+    parser.add_argument('--port', type = int, default = 8085, help = 'Port for servers started by the script')
+    args = parser.parse_args()
+
+    paths = args.path or ['/health']
+    servers = sorted(SERVERS) if args.compare else [args.start] if args.start else [None]
+
+    print(f'{"server":<10} {"req/s":>10} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"requests":>9} {"errors":>7}')
+    results = {}
+    for server in servers:
+        process = None
+        if server:
+            process = start_server(server, args.port)
+            host, port = '127.0.0.1', args.port
+        else:
+            url = urllib.parse.urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        try:
+            if args.warmup:
+                run_load(host, port, paths, args.concurrency, args.warmup)
+            results[server] = run_load(host, port, paths, args.concurrency, args.duration)
+        finally:
+            if process is not None:
+                stop_server(process)
+        print_result(server or 'service', results[server])
+
+    if args.compare and results['dev']['rps']:
+        print(f'\ngunicorn served {results["gunicorn"]["rps"] / results["dev"]["rps"]:.1f}x the requests per second of the development server')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import threading
+import time
+
+from typing import Callable, Dict
+from boto3.session import Session
+
+log = logging.getLogger(__name__)
+
+class LazyClient:
+    """ Stands in for a boto3 client (or resource) that is only created when it is first used
+
+    Attribute access is forwarded to the registry's client, so a LazyClient can be passed
+    anywhere a client is expected (e.g. client.get_parameter(...), client.exceptions).
+    The client is looked up on each access so the registry can replace it (see reset).
+    """
+
+    def __init__(self, registry: 'ClientRegistry', kind: str, service_name: str, config = None):
+        self._registry = registry
+        self._kind = kind
+        self._service_name = service_name
+        self._config = config
+
+    def __getattr__(self, name):
+        # Probes for special attributes (e.g. ABCMeta checking class attributes for
+        # __isabstractmethod__) must not create the client
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+        return getattr(self._registry.get(self._kind, self._service_name, self._config), name)
+
+    def __repr__(self):
+        return f'<LazyClient {self._kind} {self._service_name}>'
+
+class ClientRegistry:
+    """ Creates boto3 clients and resources on first use from one shared session
+
+    Creating a client loads its service model and resolves credentials and endpoints,
+    which adds up to a noticeable part of the service's start time when every module
+    creates its clients at import, including clients that requests never use. The
+    registry defers that work to the first call, creates each client once (clients
+    are thread safe and are shared) and creates them all from a single session so
+    that loaders, credentials and the region are only resolved once per process.
+    """
+
+    CLIENT = 'client'
+    RESOURCE = 'resource'
+
+    def __init__(self, session_factory: Callable[[], Session] = Session):
+        self._session_factory = session_factory
+        self._session = None
+        self._lock = threading.Lock()
+        self._clients = {}
+        # Seconds spent creating each client, keyed by "kind:service"
+        self._created = {}
+
+    def session(self) -> Session:
+        """ Returns the shared session, creating it on first use """
+        with self._lock:
+            return self.__session()
+
+    def __session(self) -> Session:
+        if self._session is None:
+            self._session = self._session_factory()
+        return self._session
+
+    def get(self, kind: str, service_name: str, config = None):
+        """ Returns the client or resource for a service and config, creating it on first use """
+        key = (kind, service_name, config)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+
+        # Session and client creation is not thread safe, so it is serialized
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                start = time.perf_counter()
+                session = self.__session()
+                if kind == ClientRegistry.RESOURCE:
+                    client = session.resource(service_name, config = config)
+                else:
+                    client = session.client(service_name, config = config)
+                elapsed = time.perf_counter() - start
+                self._clients[key] = client
+                name = f'{kind}:{service_name}'
+                self._created[name] = self._created.get(name, 0.0) + elapsed
+                log.debug('ClientRegistry - created %s in %.1f ms', name, elapsed * 1000)
+        return client
+
+    def client(self, service_name: str, config = None) -> LazyClient:
+        """ Returns a client for the service that is created on first use """
+        return LazyClient(self, ClientRegistry.CLIENT, service_name, config)
+
+    def resource(self, service_name: str, config = None) -> LazyClient:
+        """ Returns a resource for the service that is created on first use """
+        return LazyClient(self, ClientRegistry.RESOURCE, service_name, config)
+
+    def reset(self, session_factory: Callable[[], Session] = None):
+        """ Drops the session and clients so they are created again on next use
+
+        A session_factory replaces the one used to create the session, e.g. to serve
+        clients from local stand-ins in benchmarks.
+        """
+        with self._lock:
+            if session_factory is not None:
+                self._session_factory = session_factory
+            self._session = None
+            self._clients = {}
+            self._created = {}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'session_created': self._session is not None,
+                'clients': len(self._clients),
+                'creation_ms': {name: round(seconds * 1000, 3) for name, seconds in self._created.items()}
+            }
+
+# Shared registry used by the service and the experimentation package
+aws_clients = ClientRegistry()
@@ -0,0 +1,105 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import threading
+
+import numpy as np
+
+from typing import Dict, Optional, Sequence
+
+log = logging.getLogger(__name__)
+
+class BanditState:
+    """ In-process Beta posteriors of the variations of a multi-armed bandit experiment
+
+    The posterior of each variation is Beta(conversions + 1, exposures - conversions + 1).
+    Counts are the persisted counts (from the experiment item in DynamoDB) plus the
+    exposures and conversions observed by this process since they were read, so the
+    bandit learns from every request rather than only when counts are read back.
+    reconcile() replaces the persisted counts with fresh ones; local observations that
+    have been written since are part of those counts and only the increments still
+    pending in the counter aggregator are kept on top of them.
+
+    The alpha and beta arrays are replaced rather than updated in place, so draws
+    read a consistent pair without taking the lock.
+    """
+
+    def __init__(self, variation_count: int):
+        self.variation_count = variation_count
+        self._lock = threading.Lock()
+        self._persisted_exposures = np.zeros(variation_count)
+        self._persisted_conversions = np.zeros(variation_count)
+        self._local_exposures = np.zeros(variation_count)
+        self._local_conversions = np.zeros(variation_count)
+        self._posterior = self.__posterior()
+        self._counters = {
+            'observed_exposures': 0,
+            'observed_conversions': 0,
+            'reconciles': 0
+        }
+
+    def reconcile(self, exposures: Sequence[int], conversions: Sequence[int], pending: Optional[Dict[int, Dict[str, int]]] = None):
+        """ Sets the persisted counts and resets local observations to the increments not yet persisted
+
+        pending is keyed by variation index, as returned by VariationCounterAggregator.pending().
+        """
+        pending = pending or {}
+        local_exposures = np.zeros(self.variation_count)
+        local_conversions = np.zeros(self.variation_count)
+        for variation, fields in pending.items():
+            if 0 <= variation < self.variation_count:
+                local_exposures[variation] = fields.get('exposures', 0)
+                local_conversions[variation] = fields.get('conversions', 0)
+
+        with self._lock:
+            self._persisted_exposures = np.asarray(exposures, dtype = float)
+            self._persisted_conversions = np.asarray(conversions, dtype = float)
+            self._local_exposures = local_exposures
+            self._local_conversions = local_conversions
+            self._posterior = self.__posterior()
+            self._counters['reconciles'] += 1
+
+    def observe(self, variation: int, exposures: int = 0, conversions: int = 0):
+        """ Folds exposures and/or conversions observed by this process into the posterior """
+        with self._lock:
+            if exposures:
+                self._local_exposures[variation] += exposures
+                self._counters['observed_exposures'] += exposures
+            if conversions:
+                self._local_conversions[variation] += conversions
+                self._counters['observed_conversions'] += conversions
+            self._posterior = self.__posterior()
+
+    def select(self, rng: np.random.RandomState = None) -> int:
+        """ Returns the variation with the highest draw from its posterior (Thompson sampling) """
+        return int(self.select_many(1, rng)[0])
+
+    def select_many(self, count: int, rng: np.random.RandomState = None) -> np.ndarray:
+        """ Assigns variations for count users with a single draw of a (count, variations) matrix
+
+        Every assignment is made from the same posterior, as if the users arrived at once.
+        """
+        alpha, beta = self._posterior
+        theta = (rng or np.random).beta(alpha, beta, size = (count, self.variation_count))
+        return np.argmax(theta, axis = 1)
+
+    def posterior(self):
+        """ Returns the (alpha, beta) arrays of the variations' Beta posteriors """
+        alpha, beta = self._posterior
+        return alpha.copy(), beta.copy()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['exposures'] = (self._persisted_exposures + self._local_exposures).tolist()
+            stats['conversions'] = (self._persisted_conversions + self._local_conversions).tolist()
+        return stats
+
+    def __posterior(self):
+        """ Computes the Beta parameters; must be called with the lock held (or from __init__) """
+        exposures = self._persisted_exposures + self._local_exposures
+        conversions = self._persisted_conversions + self._local_conversions
+        # Conversions can be observed before the exposures they follow are read back,
+        # so beta is kept valid rather than letting the counts go negative.
+        return conversions + 1, np.maximum(exposures - conversions, 0) + 1
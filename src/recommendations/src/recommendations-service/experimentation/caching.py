@@ -0,0 +1,94 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import mmap
+import time
+import zlib
+
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Hashable, Iterable, Optional
+
+class InvalidatableCache(ABC):
+    """ An in-process cache that can be inspected and invalidated through the /admin/caches endpoints """
+
+    @abstractmethod
+    def invalidate(self, keys: Iterable[Hashable] = None) -> int:
+        """ Drops the entries for the given keys (or all entries) and returns how many were dropped """
+
+    @abstractmethod
+    def stats(self) -> Dict:
+        """ Returns JSON serializable counters for the cache """
+
+def ratio(part: float, whole: float) -> float:
+    """ Returns part / whole, or 0.0 before anything was counted """
+    return part / whole if whole else 0.0
+
+class TTLDict:
+    """ Dict whose entries expire ttl seconds after they are set
+
+    Expired entries are dropped when they are read rather than by a sweeper thread,
+    so a TTLDict can be created at import time in a process that gunicorn forks
+    (preload_app): there is no thread that would not survive the fork and no lock
+    that could be held by one at the time. Single dict operations are atomic, so
+    it can be shared between request threads without a lock.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        # key -> (value, monotonic expiry time)
+        self._entries: Dict[Hashable, tuple] = {}
+
+    def get(self, key: Hashable, default: Any = None) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry[1] <= time.monotonic():
+            self._entries.pop(key, None)
+            return default
+        return entry[0]
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+_MISSING = object()
+
+class SharedInvalidations:
+    """ Invalidation times shared by a process and the worker processes forked from it
+
+    gunicorn runs several worker processes, each with its own in-process caches, so an
+    invalidation handled by one worker has to reach the others. The times are kept in an
+    anonymous shared memory mapping created before the fork (gunicorn-cfg.py sets
+    preload_app), so every worker sees the invalidations of the others. Caches compare
+    the time a value was computed with invalidated_at() for its key when reading it.
+
+    Keys are hashed into a fixed number of slots. Keys that share a slot are invalidated
+    together, which only causes extra misses. Invalidations do not reach other hosts; the
+    TTL of the caches bounds how long those serve invalidated values.
+    """
+
+    def __init__(self, slots: int = 65536):
+        self.slots = slots
+        # One time per slot plus one for invalidating every key
+        self._buffer = mmap.mmap(-1, 8 * (slots + 1))
+        self._times = memoryview(self._buffer).cast('d')
+
+    def invalidate(self, key: Hashable = None):
+        """ Records that values for the key (or for all keys) computed until now are invalid """
+        # CLOCK_MONOTONIC is system wide, so the times compare across processes
+        self._times[self.slots if key is None else self.__slot(key)] = time.monotonic()
+
+    def invalidated_at(self, key: Hashable) -> float:
+        """ Returns the last time values for the key were invalidated (0 if never) """
+        return max(self._times[self.__slot(key)], self._times[self.slots])
+
+    def __slot(self, key: Hashable) -> int:
+        return zlib.crc32(str(key).encode('utf-8')) % self.slots
@@ -0,0 +1,103 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import threading
+import time
+
+from typing import Dict
+
+log = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """ Raised instead of calling a dependency whose circuit breaker is open """
+    pass
+
+class CircuitBreaker:
+    """ Stops calling a failing dependency for a cool-down period
+
+    After failure_threshold consecutive failures the circuit opens and allow()
+    returns False for cooldown seconds. Then a single trial call is allowed
+    (half-open): success closes the circuit and failure opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, cooldown: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self._state = CircuitBreaker.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_progress = False
+
+        self._counters = {
+            'successes': 0,
+            'failures': 0,
+            'rejected': 0,
+            'opened': 0
+        }
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow(self) -> bool:
+        """ Returns True if a call may be made now """
+        with self._lock:
+            if self._state == CircuitBreaker.CLOSED:
+                return True
+
+            if self._state == CircuitBreaker.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self._state = CircuitBreaker.HALF_OPEN
+
+            if self._state == CircuitBreaker.HALF_OPEN and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return True
+
+            self._counters['rejected'] += 1
+            return False
+
+    def check(self):
+        """ Raises CircuitOpenError if a call may not be made now """
+        if not self.allow():
+            raise CircuitOpenError(f'Circuit for {self.name} is open')
+
+    def record_success(self):
+        with self._lock:
+            self._counters['successes'] += 1
+            self._consecutive_failures = 0
+            self._trial_in_progress = False
+            if self._state != CircuitBreaker.CLOSED:
+                log.info('CircuitBreaker - %s closed', self.name)
+                self._state = CircuitBreaker.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._counters['failures'] += 1
+            self._consecutive_failures += 1
+            self._trial_in_progress = False
+            if self._state == CircuitBreaker.HALF_OPEN or \
+                    (self._state == CircuitBreaker.CLOSED and self._consecutive_failures >= self.failure_threshold):
+                log.warning('CircuitBreaker - %s opened after %d consecutive failures', self.name, self._consecutive_failures)
+                self._state = CircuitBreaker.OPEN
+                self._opened_at = time.monotonic()
+                self._counters['opened'] += 1
+
+    def reset(self):
+        with self._lock:
+            self._state = CircuitBreaker.CLOSED
+            self._consecutive_failures = 0
+            self._trial_in_progress = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['state'] = self._state
+            stats['consecutive_failures'] = self._consecutive_failures
+        return stats
@@ -0,0 +1,136 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import copy
+import json
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable
+from experimentation import deadline
+from experimentation.caching import InvalidatableCache, ratio
+from experimentation.deadline import DeadlineExceededError
+
+log = logging.getLogger(__name__)
+
+def make_key(*parts) -> str:
+    """ Builds a normalized key from call arguments (dict ordering does not matter) """
+    return json.dumps(parts, sort_keys = True, default = str, separators = (',', ':'))
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class SingleFlight(InvalidatableCache):
+    """ Shares one execution between concurrent calls with the same key
+
+    The first caller for a key runs the function while callers arriving with
+    the same key wait for and share its result (or exception). A successful
+    result is also reused for ttl seconds, unless the cacheable predicate
+    rejects it. Results are deep copied for each caller, so callers can
+    mutate what they get back without affecting the others. Waiting callers
+    give up with DeadlineExceededError when their request's budget runs out.
+    """
+
+    def __init__(self, ttl: float = 2.0, max_size: int = 1000, copy_fn: Callable[[Any], Any] = copy.deepcopy):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._copy = copy_fn
+
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, _Call] = {}
+        # key -> (value, monotonic expiry time)
+        self._results: OrderedDict = OrderedDict()
+
+        self._counters = {
+            'calls': 0,
+            'executions': 0,
+            'coalesced': 0,
+            'cache_hits': 0,
+            'errors': 0,
+            'wait_timeouts': 0
+        }
+
+    def do(self, key: str, func: Callable[[], Any], cacheable: Callable[[Any], bool] = None):
+        """ Returns func's result, sharing it with concurrent and recent calls for the same key """
+        with self._lock:
+            self._counters['calls'] += 1
+
+            entry = self._results.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._counters['cache_hits'] += 1
+                    value = entry[0]
+                    call = None
+                else:
+                    del self._results[key]
+                    entry = None
+
+            if entry is None:
+                call = self._in_flight.get(key)
+                leader = call is None
+                if leader:
+                    call = _Call()
+                    self._in_flight[key] = call
+                    self._counters['executions'] += 1
+                else:
+                    self._counters['coalesced'] += 1
+
+        if entry is not None:
+            return self._copy(value)
+
+        if not leader:
+            if not call.done.wait(timeout = deadline.remaining()):
+                with self._lock:
+                    self._counters['wait_timeouts'] += 1
+                raise DeadlineExceededError(f'request budget spent waiting for in-flight call {key}')
+            if call.error is not None:
+                raise call.error
+            return self._copy(call.value)
+
+        try:
+            value = func()
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self._counters['errors'] += 1
+            raise
+        else:
+            # Keep a private copy for followers and the result cache; the leader gets the original
+            call.value = self._copy(value)
+            if self.ttl > 0 and (cacheable is None or cacheable(value)):
+                with self._lock:
+                    self._results[key] = (call.value, time.monotonic() + self.ttl)
+                    self._results.move_to_end(key)
+                    while len(self._results) > self.max_size:
+                        self._results.popitem(last = False)
+            return value
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            call.done.set()
+
+    def invalidate(self, keys: Iterable[str] = None) -> int:
+        """ Drops the given (or all) cached results; in-flight calls are not affected """
+        with self._lock:
+            if keys is None:
+                removed = len(self._results)
+                self._results.clear()
+            else:
+                removed = sum(1 for key in keys if self._results.pop(key, None) is not None)
+        return removed
+
+    def stats(self) -> Dict:
+        """ Returns call counters, the share of calls that did not execute and current sizes """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._in_flight)
+            stats['size'] = len(self._results)
+
+        saved = stats['coalesced'] + stats['cache_hits']
+        stats['saved_ratio'] = ratio(saved, stats['calls'])
+        return stats
@@ -0,0 +1,173 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from aws_xray_sdk.core import xray_recorder
+from experimentation import deadline
+
+log = logging.getLogger(__name__)
+
+# Upper bound on the threads shared by all fan-out calls in the process
+MAX_WORKERS = int(os.environ.get('RESOLVER_MAX_WORKERS', 32))
+
+# Default deadline (seconds) for a fan-out started by a request
+DEFAULT_TIMEOUT = float(os.environ.get('RESOLVER_TIMEOUT', 2.5))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_worker_state = threading.local()
+
+class TaskResult:
+    """ Outcome of one task run by run_concurrently """
+
+    def __init__(self, value = None, error: Exception = None):
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+def get_executor() -> ThreadPoolExecutor:
+    """ Returns the shared, bounded executor, creating it in each (forked) process on first use """
+    global _executor, _executor_pid
+
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers = MAX_WORKERS, thread_name_prefix = 'resolver')
+                _executor_pid = pid
+    return _executor
+
+def run_concurrently(tasks: List[Callable], timeout: float = None) -> List[TaskResult]:
+    """ Runs the tasks on the shared executor and waits for them until the deadline
+
+    Returns one TaskResult per task, in order. Tasks that raise have their exception
+    in TaskResult.error and tasks still running at the deadline get a TimeoutError;
+    their eventual results are discarded. When called from one of the executor's own
+    threads (a nested fan-out) the tasks run inline so the pool cannot deadlock on itself.
+
+    Tasks run in a copy of the caller's context, so the request's deadline (which also
+    caps the timeout) and stage timings carry over to the worker threads.
+    """
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT
+    timeout = min(timeout, deadline.remaining(default = timeout))
+
+    if len(tasks) == 1 or getattr(_worker_state, 'active', False):
+        return [_run_inline(task) for task in tasks]
+
+    trace_entity = _current_trace_entity()
+    executor = get_executor()
+    futures = [executor.submit(contextvars.copy_context().run, _run_in_worker, task, trace_entity) for task in tasks]
+
+    done, not_done = wait(futures, timeout = timeout)
+
+    results = []
+    for future in futures:
+        if future in done:
+            error = future.exception()
+            results.append(TaskResult(error = error) if error else TaskResult(value = future.result()))
+        else:
+            future.cancel()
+            results.append(TaskResult(error = TimeoutError(f'Task did not complete within {timeout}s')))
+
+    if not_done:
+        log.warning('run_concurrently - %d of %d tasks did not complete within %ss', len(not_done), len(tasks), timeout)
+
+    return results
+
+def run_windowed(tasks: Iterable[Callable], window: int, budget: float = None) -> Iterator[List[Tuple[int, TaskResult]]]:
+    """ Runs the tasks on the shared executor with at most window of them in flight
+
+    Yields lists of (task index, TaskResult) for the tasks that completed together, so callers
+    can batch follow-up work, and starts the next task as soon as one completes so a slow task
+    only holds up its own slot. Each task runs with a request deadline of budget seconds
+    (deadline.REQUEST_BUDGET by default) from when it starts; a task still running when its
+    budget is spent gets a TimeoutError and its eventual result is discarded. Like
+    run_concurrently, tasks run inline when called from one of the executor's own threads.
+    """
+    if budget is None:
+        budget = deadline.REQUEST_BUDGET
+    pending = enumerate(tasks)
+
+    if getattr(_worker_state, 'active', False):
+        for index, task in pending:
+            yield [(index, _run_inline(lambda task=task: contextvars.copy_context().run(_run_with_deadline, task, budget)))]
+        return
+
+    trace_entity = _current_trace_entity()
+    executor = get_executor()
+    # future -> (task index, monotonic time its budget is spent)
+    in_flight = {}
+
+    def fill():
+        while len(in_flight) < window:
+            entry = next(pending, None)
+            if entry is None:
+                return
+            index, task = entry
+            future = executor.submit(contextvars.copy_context().run, _run_in_worker,
+                                     lambda task=task: _run_with_deadline(task, budget), trace_entity)
+            in_flight[future] = (index, time.monotonic() + budget)
+
+    fill()
+    while in_flight:
+        expires = min(entry[1] for entry in in_flight.values())
+        done, _ = wait(in_flight, timeout = max(0.0, expires - time.monotonic()), return_when = FIRST_COMPLETED)
+
+        completed = []
+        for future in done:
+            index = in_flight.pop(future)[0]
+            error = future.exception()
+            completed.append((index, TaskResult(error = error) if error else TaskResult(value = future.result())))
+
+        now = time.monotonic()
+        for future, (index, expires) in list(in_flight.items()):
+            if expires <= now:
+                del in_flight[future]
+                future.cancel()
+                completed.append((index, TaskResult(error = TimeoutError(f'Task did not complete within {budget}s'))))
+                log.warning('run_windowed - task %d did not complete within %ss', index, budget)
+
+        fill()
+        if completed:
+            yield sorted(completed, key = lambda entry: entry[0])
+
+def _run_with_deadline(task: Callable, budget: float):
+    deadline.start(budget)
+    return task()
+
+def _run_inline(task: Callable) -> TaskResult:
+    try:
+        return TaskResult(value = task())
+    except Exception as e:
+        return TaskResult(error = e)
+
+def _run_in_worker(task: Callable, trace_entity):
+    _worker_state.active = True
+    if trace_entity is not None:
+        # Attach AWS calls made by the task to the request's X-Ray trace.
+        xray_recorder.set_trace_entity(trace_entity)
+    try:
+        return task()
+    finally:
+        _worker_state.active = False
+        if trace_entity is not None:
+            xray_recorder.clear_trace_entities()
+
+def _current_trace_entity():
+    try:
+        return xray_recorder.get_trace_entity()
+    except Exception:
+        return None
@@ -0,0 +1,212 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import atexit
+import logging
+import os
+import threading
+
+from typing import Dict, Optional
+from experimentation.parameters import is_dependency_failure
+
+log = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ('exposures', 'conversions')
+
+def without_counts(config: Dict) -> Dict:
+    """ Returns an experiment configuration without the variations' counters """
+    return {
+        **config,
+        'variations': [{k: v for k, v in variation.items() if k not in COUNTER_FIELDS} for variation in config.get('variations', [])]
+    }
+
+class VariationCounterAggregator:
+    """ Coalesces experiment exposure and conversion increments into periodic DynamoDB writes
+
+    Built-in experiments count exposures and conversions on the variations of the
+    experiment item. Rather than issuing an update_item per request against the
+    same (hot) item, increments are accumulated in memory per (experiment,
+    variation) and a background thread writes them every flush_interval seconds
+    with a single update_item per variation. A flush is also triggered early once
+    max_pending increments are buffered, and pending increments are drained when
+    the process exits. If the process dies abruptly, at most one interval of
+    increments is lost. Writes that DynamoDB rejects as invalid (e.g. for a deleted
+    experiment) are dropped, and other failed writes are retried up to
+    max_write_attempts times before they are dropped too.
+
+    Counts returned to callers are the last persisted value plus the increments
+    not yet written, so they are eventually consistent. The persisted value is
+    the latest of the counts read back with the experiment item (see
+    record_persisted) and those returned by this process's own writes.
+    """
+
+    def __init__(self, flush_interval: float = 1.0, max_pending: int = 1000, max_write_attempts: int = 5):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_write_attempts = max_write_attempts
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (table name, experiment ID, variation index) -> {field: increment}
+        self._pending: Dict[tuple, Dict[str, int]] = {}
+        self._pending_count = 0
+        self._tables = {}
+        # (table name, experiment ID, variation index, field) -> last persisted count
+        self._persisted: Dict[tuple, int] = {}
+        # (table name, experiment ID, variation index) -> consecutive failed writes
+        self._failed_attempts: Dict[tuple, int] = {}
+
+        self._wakeup = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+        self._counters = {
+            'increments': 0,
+            'flushes': 0,
+            'writes': 0,
+            'write_errors': 0,
+            'dropped_writes': 0
+        }
+
+        atexit.register(self.drain)
+
+    def increment(self, table, experiment_id: str, variation: int, field_name: str, count: int = 1) -> int:
+        """ Buffers an increment and returns the (eventually consistent) count for the variation field """
+        if field_name not in COUNTER_FIELDS:
+            raise ValueError(f'Unsupported counter field {field_name}')
+
+        key = (table.table_name, experiment_id, variation)
+
+        with self._lock:
+            self._tables[table.table_name] = table
+            fields = self._pending.setdefault(key, {})
+            fields[field_name] = fields.get(field_name, 0) + count
+            self._pending_count += count
+            self._counters['increments'] += count
+
+            estimate = self._persisted.get(key + (field_name,), 0) + fields[field_name]
+            flush_now = self._pending_count >= self.max_pending
+
+            self.__ensure_flusher()
+
+        if flush_now:
+            self._wakeup.set()
+
+        return estimate
+
+    def record_persisted(self, table_name: str, experiment_id: str, variation: int, counts: Dict):
+        """ Records the counts of a variation read from the experiment item """
+        with self._lock:
+            for field_name in COUNTER_FIELDS:
+                if field_name in counts:
+                    key = (table_name, experiment_id, variation, field_name)
+                    # Counts only grow, so an older read never replaces a newer write
+                    self._persisted[key] = max(self._persisted.get(key, 0), int(counts[field_name]))
+
+    def flush(self):
+        """ Writes all buffered increments to DynamoDB """
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {}
+                self._pending_count = 0
+
+            for key, fields in pending.items():
+                table_name, experiment_id, variation = key
+                try:
+                    attributes = self.__write(self._tables[table_name], experiment_id, variation, fields)
+                except Exception as e:
+                    self.__write_failed(key, fields, e)
+                    continue
+
+                with self._lock:
+                    self._failed_attempts.pop(key, None)
+                    self._counters['writes'] += 1
+                    for field_name, value in attributes.items():
+                        self._persisted[key + (field_name,)] = max(self._persisted.get(key + (field_name,), 0), int(value))
+
+            with self._lock:
+                self._counters['flushes'] += 1
+
+    def pending(self, table_name: str, experiment_id: str) -> Dict[int, Dict[str, int]]:
+        """ Returns the increments for an experiment that have not been written yet, keyed by variation """
+        with self._lock:
+            return {key[2]: dict(fields) for key, fields in self._pending.items() if key[:2] == (table_name, experiment_id)}
+
+    def drain(self):
+        """ Flushes remaining increments; registered to run at interpreter exit """
+        if self._pending:
+            log.info('VariationCounterAggregator - draining pending experiment counters')
+            self.flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['pending'] = self._pending_count
+            stats['pending_variations'] = len(self._pending)
+        return stats
+
+    def __write(self, table, experiment_id: str, variation: int, fields: Dict[str, int]) -> Dict[str, int]:
+        """ Applies the increments for one variation with a single update_item and returns the new values """
+        assignments = []
+        values = {':zero': 0}
+        for field_name, count in fields.items():
+            path = f'variations[{variation}].{field_name}'
+            assignments.append(f'{path} = if_not_exists({path}, :zero) + :{field_name}')
+            values[f':{field_name}'] = count
+
+        response = table.update_item(
+            Key={'id': experiment_id},
+            UpdateExpression='SET ' + ', '.join(assignments),
+            ExpressionAttributeValues=values,
+            ReturnValues='UPDATED_NEW'
+        )
+
+        # UPDATED_NEW only returns the updated variation so it is always at index 0.
+        updated = response['Attributes']['variations'][0]
+        return {field_name: updated[field_name] for field_name in fields if field_name in updated}
+
+    def __write_failed(self, key: tuple, fields: Dict[str, int], error: Exception):
+        """ Requeues the increments of a failed write, or drops them if retrying cannot help """
+        _, experiment_id, variation = key
+        with self._lock:
+            self._counters['write_errors'] += 1
+            attempts = self._failed_attempts.get(key, 0) + 1
+            retry = is_dependency_failure(error) and attempts < self.max_write_attempts
+            if retry:
+                self._failed_attempts[key] = attempts
+            else:
+                self._failed_attempts.pop(key, None)
+                self._counters['dropped_writes'] += 1
+
+        if not retry:
+            log.error(f'VariationCounterAggregator - dropping counters {fields} for experiment {experiment_id} variation {variation} after {attempts} attempt(s): {error}')
+            return
+
+        log.warning(f'VariationCounterAggregator - could not write counters for experiment {experiment_id} variation {variation}; will retry: {error}')
+        self.__requeue(key, fields)
+
+    def __requeue(self, key: tuple, fields: Dict[str, int]):
+        with self._lock:
+            pending = self._pending.setdefault(key, {})
+            for field_name, count in fields.items():
+                pending[field_name] = pending.get(field_name, 0) + count
+                self._pending_count += count
+
+    def __ensure_flusher(self):
+        """ Lazily (re)starts the flush thread; must be called with the lock held """
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=self.__run, name='experiment-counter-flush', daemon=True)
+            self._flusher.start()
+
+    def __run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception(f'VariationCounterAggregator - unexpected error flushing counters: {e}')
+
+variation_counters = VariationCounterAggregator(
+    flush_interval = float(os.environ.get('EXPERIMENT_COUNTER_FLUSH_INTERVAL', 1.0))
+)
@@ -0,0 +1,56 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import time
+
+from contextvars import ContextVar
+from typing import Optional
+
+# Default time budget (seconds) for handling one request
+REQUEST_BUDGET = float(os.environ.get('REQUEST_TIME_BUDGET', 2.0))
+
+class DeadlineExceededError(Exception):
+    """ Raised instead of starting work that cannot finish within the request's time budget """
+    pass
+
+class Deadline:
+    """ Point in time by which the current request should have produced a response """
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def check(self, required: float = 0.0, what: str = 'call'):
+        """ Raises DeadlineExceededError if less than required seconds of the budget are left """
+        remaining = self.remaining()
+        if remaining <= required:
+            raise DeadlineExceededError(f'{remaining * 1000:.0f}ms left of the {self.budget}s budget; skipping {what}')
+
+_current: ContextVar[Optional[Deadline]] = ContextVar('request_deadline', default = None)
+
+def start(budget: float = None) -> Deadline:
+    """ Starts a new deadline for the work done in the current context (e.g. a request) """
+    deadline = Deadline(REQUEST_BUDGET if budget is None else budget)
+    _current.set(deadline)
+    return deadline
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+def remaining(default: float = None) -> Optional[float]:
+    """ Returns the seconds left in the current deadline, or default when there is none """
+    deadline = _current.get()
+    return deadline.remaining() if deadline is not None else default
+
+def check(required: float = 0.0, what: str = 'call'):
+    """ Raises DeadlineExceededError if the current deadline has less than required seconds left """
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check(required, what)
+
+def clear():
+    _current.set(None)
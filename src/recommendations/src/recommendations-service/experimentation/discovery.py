@@ -0,0 +1,151 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import itertools
+import logging
+import os
+import threading
+import time
+
+from typing import Dict, Iterable, List
+from experimentation.aws_clients import aws_clients
+from experimentation.caching import InvalidatableCache
+from experimentation.coalescing import SingleFlight
+
+log = logging.getLogger(__name__)
+
+NAMESPACE_NAME = 'retaildemostore.local'
+
+class ServiceDiscovery(InvalidatableCache):
+    """ Cached, health-aware lookup of service instances registered in AWS Cloud Map
+
+    The HEALTHY instances of a service are cached for a TTL and requests are
+    balanced across them round-robin. An instance that a caller could not connect
+    to can be evicted, which removes it from rotation until the eviction period
+    elapses or until Cloud Map no longer returns it. If every known instance has
+    been evicted, the full list is used again rather than failing the request.
+    Concurrent lookups of a service that is not cached (or has expired) share
+    one call to Cloud Map.
+    """
+
+    def __init__(self, client, namespace: str = NAMESPACE_NAME, ttl: float = 30, eviction_period: float = 30):
+        self._client = client
+        self.namespace = namespace
+        self.ttl = ttl
+        self.eviction_period = eviction_period
+
+        self._lock = threading.Lock()
+        # Service name -> (list of hosts, monotonic time fetched, round-robin counter)
+        self._services: Dict[str, tuple] = {}
+        # (service name, host) -> monotonic time the eviction expires
+        self._evicted: Dict[tuple, float] = {}
+
+        # Shares refreshes between concurrent callers; the round-robin counter must not be copied
+        self._flight = SingleFlight(ttl = 0, copy_fn = lambda result: result)
+
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'refresh_errors': 0,
+            'evictions': 0,
+            'invalidations': 0
+        }
+
+    def get_host(self, service_name: str) -> str:
+        """ Returns the IPv4 address of a healthy instance for the service """
+        hosts, counter = self._get_hosts(service_name)
+
+        now = time.monotonic()
+        with self._lock:
+            available = [host for host in hosts if self._evicted.get((service_name, host), 0) <= now]
+        if not available:
+            log.warning('ServiceDiscovery - all instances of %s are evicted; ignoring evictions', service_name)
+            available = hosts
+
+        return available[next(counter) % len(available)]
+
+    def get_hosts(self, service_name: str) -> List[str]:
+        """ Returns the IPv4 addresses of all healthy instances for the service """
+        return list(self._get_hosts(service_name)[0])
+
+    def evict(self, service_name: str, host: str):
+        """ Takes an instance out of rotation, typically after a connection error """
+        with self._lock:
+            self._evicted[(service_name, host)] = time.monotonic() + self.eviction_period
+            self._counters['evictions'] += 1
+        log.warning('ServiceDiscovery - evicted %s instance %s for %ss', service_name, host, self.eviction_period)
+
+    def invalidate(self, keys: Iterable[str] = None) -> int:
+        """ Drops the cached instances for the given service names (or all services) """
+        with self._lock:
+            if keys is None:
+                removed = len(self._services)
+                self._services.clear()
+                self._evicted.clear()
+            else:
+                removed = 0
+                for service_name in keys:
+                    if self._services.pop(service_name, None) is not None:
+                        removed += 1
+                    self._evicted = {key: expires for key, expires in self._evicted.items() if key[0] != service_name}
+            self._counters['invalidations'] += removed
+        return removed
+
+    def stats(self) -> Dict:
+        """ Returns cache counters and the currently known instances """
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self._counters)
+            stats['services'] = {name: list(entry[0]) for name, entry in self._services.items()}
+            stats['evicted'] = [f'{service_name}/{host}' for (service_name, host), expires in self._evicted.items() if expires > now]
+        return stats
+
+    def _get_hosts(self, service_name: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._services.get(service_name)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._counters['hits'] += 1
+                return entry[0], entry[2]
+            self._counters['misses'] += 1
+
+        return self._flight.do(service_name, lambda: self._refresh(service_name, entry))
+
+    def _refresh(self, service_name: str, entry):
+        """ Fetches the healthy instances of a service from Cloud Map and caches them """
+        now = time.monotonic()
+        try:
+            response = self._client.discover_instances(
+                NamespaceName=self.namespace,
+                ServiceName=service_name,
+                HealthStatus='HEALTHY'
+            )
+        except Exception as e:
+            if entry is None:
+                raise
+            # Keep using the instances we already know about until Cloud Map recovers.
+            log.warning('ServiceDiscovery - could not refresh instances for %s; using cached instances: %s', service_name, e)
+            with self._lock:
+                self._counters['refresh_errors'] += 1
+                self._services[service_name] = (entry[0], now, entry[2])
+            return entry[0], entry[2]
+
+        hosts = [instance['Attributes']['AWS_INSTANCE_IPV4'] for instance in response['Instances']]
+        if not hosts:
+            raise Exception(f'No healthy instances found for service {service_name}')
+
+        log.debug('ServiceDiscovery - resolved %s instances %s', service_name, hosts)
+
+        with self._lock:
+            counter = entry[2] if entry is not None else itertools.count()
+            self._services[service_name] = (hosts, time.monotonic(), counter)
+            # Forget evictions for instances that are no longer registered.
+            self._evicted = {key: expires for key, expires in self._evicted.items()
+                             if key[0] != service_name or key[1] in hosts}
+
+        return hosts, counter
+
+service_discovery = ServiceDiscovery(
+    aws_clients.client('servicediscovery'),
+    ttl = float(os.environ.get('SERVICE_DISCOVERY_TTL', 30))
+)
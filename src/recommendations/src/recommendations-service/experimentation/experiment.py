@@ -4,9 +4,9 @@
 import logging
 
 from datetime import datetime
-from typing import Dict
-from botocore.exceptions import ClientError
+from typing import Dict, List
 from abc import ABC, abstractmethod
+from experimentation.counters import variation_counters
 from experimentation.resolvers import ResolverFactory
 
 log = logging.getLogger(__name__)
@@ -19,6 +19,10 @@ class Variation:
 class Experiment(ABC):
     """ Base class for all experiment types """
 
+    # Status of each correlation ID passed to track_conversions
+    CONVERSION_TRACKED = 'tracked'
+    CONVERSION_INVALID = 'invalid'
+
     def __init__(self, **data):
         self.id = data['id']
         self.feature = data['feature']
@@ -41,6 +45,25 @@ class Experiment(ABC):
         """ Call this method to track a conversion/outcome for an experiment """
         pass
 
+    def track_conversions(self, correlation_ids: List[str], timestamp: datetime) -> List[str]:
+        """ Tracks a conversion for each correlation ID and returns the status of each, in order """
+        statuses = []
+        for correlation_id in correlation_ids:
+            try:
+                self.track_conversion(correlation_id, timestamp)
+                statuses.append(Experiment.CONVERSION_TRACKED)
+            except Exception as e:
+                log.warning(f'Could not track conversion for {correlation_id}: {e}')
+                statuses.append(Experiment.CONVERSION_INVALID)
+        return statuses
+
+    def reconcile(self, config: Dict):
+        """ Applies the counters read back for this experiment when nothing else in its configuration changed
+
+        Counters are only written (see VariationCounterAggregator), so by default they are ignored.
+        """
+        pass
+
     def _create_correlation_id(self, user_id: str, variation_index: int, result_rank: int) -> str:
         """ Returns an identifier representing a recommended item for an experiment """
         return f'{self.id}~{user_id}~{variation_index}~{result_rank}'
@@ -54,9 +77,40 @@ class BuiltInExperiment(Experiment):
     def __init__(self, table, **data):
         super().__init__(**data)
         self._table = table
+        self.__record_persisted_counts(data['variations'])
+
+    def reconcile(self, config: Dict):
+        """ Records the counts read back so the counts returned by increments include them """
+        self.__record_persisted_counts(config['variations'])
 
     def track_conversion(self, correlation_id: str, timestamp: datetime) -> int:
         """ Call this method to track a conversion/outcome for an experiment """
+        variation_index = self._get_variation_index(correlation_id)
+
+        return self._increment_convert_count(variation_index)
+
+    def track_conversions(self, correlation_ids: List[str], timestamp: datetime) -> List[str]:
+        """ Tracks conversions for many correlation IDs with one increment per variation """
+        statuses = []
+        counts = {}
+        for correlation_id in correlation_ids:
+            try:
+                variation_index = self._get_variation_index(correlation_id)
+            except Exception as e:
+                log.warning(f'Could not track conversion for {correlation_id}: {e}')
+                statuses.append(Experiment.CONVERSION_INVALID)
+                continue
+
+            counts[variation_index] = counts.get(variation_index, 0) + 1
+            statuses.append(Experiment.CONVERSION_TRACKED)
+
+        for variation_index, count in counts.items():
+            self._increment_convert_count(variation_index, count)
+
+        return statuses
+
+    def _get_variation_index(self, correlation_id: str) -> int:
+        """ Returns the variation a correlation ID was created for, checking it is in bounds """
         correlation_bits = correlation_id.split('~')
         user_id = correlation_bits[1]
         variation_index = int(correlation_bits[2])
@@ -67,37 +121,25 @@ class BuiltInExperiment(Experiment):
 
         log.debug(f'Incrementing conversion count for variation {variation_index}, rank {result_rank}, based on user {user_id}')
 
-        return self._increment_convert_count(variation_index)
+        return variation_index
 
     def _increment_exposure_count(self, variation: int, count: int = 1) -> int:
-        """ Call this method when a user is exposed to a variation of an experiment """
+        """ Call this method when a user is exposed to a variation of an experiment
+
+        Returns an eventually consistent count; the increment is persisted asynchronously.
+        """
         return self.__increment_variation_count('exposures', variation, count)
 
     def _increment_convert_count(self, variation: int, count: int = 1) -> int:
         """ Call this method when a user converts for a variation of an experiment """
         return self.__increment_variation_count('conversions', variation, count)
 
+    def __record_persisted_counts(self, variations: List[Dict]):
+        table_name = getattr(self._table, 'table_name', None)
+        for index, variation in enumerate(variations):
+            variation_counters.record_persisted(table_name, self.id, index, variation)
+
     def __increment_variation_count(self, field_name: str, variation: int, count: int = 1) -> int:
-        try:
-            response = self._table.update_item(
-                Key={'id': self.id},
-                UpdateExpression=f'SET variations[{variation}].{field_name} = variations[{variation}].{field_name} + :incr',
-                ExpressionAttributeValues={
-                    ':incr': count
-                },
-                ReturnValues='UPDATED_NEW'
-            )
-            return int(response['Attributes']['variations'][0][field_name])
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'ValidationException':
-                response = self._table.update_item(
-                    Key={'id': self.id},
-                    UpdateExpression=f'SET variations[{variation}].{field_name} = :incr',
-                    ExpressionAttributeValues={
-                        ':incr': count
-                    },
-                    ReturnValues='UPDATED_NEW'
-                )
-                return int(response['Attributes']['variations'][0][field_name])
-            else:
-                raise e
\ No newline at end of file
+        # Increments are buffered and written in the background by the shared aggregator
+        # so requests do not wait on (or contend for) the experiment item in DynamoDB.
+        return variation_counters.increment(self._table, self.id, variation, field_name, count)
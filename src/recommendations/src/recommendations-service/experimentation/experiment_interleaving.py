@@ -6,6 +6,7 @@ from datetime import datetime
 from typing import Dict
 import logging
 
+from experimentation.concurrency import run_concurrently
 from experimentation.experiment import BuiltInExperiment
 
 log = logging.getLogger(__name__)
@@ -13,13 +14,32 @@ log = logging.getLogger(__name__)
 class InterleavingExperiment(BuiltInExperiment):
     """ Implements interleaving technique described in research paper by
     Chapelle et al http://olivier.chapelle.cc/pub/interleaving.pdf
+
+    Interleaving methods are registered by name with register_method(). Each
+    method receives the user ID, the item lists to interleave, the number of
+    results and the variation index of each list, and returns the interleaved
+    items. Unknown methods fall back to balanced interleaving.
     """
     METHOD_BALANCED = 'balanced'
     METHOD_TEAM_DRAFT = 'team-draft'
+    METHOD_PROBABILISTIC = 'probabilistic'
+
+    # Default rank-decay exponent for probabilistic interleaving (Hofmann et al.)
+    DEFAULT_TAU = 3.0
+
+    __methods = {}
+
+    @staticmethod
+    def register_method(method, implementation):
+        """ Registers an interleaving implementation for the given method name """
+        InterleavingExperiment.__methods[method] = implementation
 
     def __init__(self, table, **data):
         super(InterleavingExperiment, self).__init__(table, **data)
         self.method = data.get('method', InterleavingExperiment.METHOD_BALANCED)
+        self.tau = float(data.get('tau', InterleavingExperiment.DEFAULT_TAU))
+        # Deadline in seconds for resolving all variations (None uses the shared default)
+        self.resolver_timeout = data.get('resolver_timeout')
 
     def get_items(self, user_id, current_item_id=None, item_list=None, num_results=10, tracker=None, filter_values=None, context=None, timestamp: datetime = None, promotion: Dict = None):
         if not user_id:
@@ -40,21 +60,31 @@ class InterleavingExperiment(BuiltInExperiment):
             'promotion': promotion
         }
 
-        # Get recomended items for each variation
-        for i in range(len(self.variations)):
-            variation = self.variations[i]
-            items = variation.resolver.get_items(**resolve_params)
-            variations_data[i] = items
+        # Get recomended items for each variation concurrently. Variations that fail or miss
+        # the deadline are left out so the experiment degrades to the variations that answered.
+        results = run_concurrently(
+            [lambda variation=variation: variation.resolver.get_items(**resolve_params) for variation in self.variations],
+            timeout = self.resolver_timeout
+        )
+
+        available = []
+        for i, result in enumerate(results):
+            if result.ok:
+                variations_data[i] = result.value
+                available.append(i)
+            else:
+                log.warning(f'{self._getClassName()} - variation {i} of experiment {self.id} unavailable: {result.error}')
+
+        if not available:
+            raise results[0].error
 
         # Interleave items to produce result
-        interleaved = []
-        if self.method == InterleavingExperiment.METHOD_TEAM_DRAFT:
-            interleaved = self._interleave_team_draft(user_id, variations_data, num_results)
-        else:
-            interleaved = self._interleave_balanced(user_id, variations_data, num_results)
-
-        # Increment exposure for each variation (can be optimized)
-        for i in range(len(self.variations)):
+        available_data = [variations_data[i] for i in available]
+        interleave = InterleavingExperiment.__methods.get(self.method, InterleavingExperiment._interleave_balanced)
+        interleaved = interleave(self, user_id, available_data, num_results, available)
+
+        # Increment exposure for each variation that contributed (buffered and written in one update per variation per interval)
+        for i in available:
             self._increment_exposure_count(i)
 
         if tracker is not None:
@@ -87,6 +117,20 @@ class InterleavingExperiment(BuiltInExperiment):
 
         return interleaved
 
+    def _tag_item(self, item, user_id, variation_idx, rank):
+        """ Injects experiment details into an item selected for the interleaved result """
+        item['experiment'] = {
+            'id': self.id,
+            'feature': self.feature,
+            'name': self.name,
+            'type': self.type,
+            'method': self.method,
+            'variationIndex': variation_idx,
+            'resultRank': rank,
+            'correlationId': self._create_correlation_id(user_id, variation_idx, rank)
+        }
+        return item
+
     """
     Implements the balanced interleaving method described in the Interleaving
     research paper by Chapelle et al http://olivier.chapelle.cc/pub/interleaving.pdf
@@ -109,52 +153,50 @@ class InterleavingExperiment(BuiltInExperiment):
 
     Output: list of interleaved results from all rankings
     """
-    def _interleave_balanced(self, user_id, list_of_item_lists, count):
-        """ Returns interleaved list of items following the balanced method """
+    def _interleave_balanced(self, user_id, list_of_item_lists, count, variation_indexes=None):
+        """ Returns interleaved list of items following the balanced method
+
+        variation_indexes maps each item list to its variation index when only a
+        subset of the variations is being interleaved.
+        """
+        if variation_indexes is None:
+            variation_indexes = list(range(len(list_of_item_lists)))
+
         # Randomize selection order of lists
         selection_order = list(range(len(list_of_item_lists)))
         random.shuffle(selection_order)
 
+        # Lists and variation indexes in selection order
+        ordered_lists = [list_of_item_lists[i] for i in selection_order]
+        ordered_variations = [variation_indexes[i] for i in selection_order]
+        lengths = [len(items) for items in ordered_lists]
+
         # Holds next selection offset into each variation list
-        offsets = [0] * len(list_of_item_lists)
+        offsets = [0] * len(ordered_lists)
+
+        # Item IDs already in the result for constant time duplicate checks
+        seen = set()
 
         result = []
         while len(result) < count:
             # Find lowest offset to determine which variation list to pull next result
             next_idx = 0
-            for i in range(len(offsets)):
-                if (offsets[i] < offsets[next_idx] and
-                        offsets[i] < len(list_of_item_lists[selection_order[i]])):
+            for i in range(1, len(offsets)):
+                if offsets[i] < offsets[next_idx] and offsets[i] < lengths[i]:
                     next_idx = i
 
             # As soon as we reach end of a variation list, we're done
-            if offsets[next_idx] >= len(list_of_item_lists[selection_order[next_idx]]):
+            offset = offsets[next_idx]
+            if offset >= lengths[next_idx]:
                 break
 
             # Add value to result if not already there
-            item = list_of_item_lists[selection_order[next_idx]][offsets[next_idx]]
-            if not any(i['itemId'] == item['itemId'] for i in result):
-                variation_idx = selection_order[next_idx]
-                correlation_id = self._create_correlation_id(user_id, variation_idx, len(result) + 1)
-
-                item_experiment = {
-                    'id': self.id,
-                    'feature': self.feature,
-                    'name': self.name,
-                    'type': self.type,
-                    'method': self.method,
-                    'variationIndex': variation_idx,
-                    'resultRank': len(result) + 1,
-                    'correlationId': correlation_id
-                }
-
-                item.update({
-                    'experiment': item_experiment
-                })
-
-                result.append(item)
+            item = ordered_lists[next_idx][offset]
+            if item['itemId'] not in seen:
+                seen.add(item['itemId'])
+                result.append(self._tag_item(item, user_id, ordered_variations[next_idx], len(result) + 1))
 
-            offsets[next_idx] = offsets[next_idx] + 1
+            offsets[next_idx] = offset + 1
 
         return result
 
@@ -182,29 +224,34 @@ class InterleavingExperiment(BuiltInExperiment):
     end while
 
     Output: list of interleaved results from all rankings
+
+    Only teams with the smallest roster pick, so roster sizes never differ by
+    more than one. The smallest teams are therefore tracked incrementally: a
+    team leaves the list when it picks, and once every team has picked the list
+    is reset to all teams.
     """
-    def _interleave_team_draft(self, user_id, list_of_item_lists, count):
-        """ Returns interleaved list of items following the team draft method """
-        # List of team rosters
-        teams = [[] for x in range(len(list_of_item_lists))]
+    def _interleave_team_draft(self, user_id, list_of_item_lists, count, variation_indexes=None):
+        """ Returns interleaved list of items following the team draft method
+
+        variation_indexes maps each item list to its variation index when only a
+        subset of the variations is being interleaved.
+        """
+        if variation_indexes is None:
+            variation_indexes = list(range(len(list_of_item_lists)))
+
+        team_count = len(list_of_item_lists)
+
+        # Team offsets with the smallest roster, in ascending order
+        smallest_teams = list(range(team_count))
 
         # Offsets into list of item lists
-        offsets = [0] * len(list_of_item_lists)
+        offsets = [0] * team_count
+
+        # Item IDs already in the result for constant time duplicate checks
+        seen = set()
 
         result = []
         while len(result) < count:
-            # Team offsets keyed by team size
-            size_teams = {}
-            for i in range(len(teams)):
-                team_size = len(teams[i])
-                teams_at_size = size_teams.get(team_size, [])
-                teams_at_size.append(i)
-                size_teams[team_size] = teams_at_size
-
-            # List of team offsets with smallest size
-            ordered_keys = sorted(size_teams.keys())
-            smallest_teams = size_teams.get(ordered_keys[0])
-
             # Choose an offset at random from smallest team offsets
             team_index = random.choice(smallest_teams)
 
@@ -215,27 +262,15 @@ class InterleavingExperiment(BuiltInExperiment):
                 offsets[team_index] = next_offset + 1
 
                 item = items[next_offset]
-                if not any(i['itemId'] == item['itemId'] for i in result):
-                    correlation_id = self._create_correlation_id(user_id, team_index, len(result) + 1)
-
-                    item_experiment = {
-                        'id': self.id,
-                        'feature': self.feature,
-                        'name': self.name,
-                        'type': self.type,
-                        'method': self.method,
-                        'variationIndex': team_index,
-                        'resultRank': len(result) + 1,
-                        'correlationId': correlation_id
-                    }
-
-                    item.update({
-                        'experiment': item_experiment
-                    })
+                if item['itemId'] not in seen:
+                    seen.add(item['itemId'])
 
                     # Add item to result and team roster
-                    result.append(item)
-                    teams[team_index].append(item)
+                    result.append(self._tag_item(item, user_id, variation_indexes[team_index], len(result) + 1))
+
+                    smallest_teams.remove(team_index)
+                    if not smallest_teams:
+                        smallest_teams = list(range(team_count))
                     break
 
                 next_offset += 1
@@ -244,4 +279,119 @@ class InterleavingExperiment(BuiltInExperiment):
             if next_offset >= len(items):
                 break
 
-        return result
\ No newline at end of file
+        return result
+
+    """
+    Implements probabilistic interleaving as described by Hofmann et al in
+    "A Probabilistic Method for Inferring Preferences from Clicks" (CIKM 2011).
+
+    Each ranking is turned into a distribution over its items where the item at
+    rank r has weight 1 / r^tau. For every result position a ranking is chosen
+    uniformly at random and an item is sampled from its distribution. The item
+    is then removed from the distributions of all rankings. This keeps the
+    result close to each ranking's order while giving every ranking a chance to
+    contribute any of its items.
+
+    Weights are kept in a Fenwick (binary indexed) tree per ranking so sampling
+    and removal are O(log n) and the method runs in O((n + count) * k log n).
+    """
+    def _interleave_probabilistic(self, user_id, list_of_item_lists, count, variation_indexes=None):
+        """ Returns interleaved list of items following the probabilistic method """
+        if variation_indexes is None:
+            variation_indexes = list(range(len(list_of_item_lists)))
+
+        trees = []
+        positions = []
+        for items in list_of_item_lists:
+            tree = _FenwickTree([1.0 / (rank ** self.tau) for rank in range(1, len(items) + 1)])
+            item_positions = {}
+            for position, item in enumerate(items):
+                if item['itemId'] in item_positions:
+                    # Duplicate within a ranking; only the best rank is kept.
+                    tree.clear(position)
+                else:
+                    item_positions[item['itemId']] = position
+            trees.append(tree)
+            positions.append(item_positions)
+
+        result = []
+        active = [i for i in range(len(positions)) if positions[i]]
+        while len(result) < count and active:
+            list_index = random.choice(active)
+
+            position = trees[list_index].sample(random.random())
+            item = list_of_item_lists[list_index][position]
+            item_id = item['itemId']
+
+            # Remove the item from every ranking's distribution
+            for i, item_positions in enumerate(positions):
+                other_position = item_positions.pop(item_id, None)
+                if other_position is not None:
+                    trees[i].clear(other_position)
+
+            result.append(self._tag_item(item, user_id, variation_indexes[list_index], len(result) + 1))
+
+            # Rankings whose items have all been used can no longer contribute
+            active = [i for i in active if positions[i]]
+
+        return result
+
+class _FenwickTree:
+    """ Binary indexed tree of non-negative weights supporting removal and weighted sampling in O(log n) """
+
+    def __init__(self, weights):
+        self._size = len(weights)
+        self._weights = list(weights)
+        self._tree = [0.0] * (self._size + 1)
+        for i, weight in enumerate(weights, 1):
+            self._tree[i] += weight
+            parent = i + (i & -i)
+            if parent <= self._size:
+                self._tree[parent] += self._tree[i]
+
+        self._top_bit = 1
+        while self._top_bit * 2 <= self._size:
+            self._top_bit *= 2
+
+    def total(self) -> float:
+        total = 0.0
+        i = self._size
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def clear(self, position: int):
+        """ Sets the weight at position to zero """
+        weight = self._weights[position]
+        if weight == 0:
+            return
+        self._weights[position] = 0.0
+        i = position + 1
+        while i <= self._size:
+            self._tree[i] -= weight
+            i += i & -i
+
+    def sample(self, u: float) -> int:
+        """ Returns the position whose cumulative weight interval contains u * total """
+        target = u * self.total()
+        position = 0
+        bit = self._top_bit
+        while bit:
+            next_position = position + bit
+            if next_position <= self._size and self._tree[next_position] <= target:
+                position = next_position
+                target -= self._tree[next_position]
+            bit //= 2
+
+        # Guard against floating point drift landing on a cleared weight.
+        while position < self._size - 1 and self._weights[position] == 0:
+            position += 1
+        while self._weights[position] == 0 and position > 0:
+            position -= 1
+        return position
+
+# Register interleaving methods here.
+InterleavingExperiment.register_method(InterleavingExperiment.METHOD_BALANCED, InterleavingExperiment._interleave_balanced)
+InterleavingExperiment.register_method(InterleavingExperiment.METHOD_TEAM_DRAFT, InterleavingExperiment._interleave_team_draft)
+InterleavingExperiment.register_method(InterleavingExperiment.METHOD_PROBABILISTIC, InterleavingExperiment._interleave_probabilistic)
@@ -1,11 +1,12 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-import numpy as np
 import logging
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List
 
+from experimentation.bandit import BanditState
+from experimentation.counters import variation_counters
 from experimentation.experiment import BuiltInExperiment
 
 log = logging.getLogger(__name__)
@@ -13,16 +14,38 @@ log = logging.getLogger(__name__)
 class MultiArmedBanditExperiment(BuiltInExperiment):
     """ Implementation of the multi-armed bandit problem using the Thompson Sampling approach
     to exploring variations to identify and exploit the best performing variation
+
+    Variations are selected from posteriors held in memory (see BanditState) that are
+    updated with each exposure and conversion in this process and reconciled with the
+    persisted counts when the experiment manager reads them back.
     """
 
-    def get_items(self, user_id, current_item_id=None, item_list=None, num_results=10, tracker=None, filter_values=None, context=None, timestamp: datetime = None, promotion: Dict = None):
+    def __init__(self, table, **data):
+        super().__init__(table, **data)
+        self._bandit = BanditState(len(self.variations))
+        self.__reconcile_counts(data['variations'])
+
+    def reconcile(self, config: Dict):
+        """ Reconciles the posteriors with the persisted counts """
+        super().reconcile(config)
+        self.__reconcile_counts(config['variations'])
+
+    def select_variation_indexes(self, count: int) -> List[int]:
+        """ Assigns variations for count users at once, e.g. for the users of a batch request """
+        return self._bandit.select_many(count).tolist()
+
+    def get_items(self, user_id, current_item_id=None, item_list=None, num_results=10, tracker=None, filter_values=None, context=None, timestamp: datetime = None, promotion: Dict = None, variation_index: int = None):
+        """ Returns items from the selected variation, or from variation_index if it was assigned up front """
         if not user_id:
             raise Exception('user_id is required')
         if len(self.variations) < 2:
             raise Exception(f'Experiment {self.id} does not have 2 or more variations')
 
         # Determine the variation to use.
-        variation_idx = self._select_variation_index()
+        if variation_index is not None and 0 <= variation_index < len(self.variations):
+            variation_idx = variation_index
+        else:
+            variation_idx = self._select_variation_index()
         log.debug(f'{self._getClassName()} - assigned user {user_id} to variation {variation_idx} for experiment {self.feature}.{self.name}')
 
         # Increment exposure count for variation
@@ -86,20 +109,25 @@ class MultiArmedBanditExperiment(BuiltInExperiment):
 
         return items
 
-    def _select_variation_index(self):
-        """ Selects the variation using Thompson Sampling """
-        variation_count = len(self.variations)
-        exposures = np.zeros(variation_count)
-        conversions = np.zeros(variation_count)
+    def _select_variation_index(self) -> int:
+        """ Selects the variation using Thompson Sampling
+
+        Sampling from the posteriors leads to more exploration because variations with
+        greater uncertainty can then be selected.
+        """
+        return self._bandit.select()
 
-        for i in range(variation_count):
-            variation = self.variations[i]
-            exposures[i] = int(variation.config.get('exposures', 0))
-            conversions[i] = int(variation.config.get('conversions', 0))
+    def _increment_exposure_count(self, variation: int, count: int = 1) -> int:
+        self._bandit.observe(variation, exposures = count)
+        return super()._increment_exposure_count(variation, count)
 
-        # Sample from posterior (this is the Thompson Sampling approach)
-        # This leads to more exploration because variations with > uncertainty can then be selected
-        theta = np.random.beta(conversions + 1, exposures - conversions + 1)
+    def _increment_convert_count(self, variation: int, count: int = 1) -> int:
+        self._bandit.observe(variation, conversions = count)
+        return super()._increment_convert_count(variation, count)
 
-        # Select variation index with highest posterior p of converting
-        return np.argmax(theta)
+    def __reconcile_counts(self, variations: List[Dict]):
+        exposures = [int(variation.get('exposures', 0)) for variation in variations]
+        conversions = [int(variation.get('conversions', 0)) for variation in variations]
+        # Increments buffered by this process are not in the persisted counts yet.
+        pending = variation_counters.pending(getattr(self._table, 'table_name', None), self.id)
+        self._bandit.reconcile(exposures, conversions, pending)
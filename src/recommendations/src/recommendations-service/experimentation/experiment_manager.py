@@ -1,31 +1,72 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-import boto3
 import logging
-
-from boto3.dynamodb.conditions import Key
+import os
+import threading
+import time
+
+from typing import Dict, Iterable, Optional
+from boto3.dynamodb.conditions import Attr
+from experimentation.aws_clients import aws_clients
+from experimentation.caching import InvalidatableCache
+from experimentation.counters import without_counts
 from experimentation.experiment_ab import ABExperiment
 from experimentation.experiment_interleaving import InterleavingExperiment
 from experimentation.experiment_mab import MultiArmedBanditExperiment
 from experimentation.experiment_optimizely import OptimizelyFeatureTest, optimizely_sdk, optimizely_configured
-from experimentation.tracking import KinesisTracker
+from experimentation.parameters import parameter_cache
+from experimentation.tracking import BufferedKinesisTracker, KinesisTracker
 
 log = logging.getLogger(__name__)
 
-ssm = boto3.client('ssm')
-dynamodb = boto3.resource('dynamodb')
-
-class ExperimentManager:
-    """ Provides access to retrieving active experiments for features """
+ssm = aws_clients.client('ssm')
+dynamodb = aws_clients.resource('dynamodb')
+
+class ExperimentSnapshot:
+    """ Immutable, versioned view of the ACTIVE built-in experiments keyed by feature and by ID """
+
+    def __init__(self, version: int, configs: Dict[str, Dict], experiments: Dict[str, object]):
+        self.version = version
+        self.loaded_at = time.time()
+        self.configs = configs
+        self.by_id = experiments
+        self.by_feature = {}
+        # Only one experiment should be active per feature. If there are more, the one with the
+        # lowest ID is used so every process (and every reload) serves the same experiment.
+        for experiment_id in sorted(experiments):
+            experiment = experiments[experiment_id]
+            current = self.by_feature.setdefault(experiment.feature, experiment)
+            if current is not experiment:
+                log.warning(f'ExperimentManager - experiments {current.id} and {experiment.id} are both active for feature {experiment.feature}; using {current.id}')
+
+class ExperimentManager(InvalidatableCache):
+    """ Provides access to retrieving active experiments for features
+
+    Active built-in experiments are read from DynamoDB into an in-memory snapshot
+    that a background thread reloads every poll_interval seconds. Looking up the
+    experiment for a request is then a dict access, and experiment objects (with
+    their resolvers) are only rebuilt when their configuration changes.
+    """
     TYPE_AB = 'ab'
     TYPE_INTERLEAVING = 'interleaving'
     TYPE_MAB = 'mab'
     TYPE_OPTIMIZELY = 'optimizely'
 
+    poll_interval = float(os.environ.get('EXPERIMENT_POLL_INTERVAL', 30))
+    tracker_mode = os.environ.get('EXPERIMENT_TRACKER_MODE', 'buffered').lower()
+
     __table_name = None
+    __table = None
     __experiments = {}
 
+    __snapshot: Optional[ExperimentSnapshot] = None
+    __snapshot_lock = threading.Lock()
+    __reload_lock = threading.Lock()
+    __poller: Optional[threading.Thread] = None
+    __trackers = {}
+    __trackers_lock = threading.Lock()
+
     @staticmethod
     def register_experiment(type, experiment):
         """ Registers an experiment implementation for the given type """
@@ -59,34 +100,93 @@ class ExperimentManager:
                         return OptimizelyFeatureTest(**data)
 
         # 2. Lastly, check for an active built-in experiment.
-        experiment = None
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return None
 
-        table = self.__get_table()
+        return snapshot.by_feature.get(feature)
 
-        if table:
-            log.debug(f'ExperimentManager - querying {table.table_name} for active experiments for {feature}')
-
-            # Get active experiments for the feature.
-            response = table.query(
-                IndexName='feature-name-index',
-                KeyConditionExpression=Key('feature').eq(feature),
-                FilterExpression=Key('status').eq('ACTIVE')
-            )
-
-            experiment_count = response['Count']
-            if experiment_count > 0:
-                experiment_config = response['Items'][0]
-                log.debug(f'ExperimentManager - {experiment_count} active experiments found for feature {feature}')
-
-                experiment_type = experiment_config['type']
-                experiment_class = ExperimentManager.__experiments.get(experiment_type)
-                if not experiment_class:
-                    raise ValueError(f'Experiment class for type {experiment_type} could not be found')
-                experiment = experiment_class(table, **experiment_config)
-            else:
-                log.debug(f'ExperimentManager - no active experiments for feature {feature}')
+    def get_snapshot(self) -> Optional[ExperimentSnapshot]:
+        """ Returns the current snapshot of active experiments, loading it on first use
 
-        return experiment
+        Returns None when the experiment strategy table is not configured.
+        """
+        if not self.__get_table():
+            return None
+
+        snapshot = ExperimentManager.__snapshot
+        if snapshot is None:
+            with ExperimentManager.__snapshot_lock:
+                snapshot = ExperimentManager.__snapshot
+                if snapshot is None:
+                    snapshot = self.reload()
+
+        self.__ensure_poller()
+        return snapshot
+
+    def reload(self) -> Optional[ExperimentSnapshot]:
+        """ Reads all ACTIVE experiments from DynamoDB and swaps in a new snapshot
+
+        Reloads by the poller and by invalidate() are serialized so each builds on the last.
+        """
+        with ExperimentManager.__reload_lock:
+            return self.__reload()
+
+    def __reload(self) -> Optional[ExperimentSnapshot]:
+        table = self.__get_table()
+        if not table:
+            return None
+
+        previous = ExperimentManager.__snapshot
+
+        configs = {}
+        scan_args = {'FilterExpression': Attr('status').eq('ACTIVE')}
+        while True:
+            response = table.scan(**scan_args)
+            for item in response['Items']:
+                configs[item['id']] = item
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        experiments = {}
+        for experiment_id, experiment_config in configs.items():
+            experiment = previous.by_id.get(experiment_id) if previous else None
+            if experiment is not None and without_counts(previous.configs[experiment_id]) == without_counts(experiment_config):
+                # Exposure and conversion counts change with traffic; anything else unchanged means
+                # the experiment and its resolvers are reused (bandits take the new counts).
+                if previous.configs[experiment_id] != experiment_config:
+                    experiment.reconcile(experiment_config)
+                experiments[experiment_id] = experiment
+                continue
+
+            try:
+                experiments[experiment_id] = self.__create_experiment(table, experiment_config)
+            except Exception as e:
+                log.exception(f'ExperimentManager - could not build experiment {experiment_id}: {e}')
+
+        version = previous.version + 1 if previous else 1
+        snapshot = ExperimentSnapshot(version, configs, experiments)
+        ExperimentManager.__snapshot = snapshot
+
+        log.debug(f'ExperimentManager - loaded snapshot version {version} with {len(experiments)} active experiments')
+        return snapshot
+
+    def stats(self) -> Dict:
+        """ Returns details of the current snapshot """
+        snapshot = ExperimentManager.__snapshot
+        return {
+            'version': snapshot.version if snapshot else 0,
+            'loaded_at': snapshot.loaded_at if snapshot else None,
+            'active_experiments': len(snapshot.by_id) if snapshot else 0,
+            'features': sorted(snapshot.by_feature.keys()) if snapshot else [],
+            'poll_interval': ExperimentManager.poll_interval
+        }
+
+    def invalidate(self, keys: Iterable[str] = None) -> int:
+        """ Forces a reload of the snapshot so changes to experiments are picked up immediately """
+        snapshot = self.reload()
+        return len(snapshot.by_id) if snapshot else 0
 
     def get_by_correlation_id(self, correlation_id: str):
         """ Returns an experiment based on a correlation ID """
@@ -102,16 +202,17 @@ class ExperimentManager:
         if not table:
             raise Exception('Experiment strategy table has not been configured')
 
+        # Active experiments are served from the snapshot; others (e.g. recently
+        # stopped experiments still receiving outcomes) are read from the table.
+        snapshot = self.get_snapshot()
+        if snapshot is not None and id in snapshot.by_id:
+            return snapshot.by_id[id]
+
         experiment = None
 
         response = table.get_item(Key={'id': id})
         if response.get('Item'):
-            experiment_config = response['Item']
-            experiment_type = experiment_config['type']
-            experiment_class = ExperimentManager.__experiments.get(experiment_type)
-            if not experiment_class:
-                raise ValueError(f'Experiment class for type {experiment_type} could not be found')
-            experiment = experiment_class(table, **experiment_config)
+            experiment = self.__create_experiment(table, response['Item'])
 
         return experiment
 
@@ -119,21 +220,59 @@ class ExperimentManager:
         """ Creates a Kinesis stream tracker for an experiment if environment is
         configured with a Kinesis stream
         """
-        tracker = None
-
-        try:
-            response = ssm.get_parameter(Name='retaildemostore-kinesis-event-stream-name')
-            if response['Parameter']['Value'] != 'NONE':
-                stream_name = response['Parameter']['Value']
-                tracker = KinesisTracker(
-                    exposure_stream_name = stream_name,
-                    outcome_stream_name = stream_name
-                )
-        except ssm.exceptions.ParameterNotFound:
-            pass
+        stream_name = parameter_cache.get_value('retaildemostore-kinesis-event-stream-name')
+        if not stream_name or stream_name == 'NONE':
+            return None
+
+        tracker = ExperimentManager.__trackers.get(stream_name)
+        if tracker is None:
+            with ExperimentManager.__trackers_lock:
+                tracker = ExperimentManager.__trackers.get(stream_name)
+                if tracker is None:
+                    # Events are batched and sent in the background unless synchronous writes are requested.
+                    tracker_class = KinesisTracker if ExperimentManager.tracker_mode == 'sync' else BufferedKinesisTracker
+                    tracker = tracker_class(
+                        exposure_stream_name = stream_name,
+                        outcome_stream_name = stream_name
+                    )
+                    ExperimentManager.__trackers[stream_name] = tracker
 
         return tracker
 
+    def trackers(self) -> Dict[str, KinesisTracker]:
+        """ Returns the trackers created so far, by stream name """
+        with ExperimentManager.__trackers_lock:
+            return dict(ExperimentManager.__trackers)
+
+    def __create_experiment(self, table, experiment_config):
+        experiment_type = experiment_config['type']
+        experiment_class = ExperimentManager.__experiments.get(experiment_type)
+        if not experiment_class:
+            raise ValueError(f'Experiment class for type {experiment_type} could not be found')
+        return experiment_class(table, **experiment_config)
+
+    def __ensure_poller(self):
+        """ Lazily starts the background thread that reloads the snapshot """
+        poller = ExperimentManager.__poller
+        if poller is not None and poller.is_alive():
+            return
+
+        with ExperimentManager.__snapshot_lock:
+            poller = ExperimentManager.__poller
+            if poller is None or not poller.is_alive():
+                poller = threading.Thread(target=self.__poll, name='experiment-snapshot-poller', daemon=True)
+                ExperimentManager.__poller = poller
+                poller.start()
+
+    def __poll(self):
+        while True:
+            time.sleep(ExperimentManager.poll_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                # Keep serving the last snapshot until DynamoDB is reachable again.
+                log.warning(f'ExperimentManager - could not reload active experiments: {e}')
+
     def __get_table(self):
         """ Lazily initializes the DDB table name for experiment strategies """
         if ExperimentManager.__table_name is None:
@@ -145,9 +284,12 @@ class ExperimentManager:
             else:
                 ExperimentManager.__table_name = 'NONE'
 
+            if ExperimentManager.__table_name != 'NONE':
+                ExperimentManager.__table = dynamodb.Table(ExperimentManager.__table_name)
+
             log.debug(f'ExperimentManager - resolved experiment strategy table name to: {ExperimentManager.__table_name}')
 
-        return dynamodb.Table(ExperimentManager.__table_name) if ExperimentManager.__table_name != 'NONE' else None
+        return ExperimentManager.__table
 
 # Register built-in experiment types here only.
 ExperimentManager.register_experiment(ExperimentManager.TYPE_AB, ABExperiment)
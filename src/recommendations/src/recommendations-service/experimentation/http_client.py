@@ -0,0 +1,171 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import os
+import random
+import threading
+import time
+
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict
+from urllib.parse import urlsplit
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from experimentation import deadline
+from experimentation.metrics import Histogram
+
+log = logging.getLogger(__name__)
+
+# Status codes that are worth retrying for idempotent requests
+RETRY_STATUS_CODES = (502, 503, 504)
+
+# Shortest timeout (seconds) given to an attempt, and the time left in the request's
+# budget below which failed attempts are not retried
+MIN_ATTEMPT_TIMEOUT = 0.05
+
+class HttpClient:
+    """ Shared HTTP client for service-to-service calls
+
+    Wraps a single requests.Session whose adapter keeps a pool of keep-alive
+    connections per host, so calls reuse TCP connections instead of opening a
+    new one each time. Every call has connect and read timeouts. Idempotent
+    requests are retried on connection errors, timeouts and 502/503/504
+    responses with exponential backoff and full jitter. Within a request, timeouts
+    are capped at the time left in its deadline and retries stop once that time
+    is spent.
+
+    The session's connection pools are thread-safe and cookies are disabled,
+    so one instance is shared by all request threads. The session is recreated
+    in forked worker processes. Latency is recorded in a histogram per host.
+    """
+
+    def __init__(self, connect_timeout: float = 1.0, read_timeout: float = 5.0, retries: int = 2,
+                 backoff: float = 0.05, max_backoff: float = 1.0, pool_maxsize: int = 50):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_maxsize = pool_maxsize
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+
+        # Host (netloc) -> latency histogram and counters
+        self._latency: Dict[str, Histogram] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def get(self, url: str, timeout = None, retries: int = None, **kwargs) -> requests.Response:
+        """ Issues a GET request, retrying transient failures """
+        return self.request('GET', url, timeout = timeout, retries = retries, **kwargs)
+
+    def request(self, method: str, url: str, timeout = None, retries: int = None, **kwargs) -> requests.Response:
+        """ Issues a request; only idempotent methods (GET, HEAD, OPTIONS, PUT, DELETE) are retried """
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        if retries is None:
+            retries = self.retries
+        if method.upper() not in ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'):
+            retries = 0
+
+        host = urlsplit(url).netloc
+        session = self.__get_session()
+
+        request_deadline = deadline.current()
+
+        attempt = 0
+        while True:
+            remaining = request_deadline.remaining() if request_deadline else None
+            start = time.perf_counter()
+            try:
+                response = session.request(method, url, timeout = bound_timeout(timeout, remaining), **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.__record(host, time.perf_counter() - start, 'errors')
+                delay = self.__retry_delay(attempt, retries, request_deadline)
+                if delay is None:
+                    raise
+                log.debug('HttpClient - %s %s failed (%s); retrying', method, url, e)
+            else:
+                self.__record(host, time.perf_counter() - start, 'requests')
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                delay = self.__retry_delay(attempt, retries, request_deadline)
+                if delay is None:
+                    return response
+                log.debug('HttpClient - %s %s returned %s; retrying', method, url, response.status_code)
+                response.close()
+
+            attempt += 1
+            self.__increment(host, 'retries')
+            time.sleep(delay)
+
+    def stats(self) -> Dict:
+        """ Returns per-host request counters and latency percentiles """
+        with self._lock:
+            hosts = list(self._latency.keys())
+            counters = {host: dict(values) for host, values in self._counters.items()}
+
+        return {host: dict(counters.get(host, {}), **self._latency[host].summary()) for host in hosts}
+
+    def histograms(self) -> Dict[str, Histogram]:
+        """ Returns the per-host latency histograms """
+        with self._lock:
+            return dict(self._latency)
+
+    def __retry_delay(self, attempt: int, retries: int, request_deadline: deadline.Deadline = None):
+        """ Returns the backoff before the next attempt, or None if the request should not be retried """
+        if attempt >= retries:
+            return None
+        # Full jitter: sleep a random time up to the exponential backoff cap
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt + 1)))
+        if request_deadline is not None and request_deadline.remaining() - delay <= MIN_ATTEMPT_TIMEOUT:
+            return None
+        return delay
+
+    def __get_session(self) -> requests.Session:
+        pid = os.getpid()
+        if self._session is not None and self._session_pid == pid:
+            return self._session
+
+        with self._lock:
+            if self._session is None or self._session_pid != pid:
+                session = requests.Session()
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains = []))
+                adapter = HTTPAdapter(pool_connections = 20, pool_maxsize = self.pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+                self._session_pid = pid
+            return self._session
+
+    def __record(self, host: str, seconds: float, counter: str):
+        histogram = self._latency.get(host)
+        if histogram is None:
+            with self._lock:
+                histogram = self._latency.setdefault(host, Histogram())
+        histogram.observe(seconds)
+        self.__increment(host, counter)
+
+    def __increment(self, host: str, counter: str):
+        with self._lock:
+            counters = self._counters.setdefault(host, {'requests': 0, 'errors': 0, 'retries': 0})
+            counters[counter] += 1
+
+def bound_timeout(timeout, remaining: float = None):
+    """ Caps a requests timeout (seconds or a (connect, read) tuple) at the remaining seconds of a deadline """
+    if remaining is None:
+        return timeout
+    remaining = max(remaining, MIN_ATTEMPT_TIMEOUT)
+    if isinstance(timeout, tuple):
+        return tuple(remaining if value is None else min(value, remaining) for value in timeout)
+    return remaining if timeout is None else min(timeout, remaining)
+
+http_client = HttpClient(
+    connect_timeout = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 1.0)),
+    read_timeout = float(os.environ.get('HTTP_READ_TIMEOUT', 5.0)),
+    retries = int(os.environ.get('HTTP_RETRIES', 2))
+)
@@ -0,0 +1,298 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Local collaborative-filtering model built from the interactions dataset
+
+The model is a low-rank factorization of the item-item co-occurrence matrix computed
+from the interactions.csv written by generators/generate_interactions_personalize.py.
+It lets the service make personalized recommendations without a Personalize campaign
+(offline, in load tests or while Personalize is throttled).
+
+Build a model with:
+
+    python -m experimentation.local_model --interactions interactions.csv --items items.csv --output model/
+
+The output directory holds NumPy arrays that are memory-mapped when the model is
+loaded (so worker processes share the pages) and a model.json with the item and
+user IDs.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from typing import Dict, Iterable, List, Optional
+
+log = logging.getLogger(__name__)
+
+# Interaction weights by event type; stronger intent counts more
+EVENT_WEIGHTS = {
+    'View': 1.0,
+    'ViewCart': 1.0,
+    'AddToCart': 2.0,
+    'UpdateQuantity': 2.0,
+    'StartCheckout': 3.0,
+    'Purchase': 4.0
+}
+
+# Categories sold in the convenience store (same as the c-store Personalize filters)
+CSTORE_CATEGORIES = ('cold dispensed', 'hot dispensed', 'salty snacks', 'food service')
+
+# Filters matching the expressions of the Personalize filters created for the demo
+FILTER_EXCLUDE_PURCHASED = 'exclude-purchased'
+FILTER_EXCLUDE_CSTORE = 'exclude-cstore'
+FILTER_CSTORE_ONLY = 'cstore-only'
+FILTER_SAME_CATEGORIES = 'same-categories'
+
+FILTERS = (FILTER_EXCLUDE_PURCHASED, FILTER_EXCLUDE_CSTORE, FILTER_CSTORE_ONLY, FILTER_SAME_CATEGORIES)
+
+METADATA_FILENAME = 'model.json'
+
+# Extra dimensions sampled and power iterations run by the randomized eigensolver
+EIGEN_OVERSAMPLING = 10
+EIGEN_POWER_ITERATIONS = 4
+
+def _read_interactions(path: str):
+    """ Returns parallel lists of user IDs, item IDs and event types from an interactions CSV """
+    user_ids, item_ids, event_types = [], [], []
+    with open(path, newline = '') as f:
+        for row in csv.DictReader(f):
+            user_ids.append(row['USER_ID'])
+            item_ids.append(row['ITEM_ID'])
+            event_types.append(row['EVENT_TYPE'])
+    return user_ids, item_ids, event_types
+
+def _read_item_categories(path: str) -> Dict[str, str]:
+    with open(path, newline = '') as f:
+        return {row['ITEM_ID']: row.get('CATEGORY_L1') or '' for row in csv.DictReader(f)}
+
+def _sparse_product(out_index: np.ndarray, in_index: np.ndarray, values: np.ndarray, dense: np.ndarray, n_out: int) -> np.ndarray:
+    """ Returns M @ dense for the sparse matrix M given by its (out_index, in_index, values) entries """
+    result = np.empty((n_out, dense.shape[1]))
+    for j in range(dense.shape[1]):
+        result[:, j] = np.bincount(out_index, weights = values * dense[in_index, j], minlength = n_out)
+    return result
+
+def _top_eigenpairs(matmul, n: int, k: int, seed: int = 0):
+    """ Returns the k largest eigenvalues and their eigenvectors of an n x n symmetric PSD matrix
+
+    The matrix is only accessed through matmul(vectors), which returns the matrix times an
+    (n, m) array. Randomized subspace iteration (Halko, Martinsson and Tropp) projects the
+    matrix on a basis for its dominant k + EIGEN_OVERSAMPLING dimensional subspace and solves
+    the small eigenproblem there; the result is exact when that covers all n dimensions.
+    """
+    rng = np.random.RandomState(seed)
+    basis, _ = np.linalg.qr(matmul(rng.standard_normal((n, min(n, k + EIGEN_OVERSAMPLING)))))
+    for _ in range(EIGEN_POWER_ITERATIONS):
+        basis, _ = np.linalg.qr(matmul(basis))
+
+    projected = basis.T @ matmul(basis)
+    eigenvalues, eigenvectors = np.linalg.eigh((projected + projected.T) / 2)
+    top = np.argsort(eigenvalues)[::-1][:k]
+    return eigenvalues[top], basis @ eigenvectors[:, top]
+
+def build_model(interactions_path: str, output_dir: str, items_path: str = None, factors: int = 64) -> Dict:
+    """ Builds a model from an interactions CSV and writes it to output_dir
+
+    Each user's interactions are weighted by event type and log-damped, the item-item
+    co-occurrence of those weights is cosine-normalized, and its top eigenvectors
+    (the least-squares optimal rank-k factorization of the symmetric matrix) give
+    the item embeddings. A user's embedding is the weighted sum of the embeddings
+    of the items they interacted with.
+    """
+    started = time.time()
+    user_ids, item_ids, event_types = _read_interactions(interactions_path)
+    categories_by_item = _read_item_categories(items_path) if items_path else {}
+
+    item_index = {item_id: i for i, item_id in enumerate(sorted(set(item_ids) | set(categories_by_item)))}
+    user_index = {user_id: u for u, user_id in enumerate(sorted(set(user_ids)))}
+    n_items, n_users = len(item_index), len(user_index)
+
+    rows = np.fromiter((user_index[user_id] for user_id in user_ids), dtype = np.int64, count = len(user_ids))
+    cols = np.fromiter((item_index[item_id] for item_id in item_ids), dtype = np.int64, count = len(item_ids))
+    weights = np.fromiter((EVENT_WEIGHTS.get(event_type, 1.0) for event_type in event_types), dtype = np.float64, count = len(event_types))
+    purchased = np.fromiter((event_type == 'Purchase' for event_type in event_types), dtype = bool, count = len(event_types))
+
+    # Sparse user x item interaction weights as (user, item, weight) entries; repeated
+    # interactions are damped so a few heavy users or items do not dominate the co-occurrence
+    pairs, inverse = np.unique(rows * n_items + cols, return_inverse = True)
+    entry_users = pairs // n_items
+    entry_items = pairs % n_items
+    entry_weights = np.log1p(np.bincount(inverse, weights = weights))
+
+    # The cosine-normalized co-occurrence D^-1 X'X D^-1 is applied to vectors without forming it
+    norms = np.sqrt(np.bincount(entry_items, weights = entry_weights ** 2, minlength = n_items))
+    norms[norms == 0] = 1.0
+
+    def cooccurrence(vectors):
+        by_user = _sparse_product(entry_users, entry_items, entry_weights, vectors / norms[:, None], n_users)
+        return _sparse_product(entry_items, entry_users, entry_weights, by_user, n_items) / norms[:, None]
+
+    factors = min(factors, n_items)
+    eigenvalues, eigenvectors = _top_eigenpairs(cooccurrence, n_items, factors)
+    item_factors = eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+
+    # Unit-length item vectors make item-item scores cosine similarities
+    item_norms = np.linalg.norm(item_factors, axis = 1, keepdims = True)
+    item_norms[item_norms == 0] = 1.0
+    item_factors = (item_factors / item_norms).astype(np.float32)
+    user_factors = _sparse_product(entry_users, entry_items, entry_weights, item_factors, n_users).astype(np.float32)
+
+    popularity = np.bincount(entry_items, weights = entry_weights, minlength = n_items)
+    popularity = (popularity / max(float(popularity.max()), 1e-9)).astype(np.float32)
+
+    # Purchased items per user in CSR form (indptr/indices) for the exclude-purchased filter
+    purchase_pairs = np.unique(rows[purchased] * n_items + cols[purchased])
+    purchase_users = purchase_pairs // n_items
+    purchased_indices = (purchase_pairs % n_items).astype(np.int32)
+    purchased_indptr = np.concatenate(([0], np.cumsum(np.bincount(purchase_users, minlength = n_users)))).astype(np.int64)
+
+    os.makedirs(output_dir, exist_ok = True)
+    np.save(os.path.join(output_dir, 'item_factors.npy'), item_factors)
+    np.save(os.path.join(output_dir, 'user_factors.npy'), user_factors)
+    np.save(os.path.join(output_dir, 'popularity.npy'), popularity)
+    np.save(os.path.join(output_dir, 'purchased_indptr.npy'), purchased_indptr)
+    np.save(os.path.join(output_dir, 'purchased_indices.npy'), purchased_indices)
+
+    item_ids_sorted = sorted(item_index, key = item_index.get)
+    metadata = {
+        'version': 1,
+        'created': int(time.time()),
+        'source': os.path.basename(interactions_path),
+        'interactions': len(user_ids),
+        'factors': int(item_factors.shape[1]),
+        'item_ids': item_ids_sorted,
+        'user_ids': sorted(user_index, key = user_index.get),
+        'item_categories': [categories_by_item.get(item_id, '') for item_id in item_ids_sorted]
+    }
+    with open(os.path.join(output_dir, METADATA_FILENAME), 'w') as f:
+        json.dump(metadata, f)
+
+    log.info('Built local model with %d users, %d items and %d factors from %d interactions in %.1fs',
+             n_users, n_items, metadata['factors'], len(user_ids), time.time() - started)
+    return metadata
+
+class LocalModel:
+    """ Scores items for a user or an item with a model written by build_model
+
+    The factor and purchase arrays are memory-mapped read-only; scoring is a single
+    matrix-vector product followed by a partial sort, with filters applied as masks.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(os.path.join(path, METADATA_FILENAME)) as f:
+            metadata = json.load(f)
+
+        self.item_ids = metadata['item_ids']
+        self.item_index = {item_id: i for i, item_id in enumerate(self.item_ids)}
+        self.user_index = {user_id: u for u, user_id in enumerate(metadata['user_ids'])}
+
+        self.item_factors = self.__load('item_factors')
+        self.user_factors = self.__load('user_factors')
+        self.popularity = self.__load('popularity')
+        self.purchased_indptr = self.__load('purchased_indptr')
+        self.purchased_indices = self.__load('purchased_indices')
+
+        categories = np.array(metadata['item_categories'], dtype = object)
+        self.item_category_codes = np.unique(categories, return_inverse = True)[1]
+        self.cstore_mask = np.isin(categories, CSTORE_CATEGORIES)
+
+        log.info('Loaded local model from %s (%d users, %d items)', path, len(self.user_index), len(self.item_ids))
+
+    def __load(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode = 'r')
+
+    def purchased(self, user_id: str) -> np.ndarray:
+        """ Returns the indices of the items purchased by a user """
+        u = self.user_index.get(user_id)
+        if u is None:
+            return np.empty(0, dtype = np.int32)
+        return self.purchased_indices[self.purchased_indptr[u]:self.purchased_indptr[u + 1]]
+
+    def recommend(self, user_id: str = None, item_id: str = None, num_results: int = 25, filters: Iterable[str] = ()) -> List[Dict]:
+        """ Returns the top items as dicts with 'itemId' and 'score'
+
+        Items related to item_id are returned when it is given (user_id is then only
+        used for filtering), otherwise items for user_id. Unknown users and items get
+        the most popular items, like Personalize does for cold users.
+        """
+        filters = set(filters or ())
+        unknown = filters.difference(FILTERS)
+        if unknown:
+            raise ValueError(f'Unsupported filters: {sorted(unknown)}')
+
+        i = self.item_index.get(item_id) if item_id else None
+        u = self.user_index.get(user_id) if user_id else None
+
+        if i is not None:
+            scores = self.item_factors @ self.item_factors[i]
+        elif u is not None and not item_id:
+            scores = self.item_factors @ self.user_factors[u]
+        else:
+            scores = np.array(self.popularity, dtype = np.float32)
+
+        excluded = np.zeros(len(self.item_ids), dtype = bool)
+        if i is not None:
+            excluded[i] = True
+        if FILTER_EXCLUDE_PURCHASED in filters and user_id:
+            excluded[self.purchased(user_id)] = True
+        if FILTER_EXCLUDE_CSTORE in filters:
+            excluded |= self.cstore_mask
+        if FILTER_CSTORE_ONLY in filters:
+            excluded |= ~self.cstore_mask
+        if FILTER_SAME_CATEGORIES in filters and i is not None:
+            excluded |= self.item_category_codes != self.item_category_codes[i]
+
+        return self.top_n(scores, excluded, num_results)
+
+    def top_n(self, scores: np.ndarray, excluded: np.ndarray, num_results: int) -> List[Dict]:
+        candidates = np.flatnonzero(~excluded)
+        if len(candidates) == 0 or num_results <= 0:
+            return []
+
+        candidate_scores = scores[candidates]
+        if num_results < len(candidates):
+            top = np.argpartition(-candidate_scores, num_results - 1)[:num_results]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(-candidate_scores[top], kind = 'stable')]
+
+        return [{'itemId': self.item_ids[c], 'score': float(s)} for c, s in zip(candidates[top], candidate_scores[top])]
+
+_models: Dict[str, LocalModel] = {}
+_models_lock = threading.Lock()
+
+def load_model(path: str) -> LocalModel:
+    """ Returns the model at path, loading it on first use; models are shared by all resolvers in the process """
+    model = _models.get(path)
+    if model is None:
+        with _models_lock:
+            model = _models.get(path)
+            if model is None:
+                model = LocalModel(path)
+                _models[path] = model
+    return model
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description = 'Builds the local collaborative-filtering model from interactions.csv')
+    parser.add_argument('--interactions', required = True, help = 'interactions.csv written by generate_interactions_personalize.py')
+    parser.add_argument('--items', help = 'items.csv with the CATEGORY_L1 of each item (needed for the c-store and category filters)')
+    parser.add_argument('--output', required = True, help = 'directory to write the model to')
+    parser.add_argument('--factors', type = int, default = 64, help = 'embedding dimensions')
+    options = parser.parse_args(args)
+
+    metadata = build_model(options.interactions, options.output, items_path = options.items, factors = options.factors)
+    print(f"Wrote model with {len(metadata['user_ids'])} users and {len(metadata['item_ids'])} items to {options.output}")
+
+if __name__ == '__main__':
+    logging.basicConfig(level = logging.INFO)
+    main()
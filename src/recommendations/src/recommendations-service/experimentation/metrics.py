@@ -0,0 +1,134 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import threading
+
+from bisect import bisect_left
+from typing import Dict, List, Sequence
+
+# Latency bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """ Thread-safe, fixed-bucket histogram with the same semantics as a Prometheus histogram
+
+    Observing a value is a bisect plus two additions, so histograms are cheap
+    enough to update on every request.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # One count per bucket plus the +Inf bucket
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> Dict:
+        """ Returns cumulative bucket counts, total count and sum """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        cumulative = []
+        running = 0
+        for upper_bound, count in zip(self.buckets + (float('inf'),), counts):
+            running += count
+            cumulative.append((upper_bound, running))
+
+        return {'buckets': cumulative, 'count': running, 'sum': total}
+
+    def percentile(self, q: float) -> float:
+        """ Returns an estimate of the q-th percentile (0-100) by interpolating within buckets """
+        snapshot = self.snapshot()
+        if snapshot['count'] == 0:
+            return 0.0
+
+        rank = q / 100 * snapshot['count']
+        lower_bound = 0.0
+        previous = 0
+        for upper_bound, cumulative in snapshot['buckets']:
+            if cumulative >= rank:
+                if upper_bound == float('inf'):
+                    return lower_bound
+                in_bucket = cumulative - previous
+                return lower_bound + (upper_bound - lower_bound) * ((rank - previous) / in_bucket if in_bucket else 0)
+            lower_bound = upper_bound
+            previous = cumulative
+        return lower_bound
+
+    def summary(self) -> Dict:
+        """ Returns count, mean and p50/p95/p99 estimates in milliseconds """
+        snapshot = self.snapshot()
+        count = snapshot['count']
+        return {
+            'count': count,
+            'mean_ms': snapshot['sum'] / count * 1000 if count else 0.0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p95_ms': self.percentile(95) * 1000,
+            'p99_ms': self.percentile(99) * 1000
+        }
+
+class HistogramFamily:
+    """ A set of histograms sharing a metric name, partitioned by label values """
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = buckets
+        self._histograms: Dict[tuple, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values) -> Histogram:
+        histogram = self._histograms.get(values)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(values, Histogram(self.buckets))
+        return histogram
+
+    def items(self):
+        with self._lock:
+            return list(self._histograms.items())
+
+    def render(self) -> List[str]:
+        """ Returns the family in the Prometheus text exposition format """
+        return render_histograms(self.name, self.documentation, self.label_names, self.items())
+
+def render_histograms(name: str, documentation: str, label_names: Sequence[str], histograms) -> List[str]:
+    """ Renders (label values, Histogram) pairs in the Prometheus text exposition format """
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} histogram']
+    for label_values, histogram in histograms:
+        labels = ','.join(f'{label}="{_escape(value)}"' for label, value in zip(label_names, label_values))
+        prefix = labels + ',' if labels else ''
+        snapshot = histogram.snapshot()
+        for upper_bound, count in snapshot['buckets']:
+            le = '+Inf' if upper_bound == float('inf') else repr(float(upper_bound))
+            lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {count}')
+        suffix = '{' + labels + '}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {snapshot["sum"]}')
+        lines.append(f'{name}_count{suffix} {snapshot["count"]}')
+    return lines
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def render_counters(name: str, documentation: str, label_names: Sequence[str], samples) -> List[str]:
+    """ Renders (label values, value) pairs as a Prometheus counter """
+    return _render_samples(name, documentation, 'counter', label_names, samples)
+
+def render_gauges(name: str, documentation: str, label_names: Sequence[str], samples) -> List[str]:
+    """ Renders (label values, value) pairs as a Prometheus gauge """
+    return _render_samples(name, documentation, 'gauge', label_names, samples)
+
+def _render_samples(name: str, documentation: str, metric_type: str, label_names: Sequence[str], samples) -> List[str]:
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {metric_type}']
+    for label_values, value in samples:
+        labels = ','.join(f'{label}="{_escape(label_value)}"' for label, label_value in zip(label_names, label_values))
+        lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+    return lines
@@ -0,0 +1,163 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import threading
+import time
+
+import numpy as np
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from experimentation.caching import InvalidatableCache
+
+log = logging.getLogger(__name__)
+
+class OfferSnapshot:
+    """ One version of the offers catalog with the offer preferences as a vector
+
+    Offers are ordered by ID (as strings) and preferences[i] is the preference of
+    offer_ids[i]. Snapshots are shared by concurrent requests and must not be modified.
+    """
+
+    def __init__(self, offers: List[Dict], etag: str = None):
+        self.etag = etag
+        self.offers_by_id = {str(offer['id']): offer for offer in offers}
+        self.offer_ids = sorted(self.offers_by_id)
+        self.index = {offer_id: i for i, offer_id in enumerate(self.offer_ids)}
+        self.preferences = np.array([float(self.offers_by_id[offer_id].get('preference', 1.0)) for offer_id in self.offer_ids])
+
+    def offer(self, offer_id: str) -> Dict:
+        """ Returns a copy of an offer that the caller may modify """
+        return dict(self.offers_by_id[offer_id])
+
+class OfferCatalog(InvalidatableCache):
+    """ Caches the offers catalog and revalidates it with the offers service using its ETag
+
+    The catalog is considered fresh for ttl seconds. After that, the next caller
+    revalidates it with a conditional request (If-None-Match); a 304 extends the
+    current snapshot without transferring or parsing the catalog again. If the offers
+    service cannot be reached, the last snapshot is served for up to max_stale seconds.
+    """
+
+    def __init__(self, ttl: float = 30, max_stale: float = 600):
+        self.ttl = ttl
+        self.max_stale = max_stale
+
+        self._lock = threading.Lock()
+        self._snapshot: Optional[OfferSnapshot] = None
+        self._expires = 0.0
+        self._validated = 0.0
+
+        self._counters = {
+            'hits': 0,
+            'revalidations': 0,
+            'not_modified': 0,
+            'refreshes': 0,
+            'stale_served': 0,
+            'errors': 0,
+            'invalidations': 0
+        }
+
+    def get(self, fetch: Callable[[Optional[str]], Optional[Tuple[List[Dict], Optional[str]]]]) -> OfferSnapshot:
+        """ Returns the current snapshot, revalidating it with fetch when it has expired
+
+        fetch is called with the ETag of the current snapshot (or None) and returns
+        None if the catalog has not changed or the offers and their ETag otherwise.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() < self._expires:
+            self._counters['hits'] += 1
+            return snapshot
+
+        with self._lock:
+            # Another thread may have revalidated while this one waited
+            now = time.monotonic()
+            if self._snapshot is not None and now < self._expires:
+                self._counters['hits'] += 1
+                return self._snapshot
+
+            etag = self._snapshot.etag if self._snapshot is not None else None
+            self._counters['revalidations'] += 1
+            try:
+                fetched = fetch(etag)
+            except Exception as e:
+                self._counters['errors'] += 1
+                if self._snapshot is not None and now - self._validated < self.ttl + self.max_stale:
+                    log.warning('OfferCatalog - could not revalidate offers, serving last catalog: %s', e)
+                    self._counters['stale_served'] += 1
+                    return self._snapshot
+                raise
+
+            if fetched is None and self._snapshot is not None:
+                self._counters['not_modified'] += 1
+            else:
+                offers, etag = fetched
+                self._snapshot = OfferSnapshot(offers, etag)
+                self._counters['refreshes'] += 1
+                log.debug('OfferCatalog - loaded %d offers (ETag %s)', len(self._snapshot.offer_ids), etag)
+
+            self._validated = now
+            self._expires = now + self.ttl
+            return self._snapshot
+
+    def invalidate(self, keys: Iterable[str] = None) -> int:
+        """ Drops the cached catalog (keys are ignored; the catalog is cached as a whole) """
+        with self._lock:
+            removed = 1 if self._snapshot is not None else 0
+            self._snapshot = None
+            self._expires = 0.0
+            self._counters['invalidations'] += removed
+        return removed
+
+    def stats(self) -> Dict:
+        stats = dict(self._counters)
+        snapshot = self._snapshot
+        stats['offers'] = len(snapshot.offer_ids) if snapshot is not None else 0
+        stats['etag'] = snapshot.etag if snapshot is not None else None
+        return stats
+
+def score_offers(snapshot: OfferSnapshot, item_lists: List[List[Dict]], random_factor: float = 0.0,
+                 rng: np.random.Generator = None) -> List[Optional[Tuple[str, float, float]]]:
+    """ Picks the best offer for each of several users from their Personalize recommendations
+
+    item_lists holds one Personalize itemList (dicts with 'itemId' and 'score') per user.
+    The scores are laid out as a users x offers matrix and, in a few vector operations,
+    multiplied by the offer preferences, normalized per user and optionally blended with
+    random noise (which adds serendipity while retaining most of the personalization).
+    Returns (offer ID, Personalize score, adjusted score) per user, or None for users
+    without scores for any offer in the catalog.
+    """
+    n_users, n_offers = len(item_lists), len(snapshot.offer_ids)
+    scores = np.zeros((n_users, n_offers))
+    # Offers Personalize did not return for a user are not candidates for that user
+    present = np.zeros((n_users, n_offers), dtype = bool)
+
+    for row, item_list in enumerate(item_lists):
+        for item in item_list:
+            column = snapshot.index.get(str(item['itemId']))
+            if column is not None:
+                scores[row, column] = float(item['score'])
+                present[row, column] = True
+
+    # We assume we have pre-calculated the adjusting factor, can be a mix of probability when applicable,
+    # calculation of expected return per offer, etc.
+    adjusted = scores * snapshot.preferences
+
+    # Normalise these - makes it easier to do further adjustments
+    sums = adjusted.sum(axis = 1, keepdims = True)
+    adjusted = np.divide(adjusted, sums, out = np.zeros_like(adjusted), where = sums != 0)
+
+    if random_factor:
+        rng = rng or np.random.default_rng()
+        adjusted = adjusted * (1 - random_factor) + random_factor * rng.random(adjusted.shape)
+
+    adjusted[~present] = -np.inf
+    best = np.argmax(adjusted, axis = 1)
+
+    results = []
+    for row, column in enumerate(best):
+        if not present[row, column]:
+            results.append(None)
+        else:
+            results.append((snapshot.offer_ids[column], float(scores[row, column]), float(adjusted[row, column])))
+    return results
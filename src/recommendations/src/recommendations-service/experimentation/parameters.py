@@ -0,0 +1,215 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import os
+import threading
+import time
+
+from typing import Dict, Iterable, List, Optional
+from botocore.exceptions import ClientError
+from experimentation.aws_clients import aws_clients
+from experimentation.caching import InvalidatableCache, ratio
+from experimentation.coalescing import SingleFlight, make_key
+
+log = logging.getLogger(__name__)
+
+# GetParameters accepts at most 10 names per call.
+MAX_NAMES_PER_CALL = 10
+
+THROTTLING_ERROR_CODES = ('ThrottlingException', 'Throttling', 'TooManyRequestsException', 'RequestLimitExceeded')
+
+def is_throttling_error(e: Exception) -> bool:
+    """ Returns True if the exception is a botocore throttling error """
+    return isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+def is_dependency_failure(e: Exception) -> bool:
+    """ Returns True for errors that indicate the called service is unhealthy (not that the request was invalid) """
+    if isinstance(e, ClientError):
+        status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return is_throttling_error(e) or status >= 500
+    return True
+
+class ParameterCache(InvalidatableCache):
+    """ Process-wide TTL cache of SSM parameter values
+
+    Fresh values are served from memory. Once an entry is older than the TTL
+    it is still returned to the caller, but a refresh is queued for a background
+    thread so that request threads only block on SSM the first time a name is
+    requested (or after it has been invalidated); concurrent requests for the
+    same missing names share one call to SSM. If SSM throttles or fails
+    during a refresh, the last known value keeps being served and the refresh
+    is retried after a short backoff. Parameters that do not exist are cached
+    as None so they do not cause a round trip on every request.
+    """
+
+    def __init__(self, ssm_client, ttl: float = 60, error_backoff: float = 5):
+        self._ssm = ssm_client
+        self.ttl = ttl
+        self.error_backoff = error_backoff
+
+        # Parameter name -> (value, monotonic time the value was fetched)
+        self._entries: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+        # Names queued for (or undergoing) a background refresh
+        self._pending = set()
+        self._wakeup = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+
+        # Shares cold fetches between concurrent callers; results are already cached in _entries
+        self._flight = SingleFlight(ttl = 0, copy_fn = lambda values: values)
+
+        self._counters = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+            'throttled': 0,
+            'invalidations': 0
+        }
+
+    def get_values(self, names: Iterable[str]) -> List[Optional[str]]:
+        """ Returns the raw values for the parameter names (None for parameters that do not exist) """
+        names = list(names)
+        now = time.monotonic()
+
+        values = {}
+        missing = []
+        stale = []
+
+        with self._lock:
+            for name in names:
+                entry = self._entries.get(name)
+                if entry is None:
+                    if name not in missing:
+                        missing.append(name)
+                    self._counters['misses'] += 1
+                    continue
+
+                values[name] = entry[0]
+                if now - entry[1] > self.ttl:
+                    stale.append(name)
+                    self._counters['stale_hits'] += 1
+                else:
+                    self._counters['hits'] += 1
+
+        if missing:
+            values.update(self._flight.do(make_key(*missing), lambda: self._fetch(missing)))
+
+        if stale:
+            self._schedule_refresh(stale)
+
+        return [values[name] for name in names]
+
+    def get_value(self, name: str) -> Optional[str]:
+        """ Returns the raw value for a single parameter name """
+        return self.get_values([name])[0]
+
+    def invalidate(self, keys: Iterable[str] = None) -> int:
+        """ Drops the given parameter names (or all names) so the next lookup goes to SSM
+
+        Returns the number of entries removed.
+        """
+        with self._lock:
+            if keys is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                removed = 0
+                for name in keys:
+                    if self._entries.pop(name, None) is not None:
+                        removed += 1
+            self._counters['invalidations'] += removed
+
+        log.info('ParameterCache - invalidated %d entries', removed)
+        return removed
+
+    def stats(self) -> Dict:
+        """ Returns cache counters and current size """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._entries)
+            stats['pending_refreshes'] = len(self._pending)
+
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_ratio'] = ratio(stats['hits'] + stats['stale_hits'], lookups)
+        return stats
+
+    def _fetch(self, names: List[str]) -> Dict[str, Optional[str]]:
+        """ Fetches parameter values from SSM and stores them in the cache """
+        values = {}
+        for i in range(0, len(names), MAX_NAMES_PER_CALL):
+            chunk = names[i:i + MAX_NAMES_PER_CALL]
+            response = self._ssm.get_parameters(Names = chunk)
+
+            found = {param['Name']: param['Value'] for param in response['Parameters']}
+            for name in chunk:
+                values[name] = found.get(name)
+
+        fetched_at = time.monotonic()
+        with self._lock:
+            for name, value in values.items():
+                self._entries[name] = (value, fetched_at)
+
+        return values
+
+    def _schedule_refresh(self, names: List[str]):
+        with self._lock:
+            queued = False
+            for name in names:
+                if name not in self._pending:
+                    self._pending.add(name)
+                    queued = True
+
+            if not queued:
+                return
+
+            # The refresher is (re)started lazily so that a forked worker process
+            # gets its own thread rather than inheriting a dead one.
+            if self._refresher is None or not self._refresher.is_alive():
+                self._refresher = threading.Thread(target=self._run_refresher, name='ssm-parameter-refresh', daemon=True)
+                self._refresher.start()
+
+        self._wakeup.set()
+
+    def _run_refresher(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+
+            with self._lock:
+                names = list(self._pending)
+
+            if names:
+                self._refresh(names)
+
+            with self._lock:
+                self._pending.difference_update(names)
+
+    def _refresh(self, names: List[str]):
+        try:
+            self._fetch(names)
+            with self._lock:
+                self._counters['refreshes'] += 1
+            log.debug('ParameterCache - refreshed %s', names)
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            log.warning('ParameterCache - refresh of %s failed (throttled=%s); serving stale values: %s', names, throttled, e)
+
+            # Keep serving the old values and try again once the backoff elapses.
+            retry_at = time.monotonic() - self.ttl + self.error_backoff
+            with self._lock:
+                self._counters['refresh_errors'] += 1
+                if throttled:
+                    self._counters['throttled'] += 1
+                for name in names:
+                    entry = self._entries.get(name)
+                    if entry is not None:
+                        self._entries[name] = (entry[0], retry_at)
+
+parameter_cache = ParameterCache(
+    aws_clients.client('ssm'),
+    ttl = float(os.environ.get('PARAMETER_CACHE_TTL', 60))
+)
@@ -0,0 +1,121 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import copy
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+from experimentation.caching import InvalidatableCache, ratio
+
+log = logging.getLogger(__name__)
+
+class ProductCache(InvalidatableCache):
+    """ In-process LRU cache of product documents with a TTL
+
+    Products are keyed by (product ID, fullyQualifyImageUrls) since the products
+    service returns different image URLs depending on that flag. Callers receive
+    shallow copies so that per-request changes (such as appending an experiment
+    correlation ID to the product URL) never leak into the cache.
+    """
+
+    def __init__(self, max_size: int = 5000, ttl: float = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        # (product ID, fully qualify flag) -> (product, monotonic expiry time)
+        self._entries: OrderedDict = OrderedDict()
+
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'fetches': 0,
+            'avoided_fetches': 0
+        }
+        # Exponentially weighted average of the products service round trip
+        self._avg_fetch_seconds = 0.0
+
+    def get_many(self, product_ids: Iterable[str], fully_qualify_image_urls: bool) -> Tuple[Dict[str, Dict], List[str]]:
+        """ Returns a dict of cached products keyed by ID and the list of IDs that were not cached """
+        found = {}
+        missing = []
+        missing_ids = set()
+        now = time.monotonic()
+
+        with self._lock:
+            for product_id in product_ids:
+                if product_id in found or product_id in missing_ids:
+                    continue
+
+                key = (product_id, fully_qualify_image_urls)
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(key)
+                    found[product_id] = copy.copy(entry[0])
+                    self._counters['hits'] += 1
+                else:
+                    if entry is not None:
+                        del self._entries[key]
+                    missing.append(product_id)
+                    missing_ids.add(product_id)
+                    self._counters['misses'] += 1
+
+            if found and not missing:
+                self._counters['avoided_fetches'] += 1
+
+        return found, missing
+
+    def put_many(self, products: Iterable[Dict], fully_qualify_image_urls: bool):
+        """ Adds products to the cache, evicting the least recently used entries if needed """
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for product in products:
+                key = (product['id'], fully_qualify_image_urls)
+                self._entries[key] = (copy.copy(product), expires)
+                self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last = False)
+                self._counters['evictions'] += 1
+
+    def record_fetch(self, seconds: float):
+        """ Records the latency of a products service call used to estimate the latency saved by cache hits """
+        with self._lock:
+            self._counters['fetches'] += 1
+            if self._counters['fetches'] == 1:
+                self._avg_fetch_seconds = seconds
+            else:
+                self._avg_fetch_seconds = 0.9 * self._avg_fetch_seconds + 0.1 * seconds
+
+    def invalidate(self, keys: Iterable[str] = None) -> int:
+        """ Drops the given product IDs (or all products) from the cache """
+        with self._lock:
+            if keys is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                removed = 0
+                for product_id in keys:
+                    for fully_qualify_image_urls in (False, True):
+                        if self._entries.pop((product_id, fully_qualify_image_urls), None) is not None:
+                            removed += 1
+            self._counters['invalidations'] += removed
+        return removed
+
+    def stats(self) -> Dict:
+        """ Returns hit ratio, size and an estimate of the hydration latency saved """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._entries)
+            avg_fetch_ms = self._avg_fetch_seconds * 1000
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = ratio(stats['hits'], lookups)
+        stats['avg_fetch_ms'] = avg_fetch_ms
+        stats['saved_ms_estimate'] = stats['avoided_fetches'] * avg_fetch_ms
+        return stats
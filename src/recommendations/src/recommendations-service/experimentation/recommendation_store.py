@@ -0,0 +1,366 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Precomputed recommendations stored in a sorted, memory-mapped file
+
+Features that tolerate stale recommendations can be served from a store written
+offline, either from the output of a Personalize batch inference job or from any
+resolver, instead of calling Personalize for every request. For example:
+
+    python -m experimentation.recommendation_store --output popular.rds --default-key cold-start \\
+        --filter /retaildemostore/personalize/filters/filter-purchased-and-cstore-arn from-batch --input batch.json.out
+
+    python -m experimentation.recommendation_store --output popular.rds --key-type user \\
+        from-resolver --type local-cf --param model_path=model/ --keys users.csv
+
+File layout (little endian):
+
+    header    magic, version, entry count, index offset, metadata length
+    metadata  JSON (key type, source, filter, recipe, creation time)
+    data      for each entry, the UTF-8 key followed by its items as JSON
+    index     (data offset, key length, value length) per entry, sorted by key
+
+Lookups binary search the index directly in the mapped file, so a store is shared
+by all worker processes through the page cache and opening it is constant time.
+Stores are replaced by writing a new file and renaming it over the old one; readers
+notice the new file and swap to it without a restart.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import gzip
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from experimentation.caching import InvalidatableCache
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'RDSRECS\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQ')  # magic, version, reserved, count, index offset, metadata length
+ENTRY = struct.Struct('<QII')       # data offset, key length, value length
+
+KEY_TYPE_USER = 'user'
+KEY_TYPE_ITEM = 'item'
+
+# Entry returned for keys that are not in the store (e.g. new users)
+DEFAULT_KEY = ''
+
+def write_store(path: str, records: Iterable[Tuple[str, List[Dict]]], metadata: Dict = None) -> int:
+    """ Writes (key, items) records to a store at path and returns the number of entries
+
+    The store is written to a temporary file in the same directory and renamed over
+    path, so readers never see a partially written store.
+    """
+    entries = sorted((str(key).encode('utf-8'), json.dumps(items, separators = (',', ':')).encode('utf-8'))
+                     for key, items in records)
+    for previous, current in zip(entries, entries[1:]):
+        if previous[0] == current[0]:
+            raise ValueError(f'Duplicate key {current[0].decode()!r}')
+
+    metadata = dict(metadata or {})
+    metadata.setdefault('created', int(time.time()))
+    metadata_bytes = json.dumps(metadata).encode('utf-8')
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir = directory, prefix = '.' + os.path.basename(path), suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'\x00' * HEADER.size)
+            f.write(metadata_bytes)
+
+            index = []
+            offset = HEADER.size + len(metadata_bytes)
+            for key, value in entries:
+                f.write(key)
+                f.write(value)
+                index.append(ENTRY.pack(offset, len(key), len(value)))
+                offset += len(key) + len(value)
+
+            f.write(b''.join(index))
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, 0, len(entries), offset, len(metadata_bytes)))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    log.info('Wrote %d entries to recommendation store %s', len(entries), path)
+    return len(entries)
+
+class _StoreFile:
+    """ One version of a store file, mapped read-only """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self.buffer = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, version, _, self.count, self.index_offset, metadata_length = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} recommendation store')
+
+        self.metadata = json.loads(self.buffer[HEADER.size:HEADER.size + metadata_length])
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        buffer = self.buffer
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset, key_length, value_length = ENTRY.unpack_from(buffer, self.index_offset + mid * ENTRY.size)
+            candidate = buffer[offset:offset + key_length]
+            if candidate < key:
+                lo = mid + 1
+            elif candidate > key:
+                hi = mid
+            else:
+                return buffer[offset + key_length:offset + key_length + value_length]
+        return None
+
+class RecommendationStore:
+    """ Reads a store written by write_store and reloads it when the file is replaced
+
+    The file is checked for replacement at most every check_interval seconds. A
+    lookup that is in progress during a reload completes against the old mapping.
+    """
+
+    def __init__(self, path: str, check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._file: Optional[_StoreFile] = None
+        self._next_check = 0.0
+
+        self._counters = {
+            'hits': 0,
+            'default_hits': 0,
+            'misses': 0,
+            'reloads': 0,
+            'reload_errors': 0
+        }
+
+    @property
+    def metadata(self) -> Dict:
+        store_file = self._current()
+        return store_file.metadata if store_file else {}
+
+    def get(self, key: str, use_default: bool = True) -> Optional[List[Dict]]:
+        """ Returns the items stored for key (or the default entry) or None """
+        store_file = self._current()
+        value = None
+        counter = 'misses'
+        if store_file is not None:
+            if key is not None:
+                value = store_file.get(str(key).encode('utf-8'))
+                counter = 'hits'
+            if value is None and use_default:
+                value = store_file.get(DEFAULT_KEY.encode('utf-8'))
+                counter = 'default_hits'
+            if value is None:
+                counter = 'misses'
+
+        # Counters are approximate; they are not worth a lock on the lookup path
+        self._counters[counter] += 1
+        return json.loads(value) if value is not None else None
+
+    def reload(self, blocking: bool = True) -> bool:
+        """ Maps the store file if it changed since it was last mapped; returns True if it was (re)loaded """
+        if not self._lock.acquire(blocking):
+            # Another thread is checking the file
+            return False
+        try:
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                if self._file is None:
+                    log.warning('Recommendation store %s not found', self.path)
+                return False
+
+            if self._file is not None and self._file.identity == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+                return False
+
+            try:
+                self._file = _StoreFile(self.path)
+            except Exception as e:
+                self._counters['reload_errors'] += 1
+                log.error('Could not load recommendation store %s: %s', self.path, e)
+                return False
+
+            self._counters['reloads'] += 1
+        finally:
+            self._lock.release()
+
+        log.info('Loaded recommendation store %s (%d entries)', self.path, self._file.count)
+        return True
+
+    def stats(self) -> Dict:
+        stats = dict(self._counters)
+        store_file = self._file
+        stats['entries'] = store_file.count if store_file else 0
+        stats['created'] = store_file.metadata.get('created') if store_file else None
+        return stats
+
+    def _current(self) -> Optional[_StoreFile]:
+        if time.monotonic() >= self._next_check:
+            # Only the first load waits; later checks are skipped while another thread checks
+            self.reload(blocking = self._file is None)
+        return self._file
+
+class RecommendationStores(InvalidatableCache):
+    """ Stores shared by all resolvers in the process, by path """
+
+    def __init__(self, check_interval: float = 5.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._stores: Dict[str, RecommendationStore] = {}
+
+    def get(self, path: str) -> RecommendationStore:
+        store = self._stores.get(path)
+        if store is None:
+            with self._lock:
+                store = self._stores.get(path)
+                if store is None:
+                    store = RecommendationStore(path, check_interval = self.check_interval)
+                    self._stores[path] = store
+        return store
+
+    def invalidate(self, keys: Iterable[str] = None) -> int:
+        """ Checks the stores at the given paths (or all stores) for a new file now """
+        paths = list(keys) if keys is not None else list(self._stores)
+        return sum(1 for path in paths if path in self._stores and self._stores[path].reload())
+
+    def stats(self) -> Dict:
+        return {path: store.stats() for path, store in list(self._stores.items())}
+
+recommendation_stores = RecommendationStores(
+    check_interval = float(os.environ.get('RECOMMENDATION_STORE_CHECK_INTERVAL', 5.0))
+)
+
+def read_batch_inference_output(paths: Iterable[str], default_key: str = None):
+    """ Yields (key, items) records from Personalize batch inference output files (JSON lines)
+
+    default_key names an input user or item ID (e.g. an unseen user included in the
+    batch input) whose recommendations are also stored as the default entry.
+    """
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get('error'):
+                    log.warning('Skipping batch inference record with error: %s', record['error'])
+                    continue
+
+                batch_input = record['input']
+                key = batch_input.get('userId', batch_input.get('itemId'))
+                output = record['output']
+                scores = output.get('scores') or []
+                items = []
+                for position, item_id in enumerate(output['recommendedItems']):
+                    item = {'itemId': item_id}
+                    if position < len(scores):
+                        item['score'] = scores[position]
+                    items.append(item)
+
+                yield key, items
+                if default_key is not None and key == default_key:
+                    yield DEFAULT_KEY, items
+
+def resolve_records(resolver, keys: Iterable[str], key_type: str, num_results: int = 25, max_workers: int = 16,
+                    default_key: str = None):
+    """ Yields (key, items) records from a resolver for each user or item key """
+    def resolve(key):
+        params = {'user_id': key} if key_type == KEY_TYPE_USER else {'product_id': key}
+        try:
+            return key, resolver.get_items(num_results = num_results, **params)
+        except Exception as e:
+            log.warning('Could not resolve items for %s %s: %s', key_type, key, e)
+            return key, None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers) as executor:
+        for key, items in executor.map(resolve, keys):
+            if items is None:
+                continue
+            yield key, items
+            if default_key is not None and key == default_key:
+                yield DEFAULT_KEY, items
+
+def _read_keys(path: str, key_type: str) -> List[str]:
+    """ Reads keys from a CSV with a USER_ID/ITEM_ID column (e.g. users.csv) or a file with one key per line """
+    with open(path, newline = '') as f:
+        first_line = f.readline()
+        f.seek(0)
+        column = 'USER_ID' if key_type == KEY_TYPE_USER else 'ITEM_ID'
+        if column in first_line.split(','):
+            return [row[column] for row in csv.DictReader(f)]
+        return [line.strip() for line in f if line.strip()]
+
+def _parse_param(value: str):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description = 'Writes precomputed recommendations to a recommendation store')
+    parser.add_argument('--output', required = True, help = 'store file to write (replaced atomically)')
+    parser.add_argument('--filter', help = 'SSM parameter name of the filter the recommendations were made with')
+    parser.add_argument('--recipe', help = 'recipe ARN reported for the recommendations')
+    parser.add_argument('--default-key', help = 'user or item ID whose recommendations are served for unknown keys')
+    parser.add_argument('--key-type', choices = [KEY_TYPE_USER, KEY_TYPE_ITEM], default = KEY_TYPE_USER,
+                        help = 'whether entries are keyed by user ID or by item ID')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    batch = commands.add_parser('from-batch', help = 'from Personalize batch inference output')
+    batch.add_argument('--input', required = True, action = 'append', help = 'batch inference output file (repeatable)')
+
+    resolver = commands.add_parser('from-resolver', help = 'from any resolver registered with ResolverFactory')
+    resolver.add_argument('--type', required = True, help = 'resolver type (e.g. local-cf)')
+    resolver.add_argument('--param', action = 'append', default = [], help = 'resolver parameter as name=value (repeatable)')
+    resolver.add_argument('--keys', required = True, help = 'users.csv/items.csv or a file with one ID per line')
+    resolver.add_argument('--num-results', type = int, default = 25)
+    resolver.add_argument('--workers', type = int, default = 16)
+
+    options = parser.parse_args(args)
+    metadata = {'filter': options.filter, 'recipe': options.recipe, 'key_type': options.key_type}
+
+    if options.command == 'from-batch':
+        records = read_batch_inference_output(options.input, default_key = options.default_key)
+        metadata['source'] = 'batch-inference'
+    else:
+        # Imported here so building from batch output does not need the resolvers' dependencies
+        from experimentation.resolvers import ResolverFactory
+
+        params = dict(param.split('=', 1) for param in options.param)
+        instance = ResolverFactory.get(options.type, **{name: _parse_param(value) for name, value in params.items()})
+        keys = _read_keys(options.keys, options.key_type)
+        records = resolve_records(instance, keys, options.key_type, num_results = options.num_results,
+                                  max_workers = options.workers, default_key = options.default_key)
+        metadata['source'] = f'resolver:{options.type}'
+
+    count = write_store(options.output, records, {k: v for k, v in metadata.items() if v is not None})
+    print(f'Wrote {count} entries to {options.output}')
+
+if __name__ == '__main__':
+    logging.basicConfig(level = logging.INFO)
+    main()
@@ -4,14 +4,120 @@
 from abc import ABC, abstractmethod
 
 import requests
-import boto3
+import os
 import urllib.parse
+import heapq
 import logging
+import math
 
+from botocore.config import Config
 from random import shuffle
+from experimentation import deadline
+from experimentation.aws_clients import aws_clients
+from experimentation.circuit_breaker import CircuitBreaker
+from experimentation.concurrency import run_concurrently
+from experimentation.discovery import service_discovery
+from experimentation.http_client import http_client
+from experimentation.local_model import load_model
+from experimentation.recommendation_store import recommendation_stores, KEY_TYPE_ITEM
+from experimentation.parameters import is_dependency_failure
 
 log = logging.getLogger(__name__)
-servicediscovery = boto3.client('servicediscovery')
+
+# Bound how long a Personalize call can block so a slow or throttled service cannot
+# hold a request past its time budget (boto3 would otherwise wait 60s and retry).
+PERSONALIZE_CONNECT_TIMEOUT = float(os.environ.get('PERSONALIZE_CONNECT_TIMEOUT', 0.5))
+PERSONALIZE_READ_TIMEOUT = float(os.environ.get('PERSONALIZE_READ_TIMEOUT', 1.5))
+PERSONALIZE_MAX_ATTEMPTS = 2
+
+# Longest backoff (seconds) botocore's standard retry mode waits before the first retry
+PERSONALIZE_RETRY_BACKOFF = 1.0
+
+# Shortest read timeout (seconds) given to a Personalize call
+PERSONALIZE_MIN_READ_TIMEOUT = 0.05
+
+personalize_runtime_config = Config(
+    connect_timeout = PERSONALIZE_CONNECT_TIMEOUT,
+    read_timeout = PERSONALIZE_READ_TIMEOUT,
+    retries = {'max_attempts': PERSONALIZE_MAX_ATTEMPTS, 'mode': 'standard'}
+)
+
+# Minimum time (seconds) left in the request's budget to start a Personalize call
+PERSONALIZE_MIN_BUDGET = float(os.environ.get('PERSONALIZE_MIN_BUDGET', 0.15))
+
+def personalize_runtime_tiers():
+    """ Returns (worst case seconds, config) pairs from the most to the least patient client config
+
+    The first tier is the configured client with retries. The others make a single attempt
+    with the read timeout halved each time, so a call started late in a request can only
+    block for about as long as the request has left. Clients are cached per config, so
+    the tiers are fixed rather than derived from each request's exact remaining time.
+    """
+    worst_case = PERSONALIZE_MAX_ATTEMPTS * (PERSONALIZE_CONNECT_TIMEOUT + PERSONALIZE_READ_TIMEOUT) + \
+        (PERSONALIZE_MAX_ATTEMPTS - 1) * PERSONALIZE_RETRY_BACKOFF
+    tiers = [(worst_case, personalize_runtime_config)]
+
+    read_timeout = PERSONALIZE_READ_TIMEOUT
+    connect_timeout = PERSONALIZE_CONNECT_TIMEOUT
+    while read_timeout >= PERSONALIZE_MIN_READ_TIMEOUT:
+        connect_timeout = min(connect_timeout, read_timeout)
+        config = Config(
+            connect_timeout = connect_timeout,
+            read_timeout = read_timeout,
+            retries = {'max_attempts': 1, 'mode': 'standard'}
+        )
+        tiers.append((connect_timeout + read_timeout, config))
+        read_timeout /= 2
+
+    return tiers
+
+_personalize_runtime_tiers = [
+    (worst_case, aws_clients.client('personalize-runtime', config = config))
+    for worst_case, config in personalize_runtime_tiers()
+]
+
+def personalize_runtime_for_budget(remaining: float = None):
+    """ Returns the most patient Personalize runtime client whose worst case fits in remaining seconds
+
+    Without a budget (remaining is None) the configured client is returned. When even the
+    least patient client does not fit, it is returned anyway; call_personalize refuses to
+    start calls with less than PERSONALIZE_MIN_BUDGET left.
+    """
+    if remaining is None:
+        return _personalize_runtime_tiers[0][1]
+
+    for worst_case, client in _personalize_runtime_tiers:
+        if worst_case <= remaining:
+            return client
+    return _personalize_runtime_tiers[-1][1]
+
+# Shared by all Personalize resolvers (including those used by experiments)
+personalize_breaker = CircuitBreaker(
+    'personalize',
+    failure_threshold = int(os.environ.get('PERSONALIZE_BREAKER_THRESHOLD', 5)),
+    cooldown = float(os.environ.get('PERSONALIZE_BREAKER_COOLDOWN', 30))
+)
+
+def call_personalize(operation: str, **params):
+    """ Calls a Personalize runtime operation unless the request's budget is spent or the circuit is open
+
+    The call's timeouts and retries are bounded by the time left in the request's budget.
+    """
+    deadline.check(PERSONALIZE_MIN_BUDGET, 'Personalize call')
+    personalize_breaker.check()
+
+    client = personalize_runtime_for_budget(deadline.remaining())
+    try:
+        response = getattr(client, operation)(**params)
+    except Exception as e:
+        if is_dependency_failure(e):
+            personalize_breaker.record_failure()
+        else:
+            personalize_breaker.record_success()
+        raise
+
+    personalize_breaker.record_success()
+    return response
 
 class Resolver(ABC):
     """ Abstract base class for all resolvers"""
@@ -41,18 +147,7 @@ class DefaultProductResolver(Resolver):
         # All we need to initialize this resolver is the instance host/IP and port for the Product service
         self.products_service_host = params.get('products_service_host')
         self.products_service_port = params.get('products_service_port', 80)
-        if not self.products_service_host:
-            # host/IP wasn't provided so attempt to discover instance
-            response = servicediscovery.discover_instances(
-                NamespaceName='retaildemostore.local',
-                ServiceName='products',
-                MaxResults=1,
-                HealthStatus='HEALTHY'
-            )
-
-            self.products_service_host = response['Instances'][0]['Attributes']['AWS_INSTANCE_IPV4']
-            log.debug('DefaultProductResolver - fetched product service instance %s', self.products_service_host)
-        else:
+        if self.products_service_host:
             log.debug('DefaultProductResolver - using product service instance %s', self.products_service_host)
 
         self.fully_qualify_image_urls = params.get('fully_qualify_image_urls', False)
@@ -74,27 +169,41 @@ class DefaultProductResolver(Resolver):
 
         category = None
 
+        # When no host/IP was provided, pick a healthy instance for each call so load is spread across instances
+        products_service_host = self.products_service_host
+        if not products_service_host:
+            products_service_host = service_discovery.get_host('products')
+            log.debug('DefaultProductResolver - fetched product service instance %s', products_service_host)
+
         if product_id:
             # Lookup product to determine if it belongs to a category
-            url = f'http://{self.products_service_host}:{self.products_service_port}/products/id/{product_id}'
+            url = f'http://{products_service_host}:{self.products_service_port}/products/id/{product_id}'
             log.debug('DefaultProductResolver - getting product details %s', url)
             try:
-                response = requests.get(url)
+                response = http_client.get(url)
                 if response.ok:
                     category = response.json()['category']
             except requests.ConnectionError as e:
                 log.error("Could not pull product information from URL %s - error: %s", url, e)
+                if not self.products_service_host:
+                    service_discovery.evict('products', products_service_host)
+                    products_service_host = service_discovery.get_host('products')
 
         if category:
             # Product belongs to a category so get list of products in same category
-            url = f'http://{self.products_service_host}:{self.products_service_port}/products/category/{category}?fullyQualifyImageUrls={self.fully_qualify_image_urls}'
+            url = f'http://{products_service_host}:{self.products_service_port}/products/category/{category}?fullyQualifyImageUrls={self.fully_qualify_image_urls}'
             log.debug('DefaultProductResolver - getting products for category %s', url)
-            response = requests.get(url)
         else:
             # Product not specified or does not belong to a category so fallback to featured products
-            url = f'http://{self.products_service_host}:{self.products_service_port}/products/featured?fullyQualifyImageUrls={self.fully_qualify_image_urls}'
+            url = f'http://{products_service_host}:{self.products_service_port}/products/featured?fullyQualifyImageUrls={self.fully_qualify_image_urls}'
             log.debug('DefaultProductResolver - getting featured products %s', url)
-            response = requests.get(url)
+
+        try:
+            response = http_client.get(url)
+        except requests.ConnectionError:
+            if not self.products_service_host:
+                service_discovery.evict('products', products_service_host)
+            raise
 
         if response.ok:
             # Create response making sure not to include current product
@@ -122,18 +231,7 @@ class SearchSimilarProductsResolver(Resolver):
         # All we need to initialize this resolver is the instance host/IP and port for the Search service
         self.search_service_host = params.get('search_service_host')
         self.search_service_port = params.get('search_service_port', 80)
-        if not self.search_service_host:
-            # host/IP wasn't provided so attempt to discover instance
-            response = servicediscovery.discover_instances(
-                NamespaceName='retaildemostore.local',
-                ServiceName='search',
-                MaxResults=1,
-                HealthStatus='HEALTHY'
-            )
-
-            self.search_service_host = response['Instances'][0]['Attributes']['AWS_INSTANCE_IPV4']
-            log.debug('SearchSimilarProductsResolver - fetched search service instance %s', self.search_service_host)
-        else:
+        if self.search_service_host:
             log.debug('SearchSimilarProductsResolver - using search service instance %s', self.search_service_host)
 
     def get_items(self, **kwargs):
@@ -151,9 +249,20 @@ class SearchSimilarProductsResolver(Resolver):
         if kwargs.get('num_results'):
             num_results = int(kwargs['num_results'])
 
-        url = f'http://{self.search_service_host}:{self.search_service_port}/similar/products?productId={product_id}'
+        # When no host/IP was provided, pick a healthy instance for each call so load is spread across instances
+        search_service_host = self.search_service_host
+        if not search_service_host:
+            search_service_host = service_discovery.get_host('search')
+            log.debug('SearchSimilarProductsResolver - fetched search service instance %s', search_service_host)
+
+        url = f'http://{search_service_host}:{self.search_service_port}/similar/products?productId={product_id}'
         log.debug('SearchSimilarProductsResolver - getting similar products %s', url)
-        response = requests.get(url)
+        try:
+            response = http_client.get(url)
+        except requests.ConnectionError:
+            if not self.search_service_host:
+                service_discovery.evict('search', search_service_host)
+            raise
 
         items = []
 
@@ -169,8 +278,6 @@ class SearchSimilarProductsResolver(Resolver):
 
 class PersonalizeRecommendationsResolver(Resolver):
     """ Provides recommendations from an Amazon Personalize campaign """
-    __personalize_runtime = boto3.client('personalize-runtime')
-
     def __init__(self, **params):
         # All we need to initialize this resolver is the ARN for the Personalize campaign/recommender
         self.inference_arn = params.get('inference_arn')
@@ -234,7 +341,7 @@ class PersonalizeRecommendationsResolver(Resolver):
 
         log.debug('PersonalizeRecommendationsResolver - getting recommendations %s', params)
 
-        response = PersonalizeRecommendationsResolver.__personalize_runtime.get_recommendations(**params)
+        response = call_personalize('get_recommendations', **params)
 
         return response['itemList']
 
@@ -278,7 +385,7 @@ class HttpResolver(Resolver):
         url += urllib.parse.urlencode(params)
 
         log.debug('HttpResolver - calling ' + url)
-        response = requests.get(url)
+        response = http_client.get(url)
 
         items = []
 
@@ -297,12 +404,96 @@ class HttpResolver(Resolver):
         return items
 
 
+class LocalCollaborativeFilteringResolver(Resolver):
+    """ Provides recommendations from a local collaborative-filtering model
+
+    The model is built from the interactions dataset with experimentation/local_model.py
+    and scored in-process, so it can stand in for a Personalize campaign when running
+    offline, in load tests or while Personalize is unavailable. Filters are named
+    rather than ARNs (see local_model.FILTERS) and mirror the demo's Personalize filters.
+    """
+
+    def __init__(self, **params):
+        self.model_path = params.get('model_path', os.environ.get('LOCAL_MODEL_PATH'))
+        if not self.model_path:
+            raise Exception('model_path (or LOCAL_MODEL_PATH) required for LocalCollaborativeFilteringResolver')
+
+        # Optionally support filters specified at resolver creation.
+        self.filters = params.get('filters') or []
+
+    def get_items(self, **kwargs):
+        """ Returns recommended items for a user or related items for a product
+
+        Arguments:
+            user_id - ID for the user for which to make recommendations (required unless product_id is given)
+            product_id - ID for the item to return related items for (optional)
+            num_results - maximum number of recommendations to return (optional)
+            filters - names of filters to apply (overrides ctor filters) (optional)
+        """
+        user_id = kwargs.get('user_id')
+        item_id = kwargs.get('product_id')
+        if not user_id and not item_id:
+            raise Exception('user_id or product_id is required')
+
+        num_results = 25
+        if kwargs.get('num_results'):
+            num_results = int(kwargs['num_results'])
+
+        filters = kwargs.get('filters') or self.filters
+
+        log.debug('LocalCollaborativeFilteringResolver - recommending for user %s item %s filters %s', user_id, item_id, filters)
+        model = load_model(self.model_path)
+        return model.recommend(user_id = str(user_id) if user_id else None, item_id = item_id,
+                               num_results = num_results, filters = filters)
+
+class PrecomputedResolver(Resolver):
+    """ Provides recommendations precomputed offline and stored in a recommendation store
+
+    The store is written by experimentation/recommendation_store.py from Personalize
+    batch inference output or from another resolver and is keyed by user or item ID.
+    Lookups are a binary search in a memory-mapped file, so this resolver suits features
+    that can tolerate recommendations as stale as the last time the store was written.
+    """
+
+    def __init__(self, **params):
+        self.store_path = params.get('store_path')
+        if not self.store_path:
+            raise Exception('store_path required for PrecomputedResolver')
+        self.store = recommendation_stores.get(self.store_path)
+
+    def get_items(self, **kwargs):
+        """ Returns the stored recommendations for a user or item
+
+        Arguments:
+            user_id - ID for the user (required for stores keyed by user)
+            product_id - ID for the item (required for stores keyed by item)
+            num_results - maximum number of recommendations to return (optional)
+        """
+        if self.store.metadata.get('key_type') == KEY_TYPE_ITEM:
+            key = kwargs.get('product_id')
+            if not key:
+                raise Exception('product_id is required')
+        else:
+            key = kwargs.get('user_id')
+            if not key:
+                raise Exception('user_id is required')
+
+        items = self.store.get(str(key)) or []
+
+        if kwargs.get('num_results'):
+            items = items[:int(kwargs['num_results'])]
+
+        return items
+
 class PersonalizeRankingResolver(Resolver):
     """ Provides personalized ranking of products from an Amazon Personalize campaign created with the Personalized-Ranking recipe
 
-    The campaign must be trained using the Personalized-Ranking recipe
+    The campaign must be trained using the Personalized-Ranking recipe. GetPersonalizedRanking
+    accepts at most 500 items, so larger lists are split into evenly sized chunks that are
+    ranked concurrently and merged into one list ordered by score.
     """
-    __personalize_runtime = boto3.client('personalize-runtime')
+    # Maximum inputList size accepted by GetPersonalizedRanking
+    MAX_INPUT_ITEMS = 500
 
     def __init__(self, **params):
         # All we need to initialize this resolver is the ARN for the Personalize campaign
@@ -315,6 +506,9 @@ class PersonalizeRankingResolver(Resolver):
 
         self.context = params.get('context', None)
 
+        # Deadline in seconds for the concurrent chunk rankings (None uses the shared default)
+        self.timeout = params.get('timeout')
+
     def get_items(self, **kwargs):
         """ Returns reranking items from an Amazon Personalize campaign trained with Personalized-Ranking recipe
 
@@ -354,9 +548,30 @@ class PersonalizeRankingResolver(Resolver):
         if 'context' in kwargs and kwargs['context'] is not None: 
             params['context'] = kwargs['context']
 
+        if len(input_list) <= PersonalizeRankingResolver.MAX_INPUT_ITEMS:
+            return self._rank(params)
+
+        # Evenly sized chunks keep the scores of the separate rankings comparable
+        chunk_count = math.ceil(len(input_list) / PersonalizeRankingResolver.MAX_INPUT_ITEMS)
+        chunk_size = math.ceil(len(input_list) / chunk_count)
+        chunks = [input_list[i:i + chunk_size] for i in range(0, len(input_list), chunk_size)]
+
+        log.debug('PersonalizeRankingResolver - ranking %d items in %d chunks', len(input_list), len(chunks))
+        results = run_concurrently([
+            lambda chunk=chunk: self._rank(dict(params, inputList = chunk)) for chunk in chunks
+        ], timeout = self.timeout)
+
+        for result in results:
+            if not result.ok:
+                raise result.error
+
+        # Each chunk is already in descending score order, so a k-way merge yields the global order
+        return list(heapq.merge(*[result.value for result in results], key = lambda item: -item.get('score', 0.0)))
+
+    def _rank(self, params):
         log.debug('PersonalizeRankingResolver - getting personalized ranking %s', params)
 
-        response = PersonalizeRankingResolver.__personalize_runtime.get_personalized_ranking(**params)
+        response = call_personalize('get_personalized_ranking', **params)
 
         return response['personalizedRanking']
 
@@ -399,7 +614,9 @@ class PersonalizeContextComparePickResolver(Resolver):
 
     def __init__(self, **params):
         with_context = params.get('with_context')
-        without_context = params.get('with_context')
+        without_context = params.get('without_context')
+        # Deadline in seconds for the two ranking calls (None uses the shared default)
+        self.timeout = params.get('timeout')
         self.with_resolver = PersonalizeRankingResolver(**params, context=with_context)
         self.without_resolver = PersonalizeRankingResolver(**params, context=without_context)
 
@@ -416,8 +633,22 @@ class PersonalizeContextComparePickResolver(Resolver):
             raise Exception('num_results is required')
 
         log.debug('PersonalizeContextComparePickResolver - comparing personalized rankings...')
-        with_ranked = self.with_resolver.get_items(**kwargs)
-        without_ranked = self.without_resolver.get_items(**kwargs)
+        with_result, without_result = run_concurrently([
+            lambda: self.with_resolver.get_items(**kwargs),
+            lambda: self.without_resolver.get_items(**kwargs)
+        ], timeout = self.timeout)
+
+        if not with_result.ok and not without_result.ok:
+            raise with_result.error
+        if not with_result.ok or not without_result.ok:
+            # Without both rankings there is nothing to compare, so fall back to the ranking we have.
+            result = with_result if with_result.ok else without_result
+            log.warning('PersonalizeContextComparePickResolver - one ranking unavailable, using the other: %s',
+                        (without_result if with_result.ok else with_result).error)
+            return result.value[:top_n]
+
+        with_ranked = with_result.value
+        without_ranked = without_result.value
         without_id_to_item = {item['itemId']: item for item in without_ranked}
         with_id_to_item = {item['itemId']: item for item in with_ranked}
         score_increases_with_discount = {item_id: with_id_to_item[item_id]['score'] / (0.01 + without_id_to_item[item_id]['score'])
@@ -473,6 +704,8 @@ class ResolverFactory:
     TYPE_RANKING_NO_OP = 'ranking-no-op'
     TYPE_PERSONALIZE_PICK = 'personalize-pick'
     TYPE_RANDOM_PICK = 'random-pick'
+    TYPE_LOCAL_CF = 'local-cf'
+    TYPE_PRECOMPUTED = 'precomputed'
 
     __resolvers = {}
 
@@ -497,6 +730,8 @@ ResolverFactory.register_resolver(ResolverFactory.TYPE_PRODUCT, DefaultProductRe
 ResolverFactory.register_resolver(ResolverFactory.TYPE_SIMILAR, SearchSimilarProductsResolver)
 ResolverFactory.register_resolver(ResolverFactory.TYPE_PERSONALIZE_RECOMMENDATIONS, PersonalizeRecommendationsResolver)
 ResolverFactory.register_resolver(ResolverFactory.TYPE_HTTP, HttpResolver)
+ResolverFactory.register_resolver(ResolverFactory.TYPE_LOCAL_CF, LocalCollaborativeFilteringResolver)
+ResolverFactory.register_resolver(ResolverFactory.TYPE_PRECOMPUTED, PrecomputedResolver)
 # These resolvers are used with product reranking use-cases
 ResolverFactory.register_resolver(ResolverFactory.TYPE_PERSONALIZE_RANKING, PersonalizeRankingResolver)
 ResolverFactory.register_resolver(ResolverFactory.TYPE_RANKING_NO_OP, RankingProductsNoOpResolver)
@@ -0,0 +1,308 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import unittest
+
+from unittest.mock import MagicMock, patch
+from werkzeug.test import Client
+from experimentation import deadline
+from experimentation.caching import InvalidatableCache
+
+import app
+
+"""
+python -m unittest experimentation/test_app.py
+"""
+
+RECOMMENDER_PARAM = '/retaildemostore/personalize/recommended-for-you-arn'
+
+def resolve(user_id = '1', feature = 'home_product_recs'):
+    return app.resolve_items(
+        feature = feature,
+        user_id = user_id,
+        current_item_id = None,
+        num_results = 5,
+        default_inference_arn_param_name = RECOMMENDER_PARAM,
+        default_filter_arn_param_name = app.filter_purchased_param_name
+    )
+
+class TestResolveItems(unittest.TestCase):
+
+    def setUp(self):
+        app.user_results.invalidate()
+        manager = patch('app.ExperimentManager')
+        self.manager = manager.start().return_value
+        self.addCleanup(manager.stop)
+
+    def test_active_experiment_bypasses_cached_results(self):
+        self.manager.get_active.return_value = None
+        key = app.make_key('home_product_recs', app.filter_purchased_param_name, None, 5, RECOMMENDER_PARAM, None, False, None)
+        app.user_results.put('1', key, ([{'itemId': 'cached'}], {}))
+        self.assertEqual(resolve()[0], [{'itemId': 'cached'}])
+
+        # The experiment is activated after the user's results were cached
+        experiment = MagicMock()
+        experiment.get_items.return_value = [{'itemId': 'a', 'experiment': {'correlationId': 'exp1~1~0~1'}}]
+        self.manager.get_active.return_value = experiment
+
+        items, headers = resolve()
+
+        experiment.get_items.assert_called_once()
+        self.assertEqual(items[0]['itemId'], 'a')
+        self.assertEqual(headers['X-Experiment-Id'], experiment.id)
+
+    def test_precomputed_store_requires_same_filter(self):
+        self.manager.get_active.return_value = None
+        precomputed = MagicMock()
+        precomputed.get_items.return_value = [{'itemId': 'precomputed'}]
+        personalize = MagicMock()
+        personalize.get_items.return_value = [{'itemId': 'personalize'}]
+
+        for store_filter, expected in ((None, 'personalize'), (app.filter_purchased_param_name, 'precomputed')):
+            with self.subTest(store_filter = store_filter):
+                app.user_results.invalidate()
+                precomputed.store.metadata = {'filter': store_filter}
+                with patch.dict('app.PRECOMPUTED_STORES', {'home_product_recs': 'recs.rds'}), \
+                        patch('app.PrecomputedResolver', return_value = precomputed), \
+                        patch('app.PersonalizeRecommendationsResolver', return_value = personalize), \
+                        patch('app.get_parameter_values', return_value = ['arn:recommender', 'arn:filter']), \
+                        patch('app.get_recipe', return_value = 'arn:recipe'):
+                    items, _ = resolve()
+                self.assertEqual(items[0]['itemId'], expected)
+
+class TestGetProducts(unittest.TestCase):
+
+    def setUp(self):
+        app.products_flight.invalidate()
+
+    def test_anonymous_calls_coalesced_per_feature(self):
+        def items_for_feature(feature = None, **kwargs):
+            return [{'itemId': feature}], {}
+
+        with patch('app.resolve_items', side_effect = items_for_feature), \
+                patch('app.fetch_product_details', side_effect = product_details), \
+                app.app.test_request_context('/recommendations'):
+            for feature in ('home_product_recs', 'product_detail_related', 'home_product_recs'):
+                items, _ = app.get_products(feature, None, None, 5, RECOMMENDER_PARAM, app.filter_purchased_param_name)
+                self.assertEqual(items[0]['product']['id'], feature)
+
+def resolved_items(user_id = None, **kwargs):
+    """ Stands in for resolve_items: user '2' fails, the others get two items """
+    if user_id == '2':
+        raise ValueError('boom')
+    return [{'itemId': f'{user_id}-a'}, {'itemId': 'shared'}], {'X-Personalize-Recipe': 'recipe'}
+
+def product_details(item_ids, fully_qualify_image_urls = False):
+    return [{'id': item_id, 'name': f'Product {item_id}'} for item_id in item_ids]
+
+class EndpointTestCase(unittest.TestCase):
+    """ Calls the service through a WSGI test client with experiments and SSM patched out """
+
+    def setUp(self):
+        self.client = Client(app.app)
+        app.user_results.invalidate()
+        self.patch('app.ExperimentManager').return_value.get_active.return_value = None
+        self.patch('app.get_parameter_values', side_effect = lambda names: [None] * (1 if isinstance(names, str) else len(names)))
+
+    def patch(self, target, **kwargs):
+        patcher = patch(target, **kwargs)
+        mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        return mock
+
+    def post(self, path, body):
+        return self.client.post(path, data = json.dumps(body), content_type = 'application/json')
+
+    def assertBadRequest(self, path, body, message):
+        response = self.post(path, body)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(message, response.json['message'])
+
+class TestRecommendationsBatch(EndpointTestCase):
+
+    def test_validation(self):
+        self.assertBadRequest('/recommendations/batch', {}, 'userIDs is required')
+        self.assertBadRequest('/recommendations/batch', {'userIDs': '1'}, 'userIDs is required')
+        self.assertBadRequest('/recommendations/batch', {'userIDs': ['1'], 'numResults': 0}, 'greater than zero')
+        self.assertBadRequest('/recommendations/batch', {'userIDs': ['1'], 'numResults': 101}, 'less than 100')
+        with patch('app.BATCH_MAX_USERS', 2):
+            self.assertBadRequest('/recommendations/batch', {'userIDs': ['1', '2', '3']}, 'more than 2 users')
+
+    def test_one_line_per_user_in_order(self):
+        self.patch('app.resolve_items', side_effect = resolved_items)
+        fetch = self.patch('app.fetch_product_details', side_effect = product_details)
+
+        user_ids = [str(user_id) for user_id in range(1, 41)]
+        response = self.post('/recommendations/batch', {'userIDs': user_ids, 'numResults': 2})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, 'application/x-ndjson')
+        body = response.get_data(as_text = True)
+        self.assertTrue(body.endswith('\n'))
+        lines = [json.loads(line) for line in body.splitlines()]
+
+        self.assertEqual([line['userID'] for line in lines], user_ids)
+        self.assertEqual(lines[1], {'userID': '2', 'error': 'boom'})
+        self.assertEqual(lines[0]['items'], [{'product': {'id': '1-a', 'name': 'Product 1-a'}},
+                                             {'product': {'id': 'shared', 'name': 'Product shared'}}])
+        self.assertEqual(lines[0]['headers'], {'X-Personalize-Recipe': 'recipe'})
+
+        # Items shared by users that completed together are looked up once
+        for call in fetch.call_args_list:
+            self.assertEqual(len(call[0][0]), len(set(call[0][0])))
+
+    def test_hydration_failure_fails_the_users(self):
+        self.patch('app.resolve_items', side_effect = resolved_items)
+        self.patch('app.fetch_product_details', side_effect = Exception('products down'))
+
+        response = self.post('/recommendations/batch', {'userIDs': ['1']})
+        self.assertEqual([json.loads(line) for line in response.get_data(as_text = True).splitlines()],
+                         [{'userID': '1', 'error': 'products down'}])
+
+class TestHome(EndpointTestCase):
+
+    def test_validation(self):
+        self.assertBadRequest('/home', {}, 'userID is required')
+        self.assertBadRequest('/home', {'userID': '1', 'widgets': []}, 'widgets must be a non-empty list')
+        self.assertBadRequest('/home', {'userID': '1', 'widgets': ['carousel']}, 'Unknown widgets')
+        self.assertBadRequest('/home', {'userID': '1', 'numResults': 101}, 'less than 100')
+        self.assertBadRequest('/home', {'userID': '1', 'featuredItems': 'x'}, 'featuredItems must be a list')
+
+    def test_widgets_hydrated_with_one_lookup(self):
+        resolve = self.patch('app.resolve_items', side_effect = resolved_items)
+        fetch = self.patch('app.fetch_product_details', side_effect = product_details)
+        ranking = self.patch('app.get_ranking', side_effect = Exception('ranking down'))
+
+        response = self.post('/home', {'userID': '1', 'featuredItems': [{'id': 'f1'}]})
+
+        self.assertEqual(response.status_code, 200)
+        widgets = response.json['widgets']
+        self.assertEqual(response.json['userID'], '1')
+        self.assertEqual(widgets['featured'], {'error': 'ranking down'})
+        for name in ('recommendations', 'popular'):
+            self.assertEqual([item['product']['id'] for item in widgets[name]['items']], ['1-a', 'shared'])
+        self.assertEqual(resolve.call_count, 2)
+        ranking.assert_called_once()
+        fetch.assert_called_once_with(['1-a', 'shared'], False)
+
+class TestCouponOfferBatch(EndpointTestCase):
+
+    def test_validation(self):
+        self.assertBadRequest('/coupon_offer/batch', {}, 'userIDs is required')
+        with patch('app.BATCH_MAX_USERS', 1):
+            self.assertBadRequest('/coupon_offer/batch', {'userIDs': ['1', '2']}, 'more than 1 users')
+
+    def test_offer_or_error_per_user_in_order(self):
+        self.patch('app.get_parameter_values', return_value = ['arn:offers'])
+        self.patch('app.get_recipe', return_value = 'arn:recipe')
+        self.patch('app.offers_catalog').get.return_value.offer_ids = ['1', '2']
+
+        def offer_recommendations(inference_arn, user_id, num_results):
+            if user_id == '2':
+                raise ValueError('throttled')
+            return [{'itemId': '1', 'score': 0.5}]
+        self.patch('app.get_offer_recommendations', side_effect = offer_recommendations)
+        choose = self.patch('app.choose_offers', side_effect = lambda user_ids, arn, snapshot, item_lists:
+                            [{'id': '1'} if items else None for items in item_lists])
+
+        response = self.post('/coupon_offer/batch', {'userIDs': [1, 2, 3]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Personalize-Recipe'], 'arn:recipe')
+        self.assertEqual(response.json['offers'], [
+            {'userID': '1', 'offer': {'id': '1'}},
+            {'userID': '2', 'error': 'throttled'},
+            {'userID': '3', 'offer': {'id': '1'}}
+        ])
+        choose.assert_called_once()
+
+class TestExperimentOutcomeBatch(EndpointTestCase):
+
+    def test_validation(self):
+        self.assertBadRequest('/experiment/outcome/batch', {}, 'correlationIds is required')
+        with patch('app.BATCH_MAX_OUTCOMES', 1):
+            self.assertBadRequest('/experiment/outcome/batch', {'correlationIds': ['a', 'b']}, 'more than 1 IDs')
+
+    def test_status_per_correlation_id(self):
+        experiment = MagicMock()
+        experiment.track_conversions.return_value = ['tracked', 'invalid']
+
+        def get_by_id(experiment_id):
+            if experiment_id == 'broken':
+                raise Exception('table unavailable')
+            return experiment if experiment_id == 'exp1' else None
+        app.ExperimentManager.return_value.get_by_id.side_effect = get_by_id
+        user_results = self.patch('app.user_results')
+
+        correlation_ids = ['exp1~u1~0~1', 'malformed', 'exp1~u2~9~1', 'missing~u3~0~1', 'broken~u4~0~1']
+        response = self.post('/experiment/outcome/batch', {'correlationIds': correlation_ids})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.json['results']],
+                         ['tracked', 'invalid', 'invalid', 'not_found', 'error'])
+        self.assertEqual(response.json['tracked'], 1)
+        # Each experiment is loaded once and its conversions are tracked together
+        experiment.track_conversions.assert_called_once()
+        self.assertEqual(experiment.track_conversions.call_args[0][0], ['exp1~u1~0~1', 'exp1~u2~9~1'])
+        user_results.invalidate_user.assert_called_once_with('u1')
+
+class TestMetrics(EndpointTestCase):
+
+    def test_tracker_stats_exposed(self):
+        tracker = MagicMock(spec = app.BufferedKinesisTracker)
+        tracker.stats.return_value = {
+            'enqueued': 5, 'dropped': 1, 'sent': 3, 'failed': 0, 'retried': 2, 'batches': 2,
+            'queue_depth': 1, 'flush_latency_avg_ms': 20.0, 'flush_latency_max_ms': 30.0
+        }
+        app.ExperimentManager.return_value.trackers.return_value = {'events': tracker}
+
+        text = self.client.get('/metrics').get_data(as_text = True)
+
+        self.assertIn('recommendations_experiment_tracker_events_total{stream="events",outcome="dropped"} 1', text)
+        self.assertIn('# TYPE recommendations_experiment_tracker_queue_depth gauge', text)
+        self.assertIn('recommendations_experiment_tracker_queue_depth{stream="events"} 1', text)
+        self.assertIn('recommendations_experiment_tracker_flush_latency_seconds{stream="events",statistic="max"} 0.03', text)
+
+    def test_experiment_counter_stats_exposed(self):
+        app.ExperimentManager.return_value.trackers.return_value = {}
+        stats = {'increments': 4, 'flushes': 2, 'writes': 2, 'write_errors': 1, 'dropped_writes': 1, 'pending': 3, 'pending_variations': 1}
+        with patch.object(app.variation_counters, 'stats', return_value = stats):
+            text = self.client.get('/metrics').get_data(as_text = True)
+
+        self.assertIn('recommendations_experiment_counter_writes_total{outcome="dropped_writes"} 1', text)
+        self.assertIn('recommendations_experiment_counter_pending_increments 3', text)
+
+class TestRequestDeadline(unittest.TestCase):
+
+    def test_deadline_cleared_after_request(self):
+        deadline.clear()
+        self.assertEqual(Client(app.app).get('/health').status_code, 200)
+        self.assertIsNone(deadline.current())
+
+class TestAdminEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client(app.app)
+
+    def test_disabled_without_token(self):
+        with patch('app.ADMIN_TOKEN', None):
+            self.assertEqual(self.client.get('/admin/caches').status_code, 404)
+            self.assertEqual(self.client.post('/admin/caches/products/invalidate').status_code, 404)
+
+    def test_token_required(self):
+        with patch('app.ADMIN_TOKEN', 'secret'):
+            self.assertEqual(self.client.post('/admin/caches/products/invalidate').status_code, 401)
+            response = self.client.post('/admin/caches/products/invalidate', headers = {'Authorization': 'Bearer wrong'})
+            self.assertEqual(response.status_code, 401)
+
+            response = self.client.post('/admin/caches/products/invalidate', headers = {'Authorization': 'Bearer secret'})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json['success'])
+
+    def test_caches_implement_admin_interface(self):
+        for name, cache in app.caches.items():
+            self.assertIsInstance(cache, InvalidatableCache, name)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import threading
+import unittest
+
+from unittest.mock import MagicMock
+from experimentation.aws_clients import ClientRegistry
+
+"""
+python -m unittest experimentation/test_aws_clients.py
+"""
+
+class TestClientRegistry(unittest.TestCase):
+
+    def test_clients_created_on_first_use(self):
+        session = MagicMock()
+        session_factory = MagicMock(return_value = session)
+        registry = ClientRegistry(session_factory)
+
+        ssm = registry.client('ssm')
+        # Special attribute probes (e.g. by ABCMeta for class attributes) do not create the client
+        self.assertFalse(hasattr(ssm, '__isabstractmethod__'))
+        self.assertEqual(registry.stats()['clients'], 0)
+        session_factory.assert_not_called()
+
+        ssm.get_parameter(Name = 'name')
+        ssm.get_parameters(Names = ['name'])
+        session.client.assert_called_once_with('ssm', config = None)
+        session.client.return_value.get_parameter.assert_called_once_with(Name = 'name')
+
+        stats = registry.stats()
+        self.assertTrue(stats['session_created'])
+        self.assertEqual(stats['clients'], 1)
+        self.assertIn('client:ssm', stats['creation_ms'])
+
+    def test_clients_shared_by_service_and_config(self):
+        session = MagicMock()
+        session.client.side_effect = lambda service_name, config: MagicMock()
+        session_factory = MagicMock(return_value = session)
+        registry = ClientRegistry(session_factory)
+        config = object()
+
+        self.assertIs(registry.get(ClientRegistry.CLIENT, 'ssm'), registry.get(ClientRegistry.CLIENT, 'ssm'))
+        self.assertIsNot(registry.get(ClientRegistry.CLIENT, 'ssm'), registry.get(ClientRegistry.CLIENT, 'ssm', config))
+        registry.resource('dynamodb').Table('table')
+        session.resource.assert_called_once_with('dynamodb', config = None)
+
+        # One session for every client
+        session_factory.assert_called_once_with()
+        self.assertEqual(registry.stats()['clients'], 3)
+
+    def test_reset_replaces_clients(self):
+        first, second = MagicMock(), MagicMock()
+        registry = ClientRegistry(lambda: first)
+        ssm = registry.client('ssm')
+        ssm.get_parameter(Name = 'name')
+
+        registry.reset(lambda: second)
+        ssm.get_parameter(Name = 'name')
+        first.client.return_value.get_parameter.assert_called_once_with(Name = 'name')
+        second.client.return_value.get_parameter.assert_called_once_with(Name = 'name')
+
+    def test_concurrent_first_use_creates_one_client(self):
+        session = MagicMock()
+        registry = ClientRegistry(lambda: session)
+        kinesis = [registry.client('kinesis') for _ in range(8)]
+        threads = [threading.Thread(target = client.put_record) for client in kinesis]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        session.client.assert_called_once_with('kinesis', config = None)
+        self.assertEqual(session.client.return_value.put_record.call_count, 8)
+
+if __name__ == '__main__':
+    unittest.main()
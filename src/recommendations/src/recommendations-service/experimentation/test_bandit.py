@@ -0,0 +1,110 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import unittest
+
+import numpy as np
+
+from unittest.mock import MagicMock, patch
+from experimentation.bandit import BanditState
+from experimentation.experiment_mab import MultiArmedBanditExperiment
+from experimentation.resolvers import ResolverFactory
+
+"""
+python -m unittest experimentation/test_bandit.py
+"""
+
+def mab_config(exposures, conversions, name = 'test-mab-experiment'):
+    return {
+        'id': 'exp1',
+        'feature': 'test-feature',
+        'name': name,
+        'type': 'mab',
+        'status': 'ACTIVE',
+        'variations': [{
+            'type': ResolverFactory.TYPE_PRODUCT,
+            'products_service_host': '10.10.10.10',
+            'exposures': e,
+            'conversions': c
+        } for e, c in zip(exposures, conversions)]
+    }
+
+class TestBanditState(unittest.TestCase):
+
+    def test_posterior_combines_persisted_and_local_counts(self):
+        bandit = BanditState(2)
+        bandit.reconcile([10, 20], [2, 5])
+        bandit.observe(0, exposures = 3)
+        bandit.observe(0, conversions = 1)
+
+        alpha, beta = bandit.posterior()
+        np.testing.assert_array_equal(alpha, [4, 6])
+        np.testing.assert_array_equal(beta, [11, 16])
+
+        # Local observations already persisted are replaced; pending ones are kept.
+        bandit.reconcile([12, 20], [3, 5], {0: {'exposures': 1}})
+        alpha, beta = bandit.posterior()
+        np.testing.assert_array_equal(alpha, [4, 6])
+        np.testing.assert_array_equal(beta, [11, 16])
+
+    def test_conversions_ahead_of_exposures_keep_posterior_valid(self):
+        bandit = BanditState(2)
+        bandit.observe(1, conversions = 2)
+
+        alpha, beta = bandit.posterior()
+        np.testing.assert_array_equal(beta, [1, 1])
+        self.assertIn(bandit.select(), (0, 1))
+
+    def test_select_many_draws_once_for_all_users(self):
+        bandit = BanditState(3)
+        bandit.reconcile([1000, 1000, 1000], [10, 500, 10])
+
+        rng = MagicMock(wraps = np.random.RandomState(7))
+        assignments = bandit.select_many(200, rng)
+
+        rng.beta.assert_called_once()
+        self.assertEqual(rng.beta.call_args.kwargs['size'], (200, 3))
+        self.assertEqual(assignments.shape, (200,))
+        # The clearly best variation wins nearly every draw.
+        self.assertGreater(np.mean(assignments == 1), 0.95)
+
+class TestMultiArmedBanditExperiment(unittest.TestCase):
+
+    def setUp(self):
+        counters = patch('experimentation.experiment.variation_counters')
+        counters.start()
+        self.addCleanup(counters.stop)
+
+    def test_local_observations_update_selection(self):
+        experiment = MultiArmedBanditExperiment(MagicMock(), **mab_config([0, 0], [0, 0]))
+
+        experiment._increment_exposure_count(0, 1000)
+        experiment._increment_exposure_count(1, 1000)
+        experiment.track_conversions([f'exp1~{i}~1~1' for i in range(500)], None)
+
+        assignments = experiment.select_variation_indexes(100)
+        self.assertEqual(len(assignments), 100)
+        self.assertGreater(assignments.count(1), 95)
+
+    def test_reconcile_applies_persisted_counts(self):
+        experiment = MultiArmedBanditExperiment(MagicMock(), **mab_config([0, 0], [0, 0]))
+
+        experiment.reconcile(mab_config([1000, 1000], [10, 500]))
+        alpha, beta = experiment._bandit.posterior()
+        np.testing.assert_array_equal(alpha, [11, 501])
+
+    def test_assigned_variation_is_used(self):
+        experiment = MultiArmedBanditExperiment(MagicMock(), **mab_config([0, 0], [0, 0]))
+        for variation in experiment.variations:
+            variation.resolver = MagicMock()
+            variation.resolver.get_items.return_value = [{'itemId': 'a'}]
+
+        items = experiment.get_items('12', variation_index = 1)
+
+        self.assertEqual(items[0]['experiment']['variationIndex'], 1)
+        experiment.variations[0].resolver.get_items.assert_not_called()
+        alpha, beta = experiment._bandit.posterior()
+        np.testing.assert_array_equal(beta, [1, 2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import threading
+import unittest
+
+from unittest.mock import patch
+from experimentation.caching import SharedInvalidations, TTLDict
+
+"""
+python -m unittest experimentation/test_caching.py
+"""
+
+class TestTTLDict(unittest.TestCase):
+
+    def test_entries_expire_when_read(self):
+        threads = threading.active_count()
+        cache = TTLDict(60)
+        # No sweeper thread, so the dict is safe to create before gunicorn forks
+        self.assertEqual(threading.active_count(), threads)
+
+        with patch('experimentation.caching.time.monotonic', return_value = 1000.0):
+            cache['arn'] = {'recipeArn': 'recipe'}
+        with patch('experimentation.caching.time.monotonic', return_value = 1059.0):
+            self.assertEqual(cache.get('arn'), {'recipeArn': 'recipe'})
+            self.assertIn('arn', cache)
+        with patch('experimentation.caching.time.monotonic', return_value = 1060.0):
+            self.assertIsNone(cache.get('arn'))
+            self.assertNotIn('arn', cache)
+        self.assertEqual(len(cache), 0)
+
+class TestSharedInvalidations(unittest.TestCase):
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires fork')
+    def test_invalidations_shared_with_forked_processes(self):
+        invalidations = SharedInvalidations(slots = 16)
+        self.assertEqual(invalidations.invalidated_at('1'), 0.0)
+
+        # Like a gunicorn worker forked from the master
+        pid = os.fork()
+        if pid == 0:
+            invalidations.invalidate('1')
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertGreater(invalidations.invalidated_at('1'), 0.0)
+
+        invalidations.invalidate()
+        self.assertGreater(invalidations.invalidated_at('2'), 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import unittest
+
+from unittest.mock import MagicMock, patch
+from botocore.exceptions import ClientError
+from experimentation import deadline
+from experimentation.circuit_breaker import CircuitBreaker, CircuitOpenError
+from experimentation.deadline import DeadlineExceededError
+from experimentation.resolvers import call_personalize, personalize_breaker, personalize_runtime_for_budget, \
+    _personalize_runtime_tiers, PERSONALIZE_MIN_BUDGET
+
+"""
+python -m unittest experimentation/test_circuit_breaker.py
+"""
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_after_consecutive_failures_and_recovers(self):
+        breaker = CircuitBreaker('test', failure_threshold = 2, cooldown = 30)
+        with patch('experimentation.circuit_breaker.time.monotonic', return_value = 100):
+            breaker.record_failure()
+            breaker.record_success()
+            breaker.record_failure()
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            self.assertFalse(breaker.allow())
+            with self.assertRaises(CircuitOpenError):
+                breaker.check()
+
+        with patch('experimentation.circuit_breaker.time.monotonic', return_value = 131):
+            # One trial call is let through after the cool-down
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            breaker.record_success()
+            self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        stats = breaker.stats()
+        self.assertEqual(stats['opened'], 1)
+        self.assertEqual(stats['rejected'], 3)
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker('test', failure_threshold = 1, cooldown = 10)
+        with patch('experimentation.circuit_breaker.time.monotonic', return_value = 100):
+            breaker.record_failure()
+        with patch('experimentation.circuit_breaker.time.monotonic', return_value = 111):
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+            self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.stats()['opened'], 2)
+
+class TestDeadline(unittest.TestCase):
+
+    def setUp(self):
+        deadline.clear()
+
+    def tearDown(self):
+        deadline.clear()
+
+    def test_check_raises_when_budget_spent(self):
+        self.assertIsNone(deadline.remaining())
+        deadline.check(10)
+
+        deadline.start(0.5)
+        self.assertLessEqual(deadline.remaining(), 0.5)
+        deadline.check(0.1)
+        with self.assertRaises(DeadlineExceededError):
+            deadline.check(1)
+
+class TestCallPersonalize(unittest.TestCase):
+
+    def setUp(self):
+        personalize_breaker.reset()
+        self.client = MagicMock()
+        patcher = patch('experimentation.resolvers.personalize_runtime_for_budget', return_value = self.client)
+        self.client_for_budget = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        personalize_breaker.reset()
+        deadline.clear()
+
+    def test_skips_call_without_budget(self):
+        deadline.start(0)
+        with self.assertRaises(DeadlineExceededError):
+            call_personalize('get_recommendations', userId = '1')
+        self.client.get_recommendations.assert_not_called()
+
+    def test_client_chosen_for_remaining_budget(self):
+        deadline.start(1)
+        call_personalize('get_recommendations', userId = '1')
+        self.client.get_recommendations.assert_called_once_with(userId = '1')
+        self.assertLessEqual(self.client_for_budget.call_args[0][0], 1)
+
+    def test_failures_open_the_circuit(self):
+        throttled = ClientError({'Error': {'Code': 'ThrottlingException'}, 'ResponseMetadata': {'HTTPStatusCode': 400}}, 'GetRecommendations')
+        operation = self.client.get_recommendations
+        operation.side_effect = throttled
+
+        for _ in range(personalize_breaker.failure_threshold):
+            with self.assertRaises(ClientError):
+                call_personalize('get_recommendations', userId = '1')
+
+        with self.assertRaises(CircuitOpenError):
+            call_personalize('get_recommendations', userId = '1')
+        self.assertEqual(operation.call_count, personalize_breaker.failure_threshold)
+
+    def test_invalid_requests_do_not_count_as_failures(self):
+        invalid = ClientError({'Error': {'Code': 'InvalidInputException'}, 'ResponseMetadata': {'HTTPStatusCode': 400}}, 'GetRecommendations')
+        operation = self.client.get_recommendations
+        operation.side_effect = invalid
+
+        for _ in range(personalize_breaker.failure_threshold + 1):
+            with self.assertRaises(ClientError):
+                call_personalize('get_recommendations', userId = '1')
+        self.assertEqual(personalize_breaker.state, CircuitBreaker.CLOSED)
+
+class TestPersonalizeRuntimeForBudget(unittest.TestCase):
+
+    @staticmethod
+    def tier(remaining):
+        """ Returns the index in the tier table of the client picked for the remaining budget """
+        client = personalize_runtime_for_budget(remaining)
+        return [tier_client for _, tier_client in _personalize_runtime_tiers].index(client)
+
+    def test_configured_client_without_budget(self):
+        self.assertEqual(self.tier(None), 0)
+        self.assertEqual(self.tier(60), 0)
+
+    def test_timeouts_fit_remaining_budget(self):
+        for remaining in (2.0, 1.0, 0.5, 0.3, PERSONALIZE_MIN_BUDGET + 0.05):
+            tier = self.tier(remaining)
+            # Tiers after the first make a single attempt
+            self.assertGreater(tier, 0)
+            self.assertLessEqual(_personalize_runtime_tiers[tier][0], remaining)
+
+        # The shortest timeouts are used once nothing fits
+        self.assertEqual(self.tier(PERSONALIZE_MIN_BUDGET), len(_personalize_runtime_tiers) - 1)
+        self.assertEqual(self.tier(0.01), len(_personalize_runtime_tiers) - 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import threading
+import time
+import unittest
+
+from unittest.mock import MagicMock
+from experimentation import deadline
+from experimentation.coalescing import SingleFlight, make_key
+from experimentation.deadline import DeadlineExceededError
+
+"""
+python -m unittest experimentation/test_coalescing.py
+"""
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight(ttl = 0)
+        started = threading.Event()
+        release = threading.Event()
+        executions = []
+
+        def compute():
+            executions.append(1)
+            started.set()
+            release.wait(5)
+            return [{'itemId': '1'}]
+
+        results = []
+        def call():
+            results.append(flight.do('key', compute))
+
+        threads = [threading.Thread(target = call) for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while flight.stats()['coalesced'] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(executions), 1)
+        self.assertEqual(results, [[{'itemId': '1'}]] * 5)
+        # Every caller gets its own copy
+        self.assertEqual(len({id(result) for result in results}), 5)
+
+        stats = flight.stats()
+        self.assertEqual(stats['executions'], 1)
+        self.assertEqual(stats['coalesced'], 4)
+        self.assertEqual(stats['size'], 0)
+
+    def test_waiting_caller_gives_up_at_deadline(self):
+        flight = SingleFlight(ttl = 0)
+        started = threading.Event()
+        release = threading.Event()
+
+        def compute():
+            started.set()
+            release.wait(5)
+            return 'late'
+
+        leader = threading.Thread(target = flight.do, args = ('key', compute))
+        leader.start()
+        started.wait(5)
+        try:
+            deadline.start(0.05)
+            with self.assertRaises(DeadlineExceededError):
+                flight.do('key', compute)
+        finally:
+            deadline.clear()
+            release.set()
+            leader.join(5)
+
+        self.assertEqual(flight.stats()['wait_timeouts'], 1)
+
+    def test_recent_result_is_reused_until_ttl(self):
+        flight = SingleFlight(ttl = 60)
+        func = MagicMock(return_value = {'items': [1]})
+
+        first = flight.do('key', func)
+        first['items'].append(2)
+        second = flight.do('key', func)
+
+        self.assertEqual(second, {'items': [1]})
+        func.assert_called_once()
+        self.assertEqual(flight.stats()['cache_hits'], 1)
+
+        self.assertEqual(flight.invalidate(), 1)
+        flight.do('key', func)
+        self.assertEqual(func.call_count, 2)
+
+    def test_uncacheable_result_is_not_reused(self):
+        flight = SingleFlight(ttl = 60)
+        func = MagicMock(return_value = ([], {'X-Experiment-Id': '1'}))
+
+        flight.do('key', func, cacheable = lambda result: 'X-Experiment-Id' not in result[1])
+        flight.do('key', func, cacheable = lambda result: 'X-Experiment-Id' not in result[1])
+        self.assertEqual(func.call_count, 2)
+
+    def test_errors_are_not_cached(self):
+        flight = SingleFlight(ttl = 60)
+        func = MagicMock(side_effect = [ValueError('boom'), 'ok'])
+
+        with self.assertRaises(ValueError):
+            flight.do('key', func)
+        self.assertEqual(flight.do('key', func), 'ok')
+        self.assertEqual(flight.stats()['errors'], 1)
+
+    def test_size_is_bounded(self):
+        flight = SingleFlight(ttl = 60, max_size = 2)
+        for i in range(5):
+            flight.do(str(i), lambda: i)
+        self.assertEqual(flight.stats()['size'], 2)
+
+    def test_key_ignores_dict_order(self):
+        self.assertEqual(make_key('u1', {'a': 1, 'b': 2}), make_key('u1', {'b': 2, 'a': 1}))
+        self.assertNotEqual(make_key('u1', None), make_key('u2', None))
+
+if __name__ == '__main__':
+    unittest.main()
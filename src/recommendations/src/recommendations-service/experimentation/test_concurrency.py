@@ -0,0 +1,54 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import threading
+import unittest
+
+from experimentation import deadline
+from experimentation.concurrency import run_windowed
+
+"""
+python -m unittest experimentation/test_concurrency.py
+"""
+
+class TestRunWindowed(unittest.TestCase):
+
+    def test_slow_task_does_not_hold_up_the_others(self):
+        release = threading.Event()
+
+        def slow():
+            release.wait(5)
+            return 'slow'
+
+        tasks = [slow] + [lambda i=i: i for i in range(1, 6)]
+        order = []
+        for completed in run_windowed(tasks, 2):
+            for index, result in completed:
+                self.assertTrue(result.ok)
+                order.append(index)
+                if index == 5:
+                    release.set()
+
+        # The second slot kept running tasks while the first waited
+        self.assertEqual(order, [1, 2, 3, 4, 5, 0])
+
+    def test_each_task_gets_its_own_budget(self):
+        release = threading.Event()
+        budgets = []
+
+        def stuck():
+            release.wait(5)
+
+        try:
+            results = dict(index_result for completed in run_windowed([stuck, lambda: budgets.append(deadline.remaining())], 2, budget = 0.1)
+                           for index_result in completed)
+        finally:
+            release.set()
+
+        self.assertIsInstance(results[0].error, TimeoutError)
+        self.assertTrue(results[1].ok)
+        self.assertLessEqual(budgets[0], 0.1)
+        self.assertIsNone(deadline.remaining())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import unittest
+
+from unittest.mock import MagicMock
+from botocore.exceptions import ClientError
+from experimentation.counters import VariationCounterAggregator
+
+"""
+python -m unittest experimentation/test_counters.py
+"""
+
+def mock_table():
+    table = MagicMock()
+    table.table_name = 'ExperimentStrategy'
+
+    def update_item(**kwargs):
+        values = kwargs['ExpressionAttributeValues']
+        return {'Attributes': {'variations': [{
+            field_name: 100 + values[f':{field_name}'] for field_name in ('exposures', 'conversions') if f':{field_name}' in values
+        }]}}
+
+    table.update_item.side_effect = update_item
+    return table
+
+class TestVariationCounterAggregator(unittest.TestCase):
+
+    def test_increments_coalesced_per_variation(self):
+        table = mock_table()
+        counters = VariationCounterAggregator(flush_interval = 60)
+
+        for _ in range(5):
+            counters.increment(table, 'exp1', 0, 'exposures')
+        counters.increment(table, 'exp1', 0, 'conversions')
+        counters.increment(table, 'exp1', 1, 'exposures', 3)
+
+        table.update_item.assert_not_called()
+        counters.flush()
+
+        self.assertEqual(table.update_item.call_count, 2)
+        first = table.update_item.call_args_list[0].kwargs
+        self.assertEqual(first['Key'], {'id': 'exp1'})
+        self.assertEqual(first['ExpressionAttributeValues'], {':zero': 0, ':exposures': 5, ':conversions': 1})
+
+        # Returned counts combine the last persisted value with pending increments.
+        self.assertEqual(counters.increment(table, 'exp1', 0, 'exposures'), 106)
+
+    def test_failed_write_is_retried(self):
+        table = mock_table()
+        counters = VariationCounterAggregator(flush_interval = 60)
+        counters.increment(table, 'exp1', 0, 'exposures', 2)
+
+        update_item = table.update_item.side_effect
+        table.update_item.side_effect = Exception('throttled')
+        counters.flush()
+        self.assertEqual(counters.stats()['pending'], 2)
+
+        table.update_item.side_effect = update_item
+        counters.flush()
+        self.assertEqual(counters.stats()['pending'], 0)
+        self.assertEqual(table.update_item.call_args.kwargs['ExpressionAttributeValues'][':exposures'], 2)
+
+    def test_invalid_write_is_dropped(self):
+        table = mock_table()
+        counters = VariationCounterAggregator(flush_interval = 60)
+        counters.increment(table, 'exp1', 7, 'exposures')
+
+        table.update_item.side_effect = ClientError(
+            {'Error': {'Code': 'ValidationException'}, 'ResponseMetadata': {'HTTPStatusCode': 400}}, 'UpdateItem')
+        counters.flush()
+        counters.flush()
+
+        table.update_item.assert_called_once()
+        stats = counters.stats()
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['dropped_writes'], 1)
+
+    def test_retries_are_capped(self):
+        table = mock_table()
+        counters = VariationCounterAggregator(flush_interval = 60, max_write_attempts = 3)
+        counters.increment(table, 'exp1', 0, 'exposures')
+
+        table.update_item.side_effect = Exception('unavailable')
+        for _ in range(5):
+            counters.flush()
+
+        self.assertEqual(table.update_item.call_count, 3)
+        stats = counters.stats()
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['write_errors'], 3)
+        self.assertEqual(stats['dropped_writes'], 1)
+
+    def test_estimate_includes_counts_read_from_the_item(self):
+        table = mock_table()
+        counters = VariationCounterAggregator(flush_interval = 60)
+
+        counters.record_persisted('ExperimentStrategy', 'exp1', 0, {'exposures': 40, 'name': 'ignored'})
+        self.assertEqual(counters.increment(table, 'exp1', 0, 'exposures'), 41)
+
+        # A stale read does not replace a newer count
+        counters.flush()
+        counters.record_persisted('ExperimentStrategy', 'exp1', 0, {'exposures': 40})
+        self.assertEqual(counters.increment(table, 'exp1', 0, 'exposures'), 102)
+
+if __name__ == '__main__':
+    unittest.main()
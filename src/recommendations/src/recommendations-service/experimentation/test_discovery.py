@@ -0,0 +1,83 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import threading
+import time
+import unittest
+
+from unittest.mock import MagicMock
+from experimentation.discovery import ServiceDiscovery
+
+"""
+python -m unittest experimentation/test_discovery.py
+"""
+
+def instances(*hosts):
+    return {'Instances': [{'Attributes': {'AWS_INSTANCE_IPV4': host}} for host in hosts]}
+
+class TestServiceDiscovery(unittest.TestCase):
+
+    def test_balances_across_cached_instances(self):
+        client = MagicMock()
+        client.discover_instances.return_value = instances('10.0.0.1', '10.0.0.2')
+
+        discovery = ServiceDiscovery(client, ttl = 60)
+        hosts = [discovery.get_host('products') for _ in range(4)]
+
+        self.assertEqual(sorted(hosts), ['10.0.0.1', '10.0.0.1', '10.0.0.2', '10.0.0.2'])
+        client.discover_instances.assert_called_once_with(
+            NamespaceName='retaildemostore.local',
+            ServiceName='products',
+            HealthStatus='HEALTHY'
+        )
+
+    def test_concurrent_misses_share_one_call(self):
+        release = threading.Event()
+        client = MagicMock()
+        def discover_instances(**kwargs):
+            release.wait(5)
+            return instances('10.0.0.1', '10.0.0.2')
+        client.discover_instances.side_effect = discover_instances
+
+        discovery = ServiceDiscovery(client, ttl = 60)
+        hosts = []
+        threads = [threading.Thread(target = lambda: hosts.append(discovery.get_host('products'))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while discovery._flight.stats()['calls'] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        client.discover_instances.assert_called_once()
+        # Callers that waited still share the round-robin counter
+        self.assertEqual(sorted(hosts), ['10.0.0.1', '10.0.0.1', '10.0.0.2', '10.0.0.2'])
+
+    def test_evicted_instance_is_skipped(self):
+        client = MagicMock()
+        client.discover_instances.return_value = instances('10.0.0.1', '10.0.0.2')
+
+        discovery = ServiceDiscovery(client, ttl = 60)
+        discovery.evict('products', '10.0.0.1')
+        hosts = {discovery.get_host('products') for _ in range(4)}
+        self.assertEqual(hosts, {'10.0.0.2'})
+
+        # With every instance evicted the full list is used again.
+        discovery.evict('products', '10.0.0.2')
+        hosts = {discovery.get_host('products') for _ in range(4)}
+        self.assertEqual(hosts, {'10.0.0.1', '10.0.0.2'})
+
+    def test_cached_instances_used_when_refresh_fails(self):
+        client = MagicMock()
+        client.discover_instances.return_value = instances('10.0.0.1')
+
+        discovery = ServiceDiscovery(client, ttl = 0)
+        self.assertEqual(discovery.get_host('products'), '10.0.0.1')
+
+        client.discover_instances.side_effect = Exception('throttled')
+        self.assertEqual(discovery.get_host('products'), '10.0.0.1')
+        self.assertEqual(discovery.stats()['refresh_errors'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,13 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import copy
+import random
 import unittest
 import uuid
 
+from unittest.mock import MagicMock, patch
+
 from experimentation.resolvers import ResolverFactory, PersonalizeRecommendationsResolver, DefaultProductResolver
 from experimentation.experiment_ab import ABExperiment
 from experimentation.experiment_interleaving import InterleavingExperiment
@@ -12,6 +16,55 @@ from experimentation.experiment_interleaving import InterleavingExperiment
 python -m unittest experimentation/test_experiment.py
 """
 
+def reference_interleave_balanced(list_of_item_lists, count):
+    """ Original quadratic balanced implementation used to check the current one produces identical results """
+    selection_order = list(range(len(list_of_item_lists)))
+    random.shuffle(selection_order)
+    offsets = [0] * len(list_of_item_lists)
+    result = []
+    while len(result) < count:
+        next_idx = 0
+        for i in range(len(offsets)):
+            if (offsets[i] < offsets[next_idx] and
+                    offsets[i] < len(list_of_item_lists[selection_order[i]])):
+                next_idx = i
+        if offsets[next_idx] >= len(list_of_item_lists[selection_order[next_idx]]):
+            break
+        item = list_of_item_lists[selection_order[next_idx]][offsets[next_idx]]
+        if not any(i[0] == item['itemId'] for i in result):
+            result.append((item['itemId'], selection_order[next_idx]))
+        offsets[next_idx] = offsets[next_idx] + 1
+    return result
+
+def reference_interleave_team_draft(list_of_item_lists, count):
+    """ Original team-draft implementation used to check the current one produces identical results """
+    teams = [[] for x in range(len(list_of_item_lists))]
+    offsets = [0] * len(list_of_item_lists)
+    result = []
+    while len(result) < count:
+        size_teams = {}
+        for i in range(len(teams)):
+            size_teams.setdefault(len(teams[i]), []).append(i)
+        smallest_teams = size_teams.get(sorted(size_teams.keys())[0])
+        team_index = random.choice(smallest_teams)
+        next_offset = offsets[team_index]
+        items = list_of_item_lists[team_index]
+        while next_offset < len(items):
+            offsets[team_index] = next_offset + 1
+            item = items[next_offset]
+            if not any(i[0] == item['itemId'] for i in result):
+                result.append((item['itemId'], team_index))
+                teams[team_index].append(item)
+                break
+            next_offset += 1
+        if next_offset >= len(items):
+            break
+    return result
+
+def random_item_lists(rng, variation_count, list_length, pool_size):
+    return [[{'itemId': str(item_id)} for item_id in rng.sample(range(pool_size), list_length)]
+            for _ in range(variation_count)]
+
 class TestExperiments(unittest.TestCase):
     def test_ab_experiment(self):
         exp_config = {
@@ -99,3 +152,112 @@ class TestExperiments(unittest.TestCase):
         #print(f'Interleaved results: {results}')
 
         self.assertEqual(len(results), 5)
+
+    def test_interleaved_degrades_when_variation_fails(self):
+        exp_config = {
+            'id': uuid.uuid4().hex,
+            'feature': 'test-feature',
+            'name': 'test-interleaved-experiment',
+            'type': 'interleaving',
+            'status': 'ACTIVE',
+            'method': InterleavingExperiment.METHOD_BALANCED,
+            'variations': [{
+                'type': ResolverFactory.TYPE_PRODUCT,
+                'products_service_host': '10.10.10.10'
+            },{
+                'type': ResolverFactory.TYPE_PRODUCT,
+                'products_service_host': '10.10.10.11'
+            }]
+        }
+
+        table = MagicMock()
+        table.table_name = 'ExperimentStrategy'
+        experiment = InterleavingExperiment(table, **exp_config)
+
+        experiment.variations[0].resolver = MagicMock()
+        experiment.variations[0].resolver.get_items.side_effect = Exception('Personalize throttled')
+        experiment.variations[1].resolver = MagicMock()
+        experiment.variations[1].resolver.get_items.return_value = [ {'itemId':'a'}, {'itemId':'b'}, {'itemId':'c'} ]
+
+        results = experiment.get_items('12', num_results = 3)
+
+        self.assertEqual([item['itemId'] for item in results], ['a', 'b', 'c'])
+        self.assertTrue(all(item['experiment']['variationIndex'] == 1 for item in results))
+        self.assertTrue(results[0]['experiment']['correlationId'].endswith('~12~1~1'))
+
+    def test_interleaving_matches_reference_for_fixed_seed(self):
+        exp_config = {
+            'id': uuid.uuid4().hex,
+            'feature': 'test-feature',
+            'name': 'test-interleaved-experiment',
+            'type': 'interleaving',
+            'status': 'ACTIVE',
+            'variations': []
+        }
+        experiment = InterleavingExperiment('ExperimentStrategy', **exp_config)
+
+        rng = random.Random(7)
+        for variation_count in (2, 3, 5, 8):
+            for count in (5, 25, 100):
+                lists = random_item_lists(rng, variation_count, count * 3, count * 4)
+                for method, reference in ((experiment._interleave_balanced, reference_interleave_balanced),
+                                          (experiment._interleave_team_draft, reference_interleave_team_draft)):
+                    random.seed(42)
+                    expected = reference(copy.deepcopy(lists), count)
+                    random.seed(42)
+                    actual = method('12', copy.deepcopy(lists), count)
+
+                    self.assertEqual([(item['itemId'], item['experiment']['variationIndex']) for item in actual], expected)
+
+    def test_interleaved_probabilistic(self):
+        exp_config = {
+            'id': uuid.uuid4().hex,
+            'feature': 'test-feature',
+            'name': 'test-interleaved-experiment',
+            'type': 'interleaving',
+            'status': 'ACTIVE',
+            'method': InterleavingExperiment.METHOD_PROBABILISTIC,
+            'variations': []
+        }
+        experiment = InterleavingExperiment('ExperimentStrategy', **exp_config)
+
+        list_of_item_lists = [[] for x in range(2)]
+        list_of_item_lists[0] = [ {'itemId':'a'}, {'itemId':'b'}, {'itemId':'c'}, {'itemId':'d'}]
+        list_of_item_lists[1] = [ {'itemId':'b'}, {'itemId':'e'}, {'itemId':'a'}, {'itemId':'f'}]
+
+        results = experiment._interleave_probabilistic('12', list_of_item_lists, 10)
+
+        # Every distinct item is used exactly once once the rankings are exhausted.
+        self.assertEqual(sorted(item['itemId'] for item in results), ['a', 'b', 'c', 'd', 'e', 'f'])
+        self.assertEqual([item['experiment']['resultRank'] for item in results], list(range(1, 7)))
+        for item in results:
+            variation_index = item['experiment']['variationIndex']
+            self.assertIn(item['itemId'], [i['itemId'] for i in list_of_item_lists[variation_index]])
+
+    def test_track_conversions_aggregated_per_variation(self):
+        exp_config = {
+            'id': 'exp1',
+            'feature': 'test-feature',
+            'name': 'test-ab-experiment',
+            'type': 'ab',
+            'status': 'ACTIVE',
+            'variations': [{
+                'type': ResolverFactory.TYPE_PRODUCT,
+                'products_service_host': '10.10.10.10'
+            },{
+                'type': ResolverFactory.TYPE_PRODUCT,
+                'products_service_host': '10.10.10.10'
+            }]
+        }
+        table = MagicMock()
+        experiment = ABExperiment(table, **exp_config)
+
+        correlation_ids = ['exp1~1~0~1', 'exp1~2~1~3', 'exp1~3~0~2', 'exp1~4~5~1', 'exp1~5~x~1', 'exp1~6~0~1']
+        with patch('experimentation.experiment.variation_counters') as counters:
+            statuses = experiment.track_conversions(correlation_ids, None)
+
+        self.assertEqual(statuses, ['tracked', 'tracked', 'tracked', 'invalid', 'invalid', 'tracked'])
+        self.assertEqual(sorted(call.args for call in counters.increment.call_args_list), [
+            (table, 'exp1', 0, 'conversions', 3),
+            (table, 'exp1', 1, 'conversions', 1)
+        ])
@@ -0,0 +1,155 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import threading
+import unittest
+
+from unittest.mock import MagicMock, patch
+from experimentation.experiment_manager import ExperimentManager
+from experimentation.resolvers import ResolverFactory
+
+"""
+python -m unittest experimentation/test_experiment_manager.py
+"""
+
+def experiment_config(id, feature, name):
+    return {
+        'id': id,
+        'feature': feature,
+        'name': name,
+        'type': 'ab',
+        'status': 'ACTIVE',
+        'variations': [{
+            'type': ResolverFactory.TYPE_PRODUCT,
+            'products_service_host': '10.10.10.10'
+        },{
+            'type': ResolverFactory.TYPE_PRODUCT,
+            'products_service_host': '10.10.10.11'
+        }]
+    }
+
+class TestExperimentManager(unittest.TestCase):
+
+    def setUp(self):
+        self.table = MagicMock()
+        self.table.scan.return_value = {'Items': [experiment_config('1', 'home_product_recs', 'exp-1')]}
+
+        # Reset class-level state shared between ExperimentManager instances.
+        ExperimentManager._ExperimentManager__snapshot = None
+        ExperimentManager._ExperimentManager__table_name = 'ExperimentStrategy'
+        ExperimentManager._ExperimentManager__table = self.table
+
+        poller = patch.object(ExperimentManager, '_ExperimentManager__ensure_poller')
+        poller.start()
+        self.addCleanup(poller.stop)
+
+    def test_active_experiment_served_from_snapshot(self):
+        manager = ExperimentManager()
+
+        experiment = manager.get_active('home_product_recs', '12')
+        self.assertEqual(experiment.id, '1')
+        self.assertIsNone(manager.get_active('product_detail_related', '12'))
+
+        # Subsequent lookups and outcome lookups do not go back to DynamoDB.
+        self.assertIs(manager.get_active('home_product_recs', '13'), experiment)
+        self.assertIs(manager.get_by_id('1'), experiment)
+        self.assertEqual(self.table.scan.call_count, 1)
+        self.table.get_item.assert_not_called()
+
+    def test_reload_reuses_unchanged_experiments(self):
+        manager = ExperimentManager()
+        experiment = manager.get_active('home_product_recs', '12')
+
+        self.table.scan.return_value = {'Items': [
+            experiment_config('1', 'home_product_recs', 'exp-1'),
+            experiment_config('2', 'product_detail_related', 'exp-2')
+        ]}
+        snapshot = manager.reload()
+
+        self.assertEqual(snapshot.version, 2)
+        self.assertIs(manager.get_active('home_product_recs', '12'), experiment)
+        self.assertEqual(manager.get_active('product_detail_related', '12').id, '2')
+
+    def test_reload_reuses_experiments_when_only_counts_change(self):
+        manager = ExperimentManager()
+        experiment = manager.get_active('home_product_recs', '12')
+
+        config = experiment_config('1', 'home_product_recs', 'exp-1')
+        config['variations'][0].update({'exposures': 10, 'conversions': 2})
+        self.table.scan.return_value = {'Items': [config]}
+        manager.reload()
+        self.assertIs(manager.get_active('home_product_recs', '12'), experiment)
+
+        config = experiment_config('1', 'home_product_recs', 'exp-1 renamed')
+        self.table.scan.return_value = {'Items': [config]}
+        manager.reload()
+        self.assertIsNot(manager.get_active('home_product_recs', '12'), experiment)
+
+    def test_lowest_id_wins_when_feature_has_several_experiments(self):
+        self.table.scan.return_value = {'Items': [
+            experiment_config('2', 'home_product_recs', 'exp-2'),
+            experiment_config('1', 'home_product_recs', 'exp-1')
+        ]}
+        manager = ExperimentManager()
+
+        with self.assertLogs('experimentation.experiment_manager', level = 'WARNING'):
+            snapshot = manager.reload()
+        self.assertEqual(snapshot.by_feature['home_product_recs'].id, '1')
+
+    def test_concurrent_reloads_are_serialized(self):
+        manager = ExperimentManager()
+        manager.reload()
+
+        threads = [threading.Thread(target = manager.reload) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(manager.get_snapshot().version, 9)
+
+class TestDefaultTracker(unittest.TestCase):
+
+    def setUp(self):
+        ExperimentManager._ExperimentManager__trackers = {}
+        self.addCleanup(setattr, ExperimentManager, '_ExperimentManager__trackers', {})
+
+        stream_name = patch('experimentation.experiment_manager.parameter_cache.get_value', return_value = 'events')
+        stream_name.start()
+        self.addCleanup(stream_name.stop)
+
+        tracker_class = patch('experimentation.experiment_manager.BufferedKinesisTracker', side_effect = lambda **kwargs: MagicMock())
+        self.BufferedKinesisTracker = tracker_class.start()
+        self.addCleanup(tracker_class.stop)
+
+    def test_concurrent_first_requests_share_one_tracker(self):
+        manager = ExperimentManager()
+        start = threading.Barrier(8)
+        trackers = []
+
+        def get_tracker():
+            start.wait()
+            trackers.append(manager.default_tracker())
+
+        threads = [threading.Thread(target = get_tracker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.BufferedKinesisTracker.call_count, 1)
+        self.assertTrue(all(tracker is trackers[0] for tracker in trackers))
+        self.assertEqual(manager.trackers(), {'events': trackers[0]})
+
+    def test_invalidate_keeps_trackers(self):
+        manager = ExperimentManager()
+        tracker = manager.default_tracker()
+
+        with patch.object(ExperimentManager, 'reload', return_value = None):
+            manager.invalidate()
+
+        tracker.close.assert_not_called()
+        self.assertIs(manager.default_tracker(), tracker)
+
+if __name__ == '__main__':
+    unittest.main()
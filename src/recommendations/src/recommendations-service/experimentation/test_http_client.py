@@ -0,0 +1,140 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import unittest
+import requests
+
+from unittest.mock import MagicMock, patch
+from experimentation import deadline
+from experimentation.http_client import HttpClient, MIN_ATTEMPT_TIMEOUT
+from experimentation.metrics import Histogram
+
+"""
+python -m unittest experimentation/test_http_client.py
+"""
+
+def response(status_code):
+    mocked = MagicMock()
+    mocked.status_code = status_code
+    return mocked
+
+class TestHttpClient(unittest.TestCase):
+
+    def setUp(self):
+        sleep_patcher = patch('experimentation.http_client.time.sleep')
+        self.sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+        self.addCleanup(deadline.clear)
+
+    def client_with_session(self, **kwargs):
+        client = HttpClient(**kwargs)
+        session = MagicMock()
+        client._session = session
+        client._session_pid = os.getpid()
+        return client, session
+
+    def test_reuses_session_with_timeouts(self):
+        client, session = self.client_with_session(connect_timeout = 0.5, read_timeout = 2)
+        session.request.return_value = response(200)
+
+        client.get('http://10.0.0.1/products/id/1')
+        client.get('http://10.0.0.1/products/id/2')
+
+        self.assertEqual(session.request.call_count, 2)
+        session.request.assert_called_with('GET', 'http://10.0.0.1/products/id/2', timeout = (0.5, 2))
+        self.assertEqual(client.stats()['10.0.0.1']['requests'], 2)
+
+    def test_retries_connection_errors(self):
+        client, session = self.client_with_session(retries = 2)
+        session.request.side_effect = [requests.ConnectionError('refused'), response(200)]
+
+        result = client.get('http://10.0.0.1/products/featured')
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(session.request.call_count, 2)
+        self.assertEqual(self.sleep.call_count, 1)
+        stats = client.stats()['10.0.0.1']
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['retries'], 1)
+
+    def test_retries_unavailable_responses_then_returns_last(self):
+        client, session = self.client_with_session(retries = 2)
+        session.request.return_value = response(503)
+
+        result = client.get('http://10.0.0.1/products/featured')
+
+        self.assertEqual(result.status_code, 503)
+        self.assertEqual(session.request.call_count, 3)
+
+    def test_raises_when_retries_exhausted(self):
+        client, session = self.client_with_session(retries = 1)
+        session.request.side_effect = requests.ConnectionError('refused')
+
+        with self.assertRaises(requests.ConnectionError):
+            client.get('http://10.0.0.1/products/featured')
+        self.assertEqual(session.request.call_count, 2)
+
+    def test_does_not_retry_non_idempotent_requests(self):
+        client, session = self.client_with_session(retries = 3)
+        session.request.side_effect = requests.ConnectionError('refused')
+
+        with self.assertRaises(requests.ConnectionError):
+            client.request('POST', 'http://10.0.0.1/orders')
+        self.assertEqual(session.request.call_count, 1)
+
+    def test_backoff_is_jittered_and_capped(self):
+        client, session = self.client_with_session(retries = 5, backoff = 0.1, max_backoff = 0.3)
+        session.request.return_value = response(502)
+
+        client.get('http://10.0.0.1/products/featured')
+
+        delays = [call.args[0] for call in self.sleep.call_args_list]
+        self.assertEqual(len(delays), 5)
+        for delay in delays:
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, 0.3)
+
+    def test_timeouts_capped_at_request_deadline(self):
+        client, session = self.client_with_session(connect_timeout = 1, read_timeout = 5)
+        session.request.return_value = response(200)
+
+        deadline.start(0.5)
+        client.get('http://10.0.0.1/products/id/1')
+
+        connect_timeout, read_timeout = session.request.call_args.kwargs['timeout']
+        self.assertLessEqual(connect_timeout, 0.5)
+        self.assertLessEqual(read_timeout, 0.5)
+
+    def test_no_retries_once_deadline_spent(self):
+        client, session = self.client_with_session(retries = 2)
+        session.request.side_effect = requests.Timeout('slow')
+
+        deadline.start(0)
+        with self.assertRaises(requests.Timeout):
+            client.get('http://10.0.0.1/products/featured')
+
+        self.assertEqual(session.request.call_count, 1)
+        self.assertEqual(session.request.call_args.kwargs['timeout'], (MIN_ATTEMPT_TIMEOUT, MIN_ATTEMPT_TIMEOUT))
+        self.sleep.assert_not_called()
+
+class TestHistogram(unittest.TestCase):
+
+    def test_cumulative_buckets_and_percentiles(self):
+        histogram = Histogram(buckets = (0.01, 0.1, 1))
+        for value in (0.005, 0.005, 0.05, 0.5, 5):
+            histogram.observe(value)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 5)
+        self.assertEqual([count for _, count in snapshot['buckets']], [2, 3, 4, 5])
+        self.assertAlmostEqual(snapshot['sum'], 5.56)
+        self.assertLessEqual(histogram.percentile(40), 0.01)
+        self.assertGreater(histogram.percentile(70), 0.1)
+
+    def test_empty_histogram(self):
+        self.assertEqual(Histogram().summary()['count'], 0)
+        self.assertEqual(Histogram().percentile(99), 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from experimentation import local_model
+from experimentation.local_model import LocalModel, build_model, _top_eigenpairs
+from experimentation.resolvers import ResolverFactory, LocalCollaborativeFilteringResolver
+
+"""
+python -m unittest experimentation/test_local_model.py
+"""
+
+ITEMS = [
+    ('shirt', 'apparel'),
+    ('pants', 'apparel'),
+    ('socks', 'apparel'),
+    ('lamp', 'homedecor'),
+    ('vase', 'homedecor'),
+    ('chips', 'salty snacks')
+]
+
+# Two groups of users: apparel shoppers and home decor shoppers
+INTERACTIONS = [
+    ('u1', 'shirt', 'View'), ('u1', 'pants', 'View'), ('u1', 'socks', 'Purchase'),
+    ('u2', 'shirt', 'View'), ('u2', 'pants', 'AddToCart'), ('u2', 'socks', 'View'),
+    ('u3', 'shirt', 'Purchase'), ('u3', 'socks', 'View'),
+    ('u4', 'lamp', 'View'), ('u4', 'vase', 'Purchase'), ('u4', 'chips', 'View'),
+    ('u5', 'lamp', 'View'), ('u5', 'vase', 'View'), ('u5', 'chips', 'View')
+]
+
+class TestLocalModel(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.interactions_path = os.path.join(cls.directory, 'interactions.csv')
+        cls.items_path = os.path.join(cls.directory, 'items.csv')
+        cls.model_path = os.path.join(cls.directory, 'model')
+
+        with open(cls.items_path, 'w', newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(['ITEM_ID', 'PRICE', 'CATEGORY_L1'])
+            for item_id, category in ITEMS:
+                writer.writerow([item_id, '1.0', category])
+
+        with open(cls.interactions_path, 'w', newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(['ITEM_ID', 'USER_ID', 'EVENT_TYPE', 'TIMESTAMP', 'DISCOUNT'])
+            for timestamp, (user_id, item_id, event_type) in enumerate(INTERACTIONS):
+                writer.writerow([item_id, user_id, event_type, 1600000000 + timestamp, 'No'])
+
+        build_model(cls.interactions_path, cls.model_path, items_path = cls.items_path, factors = 4)
+        cls.model = LocalModel(cls.model_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def item_ids(self, items):
+        return [item['itemId'] for item in items]
+
+    def test_arrays_are_memory_mapped(self):
+        self.assertIsInstance(self.model.item_factors, np.memmap)
+        self.assertEqual(self.model.item_factors.shape, (len(ITEMS), 4))
+
+    def test_related_items_come_from_the_same_group(self):
+        items = self.model.recommend(item_id = 'shirt', num_results = 2)
+        self.assertEqual(sorted(self.item_ids(items)), ['pants', 'socks'])
+        self.assertGreaterEqual(items[0]['score'], items[1]['score'])
+
+    def test_user_recommendations_and_purchased_filter(self):
+        items = self.model.recommend(user_id = 'u1', num_results = 3)
+        self.assertEqual(sorted(self.item_ids(items)), ['pants', 'shirt', 'socks'])
+
+        items = self.model.recommend(user_id = 'u1', num_results = 3, filters = [local_model.FILTER_EXCLUDE_PURCHASED])
+        self.assertNotIn('socks', self.item_ids(items))
+        self.assertEqual(sorted(self.item_ids(items)[:2]), ['pants', 'shirt'])
+
+    def test_cstore_filters(self):
+        items = self.model.recommend(user_id = 'u5', num_results = 6, filters = [local_model.FILTER_EXCLUDE_CSTORE])
+        self.assertNotIn('chips', self.item_ids(items))
+        self.assertEqual(len(items), 5)
+
+        items = self.model.recommend(user_id = 'u5', num_results = 6, filters = [local_model.FILTER_CSTORE_ONLY])
+        self.assertEqual(self.item_ids(items), ['chips'])
+
+        items = self.model.recommend(item_id = 'lamp', num_results = 6, filters = [local_model.FILTER_SAME_CATEGORIES])
+        self.assertEqual(self.item_ids(items), ['vase'])
+
+        with self.assertRaises(ValueError):
+            self.model.recommend(user_id = 'u5', filters = ['bogus'])
+
+    def test_unknown_user_gets_popular_items(self):
+        items = self.model.recommend(user_id = 'new-user', num_results = 2)
+        self.assertEqual(sorted(self.item_ids(items)), ['shirt', 'socks'])
+
+    def test_resolver(self):
+        resolver = ResolverFactory.get(ResolverFactory.TYPE_LOCAL_CF, model_path = self.model_path,
+                                       filters = [local_model.FILTER_EXCLUDE_PURCHASED])
+        self.assertTrue(type(resolver) is LocalCollaborativeFilteringResolver)
+
+        items = resolver.get_items(user_id = 'u4', num_results = 2)
+        self.assertEqual(len(items), 2)
+        self.assertNotIn('vase', self.item_ids(items))
+
+        items = resolver.get_items(product_id = 'lamp', num_results = 10)
+        self.assertNotIn('lamp', self.item_ids(items))
+
+        with self.assertRaises(Exception):
+            resolver.get_items(num_results = 2)
+
+class TestTopEigenpairs(unittest.TestCase):
+
+    def test_matches_full_decomposition(self):
+        rng = np.random.RandomState(1)
+        basis, _ = np.linalg.qr(rng.standard_normal((200, 200)))
+        matrix = (basis * 0.8 ** np.arange(200)) @ basis.T
+
+        eigenvalues, eigenvectors = _top_eigenpairs(lambda vectors: matrix @ vectors, 200, 5)
+
+        expected_values, expected_vectors = np.linalg.eigh(matrix)
+        np.testing.assert_allclose(eigenvalues, expected_values[::-1][:5], rtol = 1e-6)
+        # Eigenvectors are only defined up to their sign
+        np.testing.assert_allclose(np.abs(np.sum(eigenvectors * expected_vectors[:, ::-1][:, :5], axis = 0)), 1, rtol = 1e-6)
+
+if __name__ == '__main__':
+    unittest.main()
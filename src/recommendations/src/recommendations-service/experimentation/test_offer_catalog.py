@@ -0,0 +1,102 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import unittest
+
+import numpy as np
+
+from unittest.mock import MagicMock, patch
+from experimentation.offer_catalog import OfferCatalog, OfferSnapshot, score_offers
+
+"""
+python -m unittest experimentation/test_offer_catalog.py
+"""
+
+OFFERS = [
+    {'id': 1, 'description': '5% off', 'preference': 1},
+    {'id': 2, 'description': '10% off', 'preference': 1},
+    {'id': 3, 'description': 'Free shipping', 'preference': 3}
+]
+
+class TestOfferCatalog(unittest.TestCase):
+
+    def test_revalidates_with_etag_after_ttl(self):
+        fetch = MagicMock(side_effect = [(OFFERS, '"v1"'), None, (OFFERS[:2], '"v2"')])
+        catalog = OfferCatalog(ttl = 10)
+
+        with patch('experimentation.offer_catalog.time.monotonic', return_value = 100):
+            snapshot = catalog.get(fetch)
+            self.assertIs(catalog.get(fetch), snapshot)
+        fetch.assert_called_once_with(None)
+
+        with patch('experimentation.offer_catalog.time.monotonic', return_value = 111):
+            # Not modified: the same snapshot is kept
+            self.assertIs(catalog.get(fetch), snapshot)
+        fetch.assert_called_with('"v1"')
+
+        with patch('experimentation.offer_catalog.time.monotonic', return_value = 122):
+            self.assertEqual(catalog.get(fetch).offer_ids, ['1', '2'])
+
+        stats = catalog.stats()
+        self.assertEqual(stats['not_modified'], 1)
+        self.assertEqual(stats['refreshes'], 2)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['etag'], '"v2"')
+
+    def test_serves_last_catalog_when_offers_service_fails(self):
+        catalog = OfferCatalog(ttl = 10, max_stale = 60)
+        with patch('experimentation.offer_catalog.time.monotonic', return_value = 100):
+            snapshot = catalog.get(lambda etag: (OFFERS, None))
+
+        failing = MagicMock(side_effect = ConnectionError('offers down'))
+        with patch('experimentation.offer_catalog.time.monotonic', return_value = 150):
+            self.assertIs(catalog.get(failing), snapshot)
+        with patch('experimentation.offer_catalog.time.monotonic', return_value = 171):
+            with self.assertRaises(ConnectionError):
+                catalog.get(failing)
+
+        self.assertEqual(catalog.invalidate(), 1)
+        with self.assertRaises(ConnectionError):
+            catalog.get(failing)
+
+    def test_offers_are_copied(self):
+        snapshot = OfferSnapshot(OFFERS)
+        offer = snapshot.offer('1')
+        offer['score'] = 0.5
+        self.assertNotIn('score', snapshot.offers_by_id['1'])
+
+class TestScoreOffers(unittest.TestCase):
+
+    def test_matches_per_user_scoring(self):
+        snapshot = OfferSnapshot(OFFERS)
+        item_lists = [
+            [{'itemId': '1', 'score': 0.5}, {'itemId': '2', 'score': 0.3}, {'itemId': '3', 'score': 0.2}],
+            [{'itemId': '2', 'score': 0.9}, {'itemId': '3', 'score': 0.1}],
+            [{'itemId': '99', 'score': 1.0}],
+            []
+        ]
+
+        results = score_offers(snapshot, item_lists)
+
+        # Preference 3 makes offer 3 win for the first user: 0.2 * 3 > 0.5
+        self.assertEqual(results[0][0], '3')
+        self.assertAlmostEqual(results[0][1], 0.2)
+        self.assertAlmostEqual(results[0][2], 0.6 / 1.4)
+        self.assertEqual(results[1][0], '2')
+        self.assertAlmostEqual(results[1][2], 0.9 / 1.2)
+        self.assertIsNone(results[2])
+        self.assertIsNone(results[3])
+
+    def test_random_factor(self):
+        snapshot = OfferSnapshot(OFFERS)
+        item_lists = [[{'itemId': '1', 'score': 0.5}, {'itemId': '2', 'score': 0.5}]]
+        rng = MagicMock()
+        rng.random.return_value = np.array([[0.0, 1.0, 0.0]])
+
+        # Offer 3 is not a candidate even though it gets the largest random boost
+        offer_id, _, adjusted = score_offers(snapshot, item_lists, random_factor = 0.5, rng = rng)[0]
+        self.assertEqual(offer_id, '2')
+        self.assertAlmostEqual(adjusted, 0.75)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import threading
+import time
+import unittest
+
+from unittest.mock import MagicMock
+from botocore.exceptions import ClientError
+from experimentation.parameters import ParameterCache
+
+"""
+python -m unittest experimentation/test_parameters.py
+"""
+
+def ssm_response(values):
+    return {'Parameters': [{'Name': name, 'Value': value} for name, value in values.items()]}
+
+class TestParameterCache(unittest.TestCase):
+
+    def test_hit_and_miss(self):
+        ssm = MagicMock()
+        ssm.get_parameters.return_value = ssm_response({'/a': 'arn-a', '/b': 'NONE'})
+
+        cache = ParameterCache(ssm, ttl = 60)
+        self.assertEqual(cache.get_values(['/a', '/b', '/c']), ['arn-a', 'NONE', None])
+        self.assertEqual(cache.get_values(['/a', '/b', '/c']), ['arn-a', 'NONE', None])
+
+        ssm.get_parameters.assert_called_once_with(Names = ['/a', '/b', '/c'])
+        stats = cache.stats()
+        self.assertEqual(stats['misses'], 3)
+        self.assertEqual(stats['hits'], 3)
+
+    def test_concurrent_misses_share_one_call(self):
+        release = threading.Event()
+        ssm = MagicMock()
+        def get_parameters(Names):
+            release.wait(5)
+            return ssm_response({name: name for name in Names})
+        ssm.get_parameters.side_effect = get_parameters
+
+        cache = ParameterCache(ssm)
+        results = []
+        threads = [threading.Thread(target = lambda: results.append(cache.get_values(['/a', '/b']))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while cache._flight.stats()['calls'] < 5:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, [['/a', '/b']] * 5)
+        ssm.get_parameters.assert_called_once()
+
+    def test_chunks_large_lookups(self):
+        ssm = MagicMock()
+        ssm.get_parameters.side_effect = lambda Names: ssm_response({name: name for name in Names})
+
+        cache = ParameterCache(ssm)
+        names = [f'/p{i}' for i in range(25)]
+        self.assertEqual(cache.get_values(names), names)
+        self.assertEqual(ssm.get_parameters.call_count, 3)
+
+    def test_stale_value_served_while_throttled(self):
+        ssm = MagicMock()
+        ssm.get_parameters.return_value = ssm_response({'/a': 'arn-a'})
+
+        cache = ParameterCache(ssm, ttl = 0)
+        self.assertEqual(cache.get_value('/a'), 'arn-a')
+
+        ssm.get_parameters.side_effect = ClientError({'Error': {'Code': 'ThrottlingException'}}, 'GetParameters')
+        self.assertEqual(cache.get_value('/a'), 'arn-a')
+
+        # Wait for the background refresh attempt to complete.
+        for _ in range(100):
+            if cache.stats()['refresh_errors']:
+                break
+            time.sleep(0.01)
+
+        stats = cache.stats()
+        self.assertEqual(stats['throttled'], 1)
+        self.assertEqual(stats['stale_hits'], 1)
+        self.assertEqual(cache.get_value('/a'), 'arn-a')
+
+    def test_invalidate(self):
+        ssm = MagicMock()
+        ssm.get_parameters.return_value = ssm_response({'/a': 'arn-a'})
+
+        cache = ParameterCache(ssm)
+        cache.get_value('/a')
+        self.assertEqual(cache.invalidate(['/a', '/missing']), 1)
+
+        ssm.get_parameters.return_value = ssm_response({'/a': 'arn-a2'})
+        self.assertEqual(cache.get_value('/a'), 'arn-a2')
+        self.assertEqual(ssm.get_parameters.call_count, 2)
+
+if __name__ == '__main__':
+    unittest.main()
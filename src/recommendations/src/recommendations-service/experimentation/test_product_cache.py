@@ -0,0 +1,57 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import unittest
+
+from experimentation.product_cache import ProductCache
+
+"""
+python -m unittest experimentation/test_product_cache.py
+"""
+
+class TestProductCache(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        cache = ProductCache()
+        cache.put_many([{'id': '1', 'url': '/p/1'}, {'id': '2', 'url': '/p/2'}], False)
+
+        found, missing = cache.get_many(['1', '2', '3'], False)
+        self.assertEqual(sorted(found.keys()), ['1', '2'])
+        self.assertEqual(missing, ['3'])
+
+        # Fully qualified image URLs are cached separately.
+        found, missing = cache.get_many(['1'], True)
+        self.assertEqual(found, {})
+        self.assertEqual(missing, ['1'])
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_returns_copies(self):
+        cache = ProductCache()
+        cache.put_many([{'id': '1', 'url': '/p/1'}], False)
+
+        found, _ = cache.get_many(['1'], False)
+        found['1']['url'] += '?exp=abc'
+
+        found, _ = cache.get_many(['1'], False)
+        self.assertEqual(found['1']['url'], '/p/1')
+
+    def test_lru_eviction_and_ttl(self):
+        cache = ProductCache(max_size = 2)
+        cache.put_many([{'id': '1'}, {'id': '2'}], False)
+        cache.get_many(['1'], False)
+        cache.put_many([{'id': '3'}], False)
+
+        found, missing = cache.get_many(['1', '2', '3'], False)
+        self.assertEqual(sorted(found.keys()), ['1', '3'])
+        self.assertEqual(missing, ['2'])
+
+        cache = ProductCache(ttl = 0)
+        cache.put_many([{'id': '1'}], False)
+        _, missing = cache.get_many(['1'], False)
+        self.assertEqual(missing, ['1'])
+
+if __name__ == '__main__':
+    unittest.main()
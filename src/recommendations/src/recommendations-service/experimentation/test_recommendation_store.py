@@ -0,0 +1,115 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest.mock import MagicMock
+from experimentation.recommendation_store import (RecommendationStore, DEFAULT_KEY, KEY_TYPE_ITEM,
+    write_store, read_batch_inference_output, resolve_records, main)
+from experimentation.resolvers import ResolverFactory, PrecomputedResolver
+
+"""
+python -m unittest experimentation/test_recommendation_store.py
+"""
+
+def items(*item_ids):
+    return [{'itemId': item_id} for item_id in item_ids]
+
+class TestRecommendationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'recs.rds')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookups(self):
+        records = [(str(user_id), items(f'i{user_id}', 'shared')) for user_id in range(500)]
+        records.append(('ünïcode', items('u')))
+        write_store(self.path, records, {'key_type': 'user', 'recipe': 'arn:aws:personalize:::recipe/aws-popularity-count'})
+
+        store = RecommendationStore(self.path)
+        self.assertEqual(store.metadata['recipe'], 'arn:aws:personalize:::recipe/aws-popularity-count')
+        for user_id in (0, 1, 10, 250, 499):
+            self.assertEqual(store.get(str(user_id)), items(f'i{user_id}', 'shared'))
+        self.assertEqual(store.get('ünïcode'), items('u'))
+        self.assertIsNone(store.get('500'))
+        self.assertEqual(store.stats()['entries'], 501)
+        self.assertEqual(store.stats()['misses'], 1)
+
+    def test_default_entry_and_empty_store(self):
+        write_store(self.path, [(DEFAULT_KEY, items('popular')), ('1', items('a'))])
+        store = RecommendationStore(self.path)
+        self.assertEqual(store.get('2'), items('popular'))
+        self.assertIsNone(store.get('2', use_default = False))
+
+        write_store(self.path, [])
+        self.assertIsNone(RecommendationStore(self.path).get('1'))
+
+    def test_duplicate_keys_rejected(self):
+        with self.assertRaises(ValueError):
+            write_store(self.path, [('1', items('a')), ('1', items('b'))])
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_replaced_file_is_reloaded(self):
+        write_store(self.path, [('1', items('a'))])
+        store = RecommendationStore(self.path, check_interval = 3600)
+        self.assertEqual(store.get('1'), items('a'))
+
+        write_store(self.path, [('1', items('b'))])
+        # Not checked again until the interval passes (or reload() is called)
+        self.assertEqual(store.get('1'), items('a'))
+        self.assertTrue(store.reload())
+        self.assertEqual(store.get('1'), items('b'))
+        self.assertFalse(store.reload())
+        self.assertEqual(store.stats()['reloads'], 2)
+
+    def test_missing_file(self):
+        store = RecommendationStore(self.path)
+        self.assertIsNone(store.get('1'))
+        self.assertEqual(store.metadata, {})
+
+    def test_batch_inference_output(self):
+        batch_path = os.path.join(self.directory, 'batch.json.out')
+        with open(batch_path, 'w') as f:
+            f.write(json.dumps({'input': {'userId': '1'}, 'output': {'recommendedItems': ['a', 'b'], 'scores': [0.5, 0.2]}, 'error': None}) + '\n')
+            f.write(json.dumps({'input': {'userId': '2'}, 'output': {'recommendedItems': ['c']}, 'error': None}) + '\n')
+            f.write(json.dumps({'input': {'userId': 'cold'}, 'output': {'recommendedItems': ['p']}, 'error': None}) + '\n')
+            f.write(json.dumps({'input': {'userId': '3'}, 'output': None, 'error': 'Invalid user'}) + '\n')
+
+        records = list(read_batch_inference_output([batch_path], default_key = 'cold'))
+        self.assertEqual(records[0], ('1', [{'itemId': 'a', 'score': 0.5}, {'itemId': 'b', 'score': 0.2}]))
+        self.assertEqual(records[1], ('2', items('c')))
+        self.assertIn((DEFAULT_KEY, items('p')), records)
+        self.assertEqual(len(records), 4)
+
+        main(['--output', self.path, '--filter', 'purchased', '--default-key', 'cold', 'from-batch', '--input', batch_path])
+        store = RecommendationStore(self.path)
+        self.assertEqual(store.metadata['source'], 'batch-inference')
+        self.assertEqual(store.metadata['filter'], 'purchased')
+        self.assertEqual(store.get('new-user'), items('p'))
+
+    def test_resolve_records(self):
+        resolver = MagicMock()
+        resolver.get_items.side_effect = lambda product_id, num_results: items(product_id + '-related')[:num_results]
+        records = list(resolve_records(resolver, ['a', 'b'], KEY_TYPE_ITEM, num_results = 5))
+        self.assertEqual(records, [('a', items('a-related')), ('b', items('b-related'))])
+
+    def test_precomputed_resolver(self):
+        write_store(self.path, [('p1', items('a', 'b', 'c'))], {'key_type': KEY_TYPE_ITEM})
+        resolver = ResolverFactory.get(ResolverFactory.TYPE_PRECOMPUTED, store_path = self.path)
+        self.assertTrue(type(resolver) is PrecomputedResolver)
+
+        self.assertEqual(resolver.get_items(product_id = 'p1', num_results = 2), items('a', 'b'))
+        self.assertEqual(resolver.get_items(product_id = 'p2'), [])
+        with self.assertRaises(Exception):
+            resolver.get_items(user_id = '1')
+
+if __name__ == '__main__':
+    unittest.main()
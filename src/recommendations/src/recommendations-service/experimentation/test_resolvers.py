@@ -38,7 +38,7 @@ class TestResolvers(unittest.TestCase):
             ResolverFactory.get('bogus')
 
     def test_http_resolver(self):
-        with patch('experimentation.resolvers.requests.get') as mocked_get:
+        with patch('experimentation.resolvers.http_client.get') as mocked_get:
             mocked_get.return_value.ok = True
             mocked_get.return_value.json.return_value = [{'id':'1'},{'id':'2'},{'id':'3'},{'id':'4'} ]
 
@@ -53,7 +53,7 @@ class TestResolvers(unittest.TestCase):
             mocked_get.assert_called_with('http://server.com/path?userId=1&numResults=10')
 
     def test_product_resolver(self):
-        with patch('experimentation.resolvers.requests.get') as mocked_get:
+        with patch('experimentation.resolvers.http_client.get') as mocked_get:
             mocked_get.return_value.ok = True
             mocked_get.return_value.json.return_value = [{'id':'1'},{'id':'2'},{'id':'3'},{'id':'4'} ]
 
@@ -62,7 +62,7 @@ class TestResolvers(unittest.TestCase):
             self.assertEqual(len(items), 4)
 
     def test_similar_resolver(self):
-        with patch('experimentation.resolvers.requests.get') as mocked_get:
+        with patch('experimentation.resolvers.http_client.get') as mocked_get:
             mocked_get.return_value.ok = True
             mocked_get.return_value.json.return_value = [{'itemId':'1'},{'itemId':'2'},{'itemId':'3'},{'itemId':'4'} ]
 
@@ -111,6 +111,25 @@ class TestResolvers(unittest.TestCase):
             self.assertEqual(ranked_items[2]['itemId'], '2')
             self.assertEqual(ranked_items[3]['itemId'], '1')
 
+    def test_personalize_ranking_resolver_chunks_large_lists(self):
+        chunk_sizes = []
+
+        def mock_call_personalize(operation, **params):
+            input_list = params['inputList']
+            chunk_sizes.append(len(input_list))
+            # Score by item number so the expected global order is known
+            ranking = [{'itemId': item_id, 'score': int(item_id) / 10000} for item_id in input_list]
+            return {'personalizedRanking': sorted(ranking, key = lambda item: -item['score'])}
+
+        with patch('experimentation.resolvers.call_personalize', new=mock_call_personalize):
+            resolver = ResolverFactory.get(ResolverFactory.TYPE_PERSONALIZE_RANKING, inference_arn = 'arn:aws:personalize:us-east-1:123456789:campaign/some_name')
+            unranked_items = [str(i) for i in range(1201)]
+            ranked_items = resolver.get_items(user_id = '12', product_list = unranked_items)
+
+        self.assertEqual(sorted(chunk_sizes), [399, 401, 401])
+        self.assertEqual(len(ranked_items), 1201)
+        self.assertEqual([item['itemId'] for item in ranked_items], [str(i) for i in range(1200, -1, -1)])
+
     def test_ranking_noop_resolver(self):
         resolver = ResolverFactory.get(ResolverFactory.TYPE_RANKING_NO_OP)
         unranked_items = [ '1', '2', '3', '4' ]
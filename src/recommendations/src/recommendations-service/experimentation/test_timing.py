@@ -0,0 +1,63 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import unittest
+
+from experimentation import timing
+
+"""
+python -m unittest experimentation/test_timing.py
+"""
+
+class TestTiming(unittest.TestCase):
+
+    def test_stages_accumulate_and_render_server_timing(self):
+        timings = timing.start_request()
+        with timing.stage('ssm'):
+            pass
+        with timing.stage('personalize'):
+            pass
+        with timing.stage('ssm'):
+            pass
+
+        self.assertEqual(list(timings.stages.keys()), ['ssm', 'personalize'])
+        header = timings.server_timing(total = 0.0123)
+        self.assertRegex(header, r'^ssm;dur=\d+\.\d, personalize;dur=\d+\.\d, total;dur=12\.3$')
+
+        finished = timing.finish_request('/test-timing', 'GET', 200)
+        self.assertIs(finished, timings)
+        self.assertIsNone(timing.current())
+        self.assertEqual(timing.stage_durations.labels('/test-timing', 'ssm').snapshot()['count'], 1)
+        self.assertEqual(timing.request_durations.labels('/test-timing', 'GET', '200').snapshot()['count'], 1)
+
+    def test_stage_outside_request_is_noop(self):
+        @timing.timed('hydrate')
+        def work():
+            return 'done'
+
+        self.assertIsNone(timing.current())
+        self.assertEqual(work(), 'done')
+        self.assertIsNone(timing.finish_request('/test-noop', 'GET', 200))
+
+    def test_stage_records_time_when_block_raises(self):
+        timings = timing.start_request()
+        with self.assertRaises(ValueError):
+            with timing.stage('rank'):
+                raise ValueError('boom')
+        self.assertIn('rank', timings.stages)
+        timing.finish_request('/test-raise', 'GET', 500)
+
+    def test_prometheus_rendering(self):
+        timing.start_request()
+        with timing.stage('hydrate'):
+            pass
+        timing.finish_request('/test-render', 'GET', 200)
+
+        text = '\n'.join(timing.render_metrics())
+        self.assertIn('# TYPE recommendations_stage_duration_seconds histogram', text)
+        self.assertIn('recommendations_stage_duration_seconds_bucket{route="/test-render",stage="hydrate",le="+Inf"} 1', text)
+        self.assertIn('recommendations_stage_duration_seconds_count{route="/test-render",stage="hydrate"} 1', text)
+        self.assertIn('recommendations_request_duration_seconds_count{route="/test-render",method="GET",status="200"} 1', text)
+
+if __name__ == '__main__':
+    unittest.main()
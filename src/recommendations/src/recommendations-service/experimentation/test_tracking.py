@@ -0,0 +1,93 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import unittest
+
+from unittest.mock import patch
+
+from experimentation.tracking import BufferedKinesisTracker, KinesisTracker, LocalKinesisStream
+
+"""
+python -m unittest experimentation/test_tracking.py
+"""
+
+def exposure_event(user_id):
+    return {
+        'event_type': 'Experiment Exposure',
+        'event_timestamp': 1700000000000,
+        'attributes': {
+            'user_id': user_id,
+            'experiment': {'id': 'exp1', 'feature': 'home_product_recs', 'name': 'test', 'type': 'ab'},
+            'variation_index': 0
+        }
+    }
+
+class TestTracking(unittest.TestCase):
+
+    def test_kinesis_tracker(self):
+        stream = LocalKinesisStream()
+        tracker = KinesisTracker('exposures', 'outcomes', kinesis_client = stream)
+        tracker.log_exposure(exposure_event('1'))
+        tracker.log_outcome(exposure_event('1'))
+
+        self.assertEqual(len(stream.events('exposures')), 1)
+        self.assertEqual(len(stream.events('outcomes')), 1)
+
+    def test_buffered_tracker_batches_events(self):
+        stream = LocalKinesisStream()
+        tracker = BufferedKinesisTracker('exposures', 'exposures', kinesis_client = stream, max_latency = 0.2)
+
+        for i in range(1200):
+            tracker.log_exposure(exposure_event(str(i)))
+        tracker.flush()
+
+        self.assertEqual(len(stream.events('exposures')), 1200)
+        self.assertLess(stream.calls, 10)
+
+        stats = tracker.stats()
+        self.assertEqual(stats['sent'], 1200)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_buffered_tracker_retries_failed_records(self):
+        stream = LocalKinesisStream(fail_every = 3)
+        tracker = BufferedKinesisTracker('exposures', 'exposures', kinesis_client = stream, max_latency = 0.05, max_retries = 5)
+
+        for i in range(9):
+            tracker.log_exposure(exposure_event(str(i)))
+        tracker.flush()
+
+        user_ids = sorted(int(event['attributes']['user_id']) for event in stream.events('exposures'))
+        self.assertEqual(user_ids, list(range(9)))
+        self.assertGreater(tracker.stats()['retried'], 0)
+
+    def test_buffered_tracker_drops_when_full(self):
+        stream = LocalKinesisStream()
+        tracker = BufferedKinesisTracker('exposures', 'exposures', kinesis_client = stream, max_queue_size = 1)
+
+        # Fill the queue before the worker can drain it.
+        tracker._queue.put(('exposures', tracker._create_record(exposure_event('0'))))
+        tracker.log_exposure(exposure_event('1'))
+
+        self.assertEqual(tracker.stats()['dropped'], 1)
+
+    def test_buffered_tracker_close_stops_worker(self):
+        stream = LocalKinesisStream()
+        tracker = BufferedKinesisTracker('exposures', 'exposures', kinesis_client = stream, max_latency = 0.2)
+
+        for i in range(10):
+            tracker.log_exposure(exposure_event(str(i)))
+        worker = tracker._worker
+        with patch('experimentation.tracking.atexit.unregister') as unregister:
+            tracker.close()
+
+        unregister.assert_called_once_with(tracker.flush)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(len(stream.events('exposures')), 10)
+
+        # Events logged after close are sent without restarting the worker
+        tracker.log_exposure(exposure_event('10'))
+        self.assertEqual(len(stream.events('exposures')), 11)
+        self.assertIs(tracker._worker, worker)
+
+if __name__ == '__main__':
+    unittest.main()
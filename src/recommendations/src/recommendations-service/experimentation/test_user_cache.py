@@ -0,0 +1,109 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import time
+import unittest
+
+from unittest.mock import patch
+from experimentation.caching import SharedInvalidations
+from experimentation.user_cache import UserResultCache, estimate_size
+
+"""
+python -m unittest experimentation/test_user_cache.py
+"""
+
+def result(*item_ids):
+    return ([{'itemId': item_id} for item_id in item_ids], {'X-Personalize-Recipe': 'arn:aws:personalize:::recipe/aws-user-personalization'})
+
+class TestUserResultCache(unittest.TestCase):
+
+    def test_returns_copies(self):
+        cache = UserResultCache()
+        cache.put('1', 'recs', result('a', 'b'))
+
+        items, _ = cache.get('1', 'recs')
+        items[0].pop('itemId')
+
+        self.assertEqual(cache.get('1', 'recs'), result('a', 'b'))
+        self.assertIsNone(cache.get('2', 'recs'))
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_entries_expire(self):
+        cache = UserResultCache(ttl = 10, max_stale = 0)
+        with patch('experimentation.user_cache.time.monotonic', return_value = 100):
+            cache.put('1', 'recs', result('a'))
+        with patch('experimentation.user_cache.time.monotonic', return_value = 105):
+            self.assertIsNotNone(cache.get('1', 'recs'))
+        with patch('experimentation.user_cache.time.monotonic', return_value = 111):
+            self.assertIsNone(cache.get('1', 'recs'))
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def test_stale_entries_served_only_when_allowed(self):
+        cache = UserResultCache(ttl = 10, max_stale = 60)
+        with patch('experimentation.user_cache.time.monotonic', return_value = 100):
+            cache.put('1', 'recs', result('a'))
+        with patch('experimentation.user_cache.time.monotonic', return_value = 130):
+            self.assertIsNone(cache.get('1', 'recs'))
+            self.assertEqual(cache.get('1', 'recs', allow_stale = True), result('a'))
+        with patch('experimentation.user_cache.time.monotonic', return_value = 171):
+            self.assertIsNone(cache.get('1', 'recs', allow_stale = True))
+        self.assertEqual(cache.stats()['stale_hits'], 1)
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_invalidate_user_only_drops_that_user(self):
+        cache = UserResultCache()
+        cache.put('1', 'recs', result('a'))
+        cache.put('1', 'related', result('b'))
+        cache.put('2', 'recs', result('c'))
+
+        self.assertEqual(cache.invalidate_user('1'), 2)
+        self.assertIsNone(cache.get('1', 'recs'))
+        self.assertIsNone(cache.get('1', 'related'))
+        self.assertIsNotNone(cache.get('2', 'recs'))
+        self.assertEqual(cache.invalidate_user('1'), 0)
+
+        self.assertEqual(cache.invalidate(), 1)
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_evicts_least_recently_used_beyond_max_bytes(self):
+        entry_size = estimate_size(result('a'))
+        cache = UserResultCache(max_bytes = entry_size * 2)
+
+        cache.put('1', 'recs', result('a'))
+        cache.put('2', 'recs', result('b'))
+        cache.get('1', 'recs')
+        cache.put('3', 'recs', result('c'))
+
+        self.assertIsNotNone(cache.get('1', 'recs'))
+        self.assertIsNone(cache.get('2', 'recs'))
+        self.assertIsNotNone(cache.get('3', 'recs'))
+        stats = cache.stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertLessEqual(stats['bytes'], entry_size * 2)
+        self.assertEqual(stats['users'], 2)
+
+    def test_shared_invalidations_reach_other_caches(self):
+        # Two worker processes' caches sharing the invalidation times
+        shared = SharedInvalidations(slots = 16)
+        worker1 = UserResultCache(shared_invalidations = shared)
+        worker2 = UserResultCache(shared_invalidations = shared)
+
+        started = time.monotonic()
+        worker2.put('1', 'recs', result('a'))
+        worker2.put('2', 'recs', result('b'))
+        worker1.invalidate_user('1')
+
+        self.assertIsNone(worker2.get('1', 'recs'))
+        self.assertIsNotNone(worker2.get('2', 'recs'))
+        self.assertEqual(worker2.stats()['shared_invalidations'], 1)
+
+        # Results computed before the invalidation are not cached
+        worker2.put('1', 'recs', result('a'), computed_at = started)
+        self.assertIsNone(worker2.get('1', 'recs'))
+
+        worker1.invalidate()
+        self.assertIsNone(worker2.get('2', 'recs'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import functools
+import threading
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from experimentation.metrics import HistogramFamily
+
+stage_durations = HistogramFamily(
+    'recommendations_stage_duration_seconds',
+    'Time spent in each stage of a request',
+    ('route', 'stage')
+)
+
+request_durations = HistogramFamily(
+    'recommendations_request_duration_seconds',
+    'Total time spent handling a request',
+    ('route', 'method', 'status')
+)
+
+class RequestTimings:
+    """ Accumulates the time spent in named stages while handling one request
+
+    A stage entered more than once (e.g. two SSM lookups) accumulates its time.
+    Stages keep the order in which they were first entered.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        # Stages can be timed from the worker threads of a concurrent fan-out
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self, total: float = None) -> str:
+        """ Returns the stages as a Server-Timing header value (durations in milliseconds) """
+        metrics = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.stages.items()]
+        if total is not None:
+            metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar('request_timings', default = None)
+
+def start_request() -> RequestTimings:
+    """ Starts collecting stage timings for the current request """
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+def current() -> Optional[RequestTimings]:
+    return _current.get()
+
+def finish_request(route: str, method: str, status: int) -> Optional[RequestTimings]:
+    """ Stops collecting timings for the current request and records them in the histograms """
+    timings = _current.get()
+    if timings is None:
+        return None
+    _current.set(None)
+
+    for stage_name, seconds in timings.stages.items():
+        stage_durations.labels(route, stage_name).observe(seconds)
+    request_durations.labels(route, method, str(status)).observe(timings.elapsed())
+
+    return timings
+
+@contextmanager
+def stage(name: str):
+    """ Times the enclosed block as a stage of the current request; a no-op outside a request """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+def timed(name: str):
+    """ Decorator that times every call of the function as a stage of the current request """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def render_metrics() -> List[str]:
+    """ Renders the request and stage histograms in the Prometheus text format """
+    return request_durations.render() + stage_durations.render()
@@ -1,13 +1,28 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import atexit
 import json
-import boto3
+import logging
+import queue
+import threading
+import time
 
 from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+from experimentation.aws_clients import aws_clients
 from experimentation.utils import CompatEncoder
 
-kinesis = boto3.client('kinesis')
+log = logging.getLogger(__name__)
+
+kinesis = aws_clients.client('kinesis')
+
+# Kinesis PutRecords limits
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 5 * 1024 * 1024
+
+# Queued by BufferedKinesisTracker.close() to stop the worker after the events ahead of it
+_STOP = object()
 
 class Tracker(ABC):
     """ Base class for tracking detailed exposure and outcome/conversion events """
@@ -30,26 +45,288 @@ class KinesisTracker(Tracker):
     in OpenSearch or processed from S3 using tools such as AWS Glue,
     Athena, or EMR.
     """
-    def __init__(self, exposure_stream_name, outcome_stream_name):
+    def __init__(self, exposure_stream_name, outcome_stream_name, kinesis_client = None):
         self.exposure_stream_name = exposure_stream_name
         self.outcome_stream_name = outcome_stream_name
+        self._kinesis = kinesis_client or kinesis
 
     def log_exposure(self, event):
+        self._kinesis.put_record(StreamName=self.exposure_stream_name, **self._create_record(event))
+
+    def log_outcome(self, event):
+        self._kinesis.put_record(StreamName=self.outcome_stream_name, **self._create_record(event))
+
+    def _create_record(self, event) -> Dict:
         user_id = event['attributes']['user_id']
         experiment_name = event['attributes']['experiment']['name']
 
-        kinesis.put_record(
-            StreamName=self.exposure_stream_name,
-            Data=json.dumps(event, cls=CompatEncoder),
-            PartitionKey=f'{experiment_name}{user_id}'
-        )
+        return {
+            'Data': json.dumps(event, cls=CompatEncoder).encode('utf-8'),
+            'PartitionKey': f'{experiment_name}{user_id}'
+        }
+
+class BufferedKinesisTracker(KinesisTracker):
+    """ Tracker that queues events in memory and ships them to Kinesis in batches
+
+    Events are put on a bounded queue and a background worker sends them with
+    PutRecords in batches of up to 500 records / 5 MB. A batch is sent as soon
+    as it is full or once the oldest queued event has waited max_latency seconds.
+    Only the records that Kinesis reports as failed are retried (with backoff).
+
+    When the queue is full, the overflow policy decides whether the request
+    thread drops the event ('drop') or waits up to block_timeout seconds for
+    space before dropping it ('block'). Queued events are flushed at exit or
+    when the tracker is closed; events logged after close() are sent synchronously.
+    """
+    POLICY_DROP = 'drop'
+    POLICY_BLOCK = 'block'
+
+    def __init__(self, exposure_stream_name, outcome_stream_name, kinesis_client = None,
+                 max_queue_size: int = 10000, max_latency: float = 0.5, overflow_policy: str = POLICY_DROP,
+                 block_timeout: float = 0.05, max_retries: int = 3,
+                 max_batch_records: int = MAX_BATCH_RECORDS, max_batch_bytes: int = MAX_BATCH_BYTES):
+        super().__init__(exposure_stream_name, outcome_stream_name, kinesis_client)
+
+        if overflow_policy not in (BufferedKinesisTracker.POLICY_DROP, BufferedKinesisTracker.POLICY_BLOCK):
+            raise ValueError(f'Unsupported overflow policy {overflow_policy}')
+
+        self.max_latency = max_latency
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.max_retries = max_retries
+        self.max_batch_records = min(max_batch_records, MAX_BATCH_RECORDS)
+        self.max_batch_bytes = min(max_batch_bytes, MAX_BATCH_BYTES)
+
+        # Queue of (stream name, record) tuples
+        self._queue = queue.Queue(maxsize = max_queue_size)
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._closed = False
+
+        self._counters = {
+            'enqueued': 0,
+            'dropped': 0,
+            'sent': 0,
+            'failed': 0,
+            'retried': 0,
+            'batches': 0
+        }
+        self._flush_seconds_total = 0.0
+        self._flush_seconds_max = 0.0
+
+        atexit.register(self.flush)
+
+    def log_exposure(self, event):
+        self._enqueue(self.exposure_stream_name, event)
 
     def log_outcome(self, event):
-        user_id = event['attributes']['user_id']
-        experiment_name = event['attributes']['experiment']['name']
+        self._enqueue(self.outcome_stream_name, event)
+
+    def flush(self, timeout: float = 5):
+        """ Waits up to timeout seconds for queued events to be sent """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            self.__ensure_worker()
+            time.sleep(0.01)
+
+    def close(self, timeout: float = 5):
+        """ Flushes queued events, stops the worker and removes the exit hook """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        atexit.unregister(self.flush)
+
+        worker = self._worker
+        if worker is not None and worker.is_alive():
+            try:
+                self._queue.put(_STOP, timeout = timeout)
+            except queue.Full:
+                log.warning('BufferedKinesisTracker - queue still full at close; worker left to drain it')
+                return
+            worker.join(timeout)
+
+    def stats(self) -> Dict:
+        """ Returns queue depth, delivery counters and flush latency """
+        with self._lock:
+            stats = dict(self._counters)
+            batches = stats['batches']
+            stats['flush_latency_avg_ms'] = self._flush_seconds_total / batches * 1000 if batches else 0.0
+            stats['flush_latency_max_ms'] = self._flush_seconds_max * 1000
+        stats['queue_depth'] = self._queue.qsize()
+        return stats
+
+    def _enqueue(self, stream_name: str, event):
+        if self._closed:
+            self._kinesis.put_record(StreamName = stream_name, **self._create_record(event))
+            return
+
+        entry = (stream_name, self._create_record(event))
+        try:
+            if self.overflow_policy == BufferedKinesisTracker.POLICY_BLOCK:
+                self._queue.put(entry, timeout = self.block_timeout)
+            else:
+                self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self._counters['dropped'] += 1
+            log.warning('BufferedKinesisTracker - queue full; dropped event for stream %s', stream_name)
+            return
+
+        with self._lock:
+            self._counters['enqueued'] += 1
+
+        self.__ensure_worker()
+
+    def __ensure_worker(self):
+        """ Lazily (re)starts the worker so forked processes get their own thread """
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if not self._closed and (self._worker is None or not self._worker.is_alive()):
+                self._worker = threading.Thread(target=self.__run, name='kinesis-tracker', daemon=True)
+                self._worker.start()
+
+    def __run(self):
+        while True:
+            batch = self.__next_batch()
+            stop = batch[-1] is _STOP
+            try:
+                self.__send(batch[:-1] if stop else batch)
+            except Exception as e:
+                log.exception(f'BufferedKinesisTracker - unexpected error sending events: {e}')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def __next_batch(self) -> List[tuple]:
+        """ Blocks for the first event, then collects more until the batch is full or max_latency elapses """
+        batch = [self._queue.get()]
+        if batch[0] is _STOP:
+            return batch
+        batch_bytes = self.__record_size(batch[0][1])
+        deadline = time.monotonic() + self.max_latency
+
+        while len(batch) < self.max_batch_records:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout = remaining)
+            except queue.Empty:
+                break
+
+            batch.append(entry)
+            if entry is _STOP:
+                break
+            batch_bytes += self.__record_size(entry[1])
+            if batch_bytes >= self.max_batch_bytes:
+                break
+
+        return batch
+
+    def __send(self, batch: List[tuple]):
+        records_by_stream = {}
+        for stream_name, record in batch:
+            records_by_stream.setdefault(stream_name, []).append(record)
+
+        for stream_name, records in records_by_stream.items():
+            start = time.perf_counter()
+            for chunk in self.__chunk(records):
+                self.__put_records(stream_name, chunk)
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self._counters['batches'] += 1
+                self._flush_seconds_total += elapsed
+                self._flush_seconds_max = max(self._flush_seconds_max, elapsed)
+
+    def __chunk(self, records: List[Dict]):
+        """ Splits records so that each chunk stays within the PutRecords size limit """
+        chunk = []
+        chunk_bytes = 0
+        for record in records:
+            size = self.__record_size(record)
+            if chunk and (chunk_bytes + size > self.max_batch_bytes or len(chunk) >= self.max_batch_records):
+                yield chunk
+                chunk = []
+                chunk_bytes = 0
+            chunk.append(record)
+            chunk_bytes += size
+        if chunk:
+            yield chunk
+
+    def __put_records(self, stream_name: str, records: List[Dict]):
+        attempt = 0
+        while records:
+            try:
+                response = self._kinesis.put_records(StreamName = stream_name, Records = records)
+                failed = [record for record, result in zip(records, response['Records']) if result.get('ErrorCode')]
+            except Exception as e:
+                log.warning(f'BufferedKinesisTracker - PutRecords to {stream_name} failed: {e}')
+                failed = records
+
+            with self._lock:
+                self._counters['sent'] += len(records) - len(failed)
+
+            if not failed:
+                return
+
+            if attempt >= self.max_retries:
+                with self._lock:
+                    self._counters['failed'] += len(failed)
+                log.error(f'BufferedKinesisTracker - giving up on {len(failed)} records for {stream_name}')
+                return
+
+            attempt += 1
+            with self._lock:
+                self._counters['retried'] += len(failed)
+            time.sleep(min(0.1 * 2 ** attempt, 2))
+            records = failed
+
+    @staticmethod
+    def __record_size(record: Dict) -> int:
+        return len(record['Data']) + len(record['PartitionKey'].encode('utf-8'))
+
+class LocalKinesisStream:
+    """ In-memory stand-in for the Kinesis client for tests and local development
+
+    Implements put_record and put_records and keeps the records per stream. A
+    fail_every value makes every nth record of a PutRecords call fail with a
+    throughput error so that retry behavior can be exercised.
+    """
+
+    def __init__(self, fail_every: int = 0):
+        self.fail_every = fail_every
+        self.records: Dict[str, List[Dict]] = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._sequence = 0
+
+    def put_record(self, StreamName, Data, PartitionKey, **kwargs):
+        response = self.put_records(StreamName = StreamName, Records = [{'Data': Data, 'PartitionKey': PartitionKey}])
+        return response['Records'][0]
+
+    def put_records(self, StreamName, Records, **kwargs):
+        results = []
+        failed = 0
+        with self._lock:
+            self.calls += 1
+            for i, record in enumerate(Records, 1):
+                if self.fail_every and i % self.fail_every == 0:
+                    failed += 1
+                    results.append({'ErrorCode': 'ProvisionedThroughputExceededException', 'ErrorMessage': 'Rate exceeded'})
+                    continue
+
+                self._sequence += 1
+                self.records.setdefault(StreamName, []).append(record)
+                results.append({'SequenceNumber': str(self._sequence), 'ShardId': 'shardId-000000000000'})
+
+        return {'FailedRecordCount': failed, 'Records': results}
 
-        kinesis.put_record(
-            StreamName=self.outcome_stream_name,
-            Data=json.dumps(event, cls=CompatEncoder),
-            PartitionKey=f'{experiment_name}{user_id}'
-        )
+    def events(self, stream_name: str) -> List[Dict]:
+        """ Returns the decoded events written to a stream """
+        with self._lock:
+            return [json.loads(record['Data']) for record in self.records.get(stream_name, [])]
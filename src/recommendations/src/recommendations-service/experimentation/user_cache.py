@@ -0,0 +1,171 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import copy
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional
+from experimentation.caching import InvalidatableCache, SharedInvalidations, ratio
+
+log = logging.getLogger(__name__)
+
+def estimate_size(value: Any) -> int:
+    """ Returns a rough estimate of the memory used by a JSON-like value, in bytes """
+    if isinstance(value, str):
+        return 49 + len(value)
+    if isinstance(value, dict):
+        return 64 + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + 8 * len(value) + sum(estimate_size(v) for v in value)
+    return 32
+
+class UserResultCache(InvalidatableCache):
+    """ Memory-bounded LRU cache of recommendation results per user with a TTL
+
+    Entries are grouped by user so that everything cached for a user can be
+    dropped when something happens that should change their recommendations
+    (a purchase, a cart change or an experiment conversion). Entries are
+    evicted least recently used first once the estimated size of all cached
+    results exceeds max_bytes. Values are copied in and out of the cache.
+
+    Expired entries are kept for up to max_stale more seconds (memory permitting)
+    so they can be served as a fallback when recommendations cannot be generated.
+
+    With shared_invalidations, invalidations also reach the caches of the other
+    worker processes: an entry computed before its user was last invalidated is
+    treated as missing.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl: float = 60, max_stale: float = 600,
+                 shared_invalidations: Optional[SharedInvalidations] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.shared_invalidations = shared_invalidations
+
+        self._lock = threading.Lock()
+        # (user ID, key) -> (value, size, monotonic expiry time, monotonic time the value was computed)
+        self._entries: OrderedDict = OrderedDict()
+        # user ID -> keys cached for the user
+        self._keys_by_user: Dict[str, set] = {}
+        self._bytes = 0
+
+        self._counters = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'shared_invalidations': 0
+        }
+
+    def get(self, user_id: str, key: Hashable, allow_stale: bool = False) -> Optional[Any]:
+        """ Returns a copy of the cached value or None; allow_stale also returns recently expired values """
+        entry_key = (user_id, key)
+        now = time.monotonic()
+        invalidated_at = self.shared_invalidations.invalidated_at(user_id) if self.shared_invalidations else 0.0
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None and entry[2] + self.max_stale <= now:
+                self.__remove(entry_key)
+                entry = None
+            if entry is not None and entry[3] <= invalidated_at:
+                # Invalidated by another worker process
+                self.__remove(entry_key)
+                self._counters['shared_invalidations'] += 1
+                entry = None
+
+            if entry is None or (entry[2] <= now and not allow_stale):
+                self._counters['misses'] += 1
+                return None
+
+            self._entries.move_to_end(entry_key)
+            self._counters['hits' if entry[2] > now else 'stale_hits'] += 1
+            value = entry[0]
+
+        return copy.deepcopy(value)
+
+    def put(self, user_id: str, key: Hashable, value: Any, computed_at: float = None):
+        """ Caches a value; computed_at is the monotonic time its computation started (default now)
+
+        Passing the start time keeps a value computed while the user was invalidated out of the cache.
+        """
+        computed_at = time.monotonic() if computed_at is None else computed_at
+        if self.shared_invalidations and computed_at <= self.shared_invalidations.invalidated_at(user_id):
+            return
+
+        value = copy.deepcopy(value)
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        entry_key = (user_id, key)
+        with self._lock:
+            if entry_key in self._entries:
+                self.__remove(entry_key)
+
+            self._entries[entry_key] = (value, size, time.monotonic() + self.ttl, computed_at)
+            self._keys_by_user.setdefault(user_id, set()).add(key)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self.__remove(oldest)
+                self._counters['evictions'] += 1
+
+    def invalidate_user(self, user_id: str) -> int:
+        """ Drops all results cached for a user, in every worker process with shared_invalidations """
+        if self.shared_invalidations:
+            self.shared_invalidations.invalidate(user_id)
+        with self._lock:
+            keys = self._keys_by_user.get(user_id)
+            if not keys:
+                return 0
+            removed = len(keys)
+            for key in list(keys):
+                self.__remove((user_id, key))
+            self._counters['invalidations'] += removed
+
+        log.debug('UserResultCache - invalidated %d results for user %s', removed, user_id)
+        return removed
+
+    def invalidate(self, keys: Iterable[str] = None) -> int:
+        """ Drops results for the given user IDs (or for all users) """
+        if keys is not None:
+            return sum(self.invalidate_user(user_id) for user_id in keys)
+
+        if self.shared_invalidations:
+            self.shared_invalidations.invalidate()
+        with self._lock:
+            removed = len(self._entries)
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self._bytes = 0
+            self._counters['invalidations'] += removed
+        return removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._entries)
+            stats['users'] = len(self._keys_by_user)
+            stats['bytes'] = self._bytes
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = ratio(stats['hits'], lookups)
+        return stats
+
+    def __remove(self, entry_key):
+        """ Removes an entry; the caller must hold the lock """
+        _, size, _, _ = self._entries.pop(entry_key)
+        self._bytes -= size
+
+        user_id, key = entry_key
+        keys = self._keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user_id]
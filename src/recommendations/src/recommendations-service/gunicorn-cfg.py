@@ -0,0 +1,45 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import os
+import threading
+
+def cpu_count():
+    """ CPUs this container may run on (not all CPUs of the host) """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:80')
+
+# Requests mostly wait on Personalize, SSM and the other services, so each process serves
+# many requests concurrently with threads. gevent can be selected if it is installed.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('GUNICORN_WORKERS', cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 256))
+
+# Import the service once in the master so workers share its memory (numpy, the local
+# model and the service models) copy-on-write. AWS clients, HTTP sessions, executors and
+# background threads are all created on first use, in each worker, after the fork.
+preload_app = True
+
+def pre_fork(server, worker):
+    """ Warns if importing the service started threads; they do not survive the fork
+
+    A thread running in the master is missing from every worker, and any lock it held
+    when the worker was forked stays locked in that worker forever.
+    """
+    threads = [thread.name for thread in threading.enumerate() if thread is not threading.main_thread()]
+    if threads:
+        server.log.warning('Threads running in the master before forking a worker: %s', ', '.join(threads))
+
+# Keep connections from the load balancer open longer than its idle timeout (60s) so
+# it never reuses a connection that the worker is closing
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 75))
+
+accesslog = '-'
+loglevel = 'info'
+capture_output = True
+timeout = 60
+graceful_timeout = 30
@@ -0,0 +1,12 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Production entry point: gunicorn --config gunicorn-cfg.py wsgi:app
+import os
+
+from app import app, configure_logging, LoggingMiddleware
+
+configure_logging(debug = os.environ.get('DEBUG_LOGGING', 'false').lower() == 'true')
+
+if os.environ.get('LOG_REQUESTS', 'false').lower() == 'true':
+    app.wsgi_app = LoggingMiddleware(app.wsgi_app)
@@ -270,6 +270,8 @@ export const AnalyticsHandler = {
     },
 
     productAddedToCart(user, cart, product, quantity, feature, experimentCorrelationId) {
+        this.recordRecommendationsEvent(user, 'AddToCart');
+
         if (user) {
             record({
                 name: 'AddToCart',
@@ -529,6 +531,8 @@ export const AnalyticsHandler = {
     },
 
     productQuantityUpdatedInCart(user, cart, cartItem, change) {
+        this.recordRecommendationsEvent(user, 'UpdateQuantity');
+
         if (user && user.id) {
             record({
                 name: 'UpdateQuantity',
@@ -764,6 +768,8 @@ export const AnalyticsHandler = {
     },
 
     checkoutStarted(user, cart, cartQuantity, cartTotal) {
+        this.recordRecommendationsEvent(user, 'StartCheckout');
+
         if (user) {
             record({
                 name: 'StartCheckout',
@@ -851,6 +857,8 @@ export const AnalyticsHandler = {
     },
 
     orderCompleted(user, cart, order) {
+        this.recordRecommendationsEvent(user, 'Purchase');
+
         if (user) {
             record({
                 name: 'Purchase',
@@ -1044,6 +1052,18 @@ export const AnalyticsHandler = {
         }
     },
 
+    /*
+     * Tells the recommendations service about events that change a user's recommendations
+     * (e.g. through the purchased items filter) so it drops the results it cached for them.
+     */
+    recordRecommendationsEvent(user, eventType) {
+        const userID = user ? user.id : AmplifyStore.state.provisionalUserID;
+        if (userID) {
+            RecommendationsRepository.recordUserEvent(userID, eventType)
+                .catch(error => console.warn('Unable to send event to recommendations service', error));
+        }
+    },
+
     personalizeEventTrackerEnabled() {
         return import.meta.env.VITE_PERSONALIZE_TRACKING_ID && import.meta.env.VITE_PERSONALIZE_TRACKING_ID != 'NONE';
     },
@@ -11,6 +11,7 @@ const rerank = "/rerank"
 const chooseDiscounted = "/choose_discounted"
 const couponOffer = "/coupon_offer"
 const experimentOutcome = "/experiment/outcome"
+const events = "/events"
 
 export default {
     async getPopularProducts(userID, currentItemID, numResults, feature) {
@@ -119,5 +120,20 @@ export default {
         });
         const { body } = await restOperation.response;
         return body.json();
+    },
+    async recordUserEvent(userID, eventType) {
+        let payload = {
+            userID: userID,
+            eventType: eventType
+        }
+        const restOperation = post({
+            apiName: apiName,
+            path: events,
+            options: {
+                body: payload
+              }
+        });
+        const { body } = await restOperation.response;
+        return body.json();
     }
 }
\ No newline at end of file